@@ -72,6 +72,10 @@ DATA_FORMAT_GENERATE_EXPORT = [
     DATA_FORMAT_NEPTUNE,
     DATA_FORMAT_RUSPELL_CONFIG,
 ]
+DATA_FORMAT_WITH_SERVICE_PROFILE = [
+    DATA_FORMAT_GTFS,
+    DATA_FORMAT_NTFS,
+]
 
 DATA_TYPE_GEOGRAPHIC = 'geographic'
 DATA_TYPE_PUBLIC_TRANSPORT = 'public_transport'
@@ -38,10 +38,12 @@ from tartare.exceptions import IntegrityException, EntityNotFound
 
 class DataSourceContext:
     def __init__(self, data_source_id: str, gridfs_id: Optional[str],
-                 validity_period: Optional[ValidityPeriod] = None) -> None:
+                 validity_period: Optional[ValidityPeriod] = None, file_names: Optional[List[str]] = None) -> None:
         self.data_source_id = data_source_id
         self.gridfs_id = gridfs_id
         self.validity_period = validity_period
+        # members of the zip file of gridfs_id if known
+        self.file_names = file_names
 
     def __repr__(self) -> str:
         return str(vars(self))
@@ -156,13 +158,13 @@ class ContributorExportContext(Context):
 
     def add_contributor_data_source_context(self, contributor_id: str, data_source_id: str,
                                             validity_period: Optional[ValidityPeriod],
-                                            gridfs_id: Optional[str]) -> None:
+                                            gridfs_id: Optional[str], file_names: Optional[List[str]] = None) -> None:
         contributor_context = next((contributor_context for contributor_context in self.contributor_contexts
                                     if contributor_context.contributor.id == contributor_id), None)
         if contributor_context:
             contributor_context.data_source_contexts.append(
                 DataSourceContext(data_source_id=data_source_id,
-                                  gridfs_id=gridfs_id, validity_period=validity_period))
+                                  gridfs_id=gridfs_id, validity_period=validity_period, file_names=file_names))
 
     def fill_context(self, contributor: Contributor) -> None:
         self.add_contributor_context(contributor)
@@ -172,7 +174,7 @@ class ContributorExportContext(Context):
                 if data_source.export_data_source_id:
                     self.append_data_source_export(data_source, data_set)
                 self.add_contributor_data_source_context(contributor.id, data_source.id, data_set.validity_period,
-                                                         data_set.gridfs_id)
+                                                         data_set.gridfs_id, data_set.get_file_names())
             else:
                 self.add_contributor_data_source_context(contributor.id, data_source.id, None, None)
 
@@ -197,8 +199,9 @@ class ContributorExportContext(Context):
                     contributor = DataSource.get_contributor_of_data_source(config.id)
                     data_source = contributor.get_data_source(config.id)
                     self.add_contributor_context(contributor)
+                    data_set = data_source.get_last_data_set()
                     self.add_contributor_data_source_context(contributor.id, config.id, None,
-                                                             data_source.get_last_data_set().gridfs_id)
+                                                             data_set.gridfs_id, data_set.get_file_names())
 
     def __repr__(self) -> str:
         return str(vars(self))
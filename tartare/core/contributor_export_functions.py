@@ -28,20 +28,26 @@
 # www.navitia.io
 
 import logging
+import os
+import shutil
 import tempfile
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Tuple, Callable, Optional, Dict, Union, BinaryIO
+from urllib.parse import urlparse
 
-from typing import List
-
+from tartare import app
 from tartare.core.constants import DATA_FORMAT_GENERATE_EXPORT, \
-    DATA_FORMAT_GTFS
+    DATA_FORMAT_GTFS, JOB_STATUS_RUNNING, JOB_STATUS_DONE
 from tartare.core.context import ContributorExportContext
 from tartare.core.fetcher import FetcherManager
 from tartare.core.gridfs_handler import GridFsHandler
-from tartare.core.models import Contributor, DataSet
+from tartare.core.models import Contributor, DataSet, DataSource, FetchValidators, SharedFetch
 from tartare.core.validity_period_finder import ValidityPeriodFinder
 from tartare.exceptions import ParameterException, FetcherException, GuessFileNameFromUrlException, InvalidFile, \
-    RuntimeException
+    RuntimeException, FileNotModifiedException, SharedFetchPendingException
 
 logger = logging.getLogger(__name__)
 
@@ -75,50 +81,245 @@ def save_export(contributor: Contributor, context: ContributorExportContext) ->
         data_source = contributor.get_data_source(export_id)
         data_source.data_format = data_formats[0]
         data_source.service_id = service_ids[0]
-        data_set.validity_period = ValidityPeriodFinder.select_computer_and_find(
-            GridFsHandler().get_file_from_gridfs(gridfs_ids[0]), data_source.data_format)
+        with GridFsHandler().open_file_from_gridfs(gridfs_ids[0]) as export_file:
+            describe_data_set_file(data_set, export_file, data_source.data_format)
         data_source.add_data_set_and_update_owner(data_set, contributor)
         exports_ids.append(data_source.id)
     return exports_ids
 
 
-def fetch_datasets_and_return_updated_number(contributor: Contributor, data_source_to_fetch_id: str = None) -> int:
+def describe_data_set_file(data_set: DataSet, file: Union[str, BinaryIO], data_format: str) -> None:
+    data_set.index_zip_members(file)
+    data_set.validity_period = ValidityPeriodFinder.select_computer_and_find(file, data_format,
+                                                                             data_set.get_file_names())
+    data_set.compute_service_profile(file, data_format)
+
+
+class DownloadedFile(object):
+    """
+    file downloaded in full_file_name, or already stored in GridFS with gridfs_id (file of a shared fetch)
+    """
+    def __init__(self, full_file_name: Optional[str], file_name: str, digest: Dict[str, str],
+                 fetch_validators: Optional[FetchValidators], gridfs_id: str = None) -> None:
+        self.full_file_name = full_file_name
+        self.file_name = file_name
+        self.digest = digest
+        self.fetch_validators = fetch_validators
+        self.gridfs_id = gridfs_id
+
+
+def fetch_datasets_and_return_updated_number(contributor: Contributor, data_source_to_fetch_id: str = None,
+                                             fetch_cycle_id: str = None, wait_for_shared_fetch: bool = False) -> int:
+    """
+    :param wait_for_shared_fetch: see reuse_shared_fetch
+    """
+    data_sources = [data_source for data_source in contributor.data_sources
+                    if (not data_source_to_fetch_id or data_source_to_fetch_id == data_source.id) and
+                    data_source.is_auto() and data_source.input.url]
+    if app.config['FETCH_POOL_SIZE'] > 1 and len(data_sources) > 1:
+        return fetch_concurrently_and_save_datasets(contributor, data_sources, fetch_cycle_id)
     nb_updated_datasets = 0
-    for data_source in contributor.data_sources:
-        if (not data_source_to_fetch_id or data_source_to_fetch_id == data_source.id) and \
-                data_source.is_auto() and data_source.input.url:
-            nb_updated_datasets += 1 if fetch_and_save_dataset(contributor, data_source.id) else 0
+    for data_source in data_sources:
+        nb_updated_datasets += 1 if fetch_and_save_dataset(contributor, data_source.id, fetch_cycle_id,
+                                                           wait_for_shared_fetch) else 0
     return nb_updated_datasets
 
 
-def fetch_and_save_dataset(contributor: Contributor, data_source_id: str) -> bool:
-    data_source = contributor.get_data_source(data_source_id)
+def fetch_concurrently_and_save_datasets(contributor: Contributor, data_sources: List[DataSource],
+                                         fetch_cycle_id: str = None) -> int:
+    """
+    downloads are done concurrently in a bounded thread pool (with a limited number of downloads by host),
+    database writes are then applied from the calling thread in data sources order
+    if some data sources fail, the other ones are still saved, every failure is logged and the first error is raised
+    afterwards
+    only used when several data sources are fetched by a single export (manual contributor export), an automatic
+    update launches an export by data source
+    """
+    host_semaphores = {urlparse(data_source.input.url).hostname:
+                       threading.BoundedSemaphore(app.config['FETCH_MAX_CONCURRENT_BY_HOST'])
+                       for data_source in data_sources}
+
+    def download_with_host_limit(data_source: DataSource, destination_path: str) -> DownloadedFile:
+        with host_semaphores[urlparse(data_source.input.url).hostname]:
+            return download_dataset(data_source, destination_path)
+
+    shared_fetches = {}  # type: Dict[str, Optional[SharedFetch]]
+    for data_source in data_sources:
+        logger.info("fetching data from url {}".format(data_source.input.url))
+        data_source.starts_fetch(contributor)
+        shared_fetches[data_source.id] = join_shared_fetch(data_source, fetch_cycle_id)
+    nb_updated_datasets = 0
+    errors = []  # type: List[Tuple[DataSource, Exception]]
+    with tempfile.TemporaryDirectory() as tmp_dir_name, \
+            ThreadPoolExecutor(max_workers=app.config['FETCH_POOL_SIZE']) as executor:
+        downloads = []  # type: List[Tuple[DataSource, Callable[[], DownloadedFile]]]
+        for data_source in data_sources:
+            destination_path = os.path.join(tmp_dir_name, data_source.id)
+            os.mkdir(destination_path)
+            shared_fetch = shared_fetches[data_source.id]
+            if shared_fetch and not shared_fetch.owned:
+                # reusing the shared file accesses the database, it is done from the calling thread (without waiting
+                # for it, an unfinished shared download is done again)
+                downloads.append((data_source, partial(reuse_shared_fetch, data_source, shared_fetch,
+                                                       destination_path)))
+            else:
+                downloads.append((data_source, executor.submit(download_with_host_limit, data_source,
+                                                               destination_path).result))
+        for data_source, download in downloads:
+            try:
+                nb_updated_datasets += 1 if save_downloaded_dataset(contributor, data_source, download,
+                                                                    shared_fetches[data_source.id]) else 0
+            except Exception as e:
+                logger.exception('fetching data source {} of contributor {} failed: {}'.format(
+                    data_source.id, contributor.id, str(e)))
+                errors.append((data_source, e))
+    if len(errors) > 1:
+        logger.error('{} data sources of contributor {} failed: {}'.format(
+            len(errors), contributor.id, ', '.join('{} ({})'.format(data_source.id, str(e))
+                                                   for data_source, e in errors)))
+    if errors:
+        raise errors[0][1]
+    return nb_updated_datasets
+
+
+def join_shared_fetch(data_source: DataSource, fetch_cycle_id: str = None) -> Optional[SharedFetch]:
+    """
+    data sources fetching the same url with the same credentials during a cycle share a single download:
+    the first one to claim it downloads the file, the other ones reuse it (see reuse_shared_fetch)
+    """
+    if not fetch_cycle_id:
+        return None
+    shared_fetch = SharedFetch.from_cycle(fetch_cycle_id, FetcherManager.get_fetch_key(data_source.input.url,
+                                                                                        data_source.input.options))
+    shared_fetch.claim()
+    return shared_fetch
+
+
+def check_downloaded_file(data_source: DataSource, full_file_name: str) -> None:
+    if data_source.data_format == DATA_FORMAT_GTFS and not zipfile.is_zipfile(full_file_name):
+        raise InvalidFile('downloaded file from url {} is not a zip file'.format(data_source.input.url))
+
+
+def download_dataset(data_source: DataSource, destination_path: str) -> DownloadedFile:
+    """
+    network part of the fetch, it does not access the database so that it can be run concurrently
+    """
     url = data_source.input.url
-    logger.info("fetching data from url {}".format(url))
+    last_data_set = data_source.get_last_data_set_if_exists()
+    # conditional fetch only makes sense when an unchanged file is skipped (see save_downloaded_dataset)
+    validators = last_data_set.fetch_validators if last_data_set and \
+        data_source.data_format in DATA_FORMAT_GENERATE_EXPORT else None
+    fetcher = FetcherManager.select_from_url(url, os.path.join(app.config['FETCH_PARTIAL_DOWNLOADS_DIR'],
+                                                               data_source.id))
+    dest_full_file_name, expected_file_name = fetcher.fetch(url, destination_path, options=data_source.input.options,
+                                                            expected_filename=data_source.input.expected_file_name,
+                                                            validators=validators)
+    check_downloaded_file(data_source, dest_full_file_name)
+    return DownloadedFile(dest_full_file_name, expected_file_name, fetcher.digest, fetcher.fetch_validators)
+
+
+def reuse_shared_fetch(data_source: DataSource, shared_fetch: SharedFetch, destination_path: str,
+                       wait_for_shared_fetch: bool = False) -> DownloadedFile:
+    """
+    reuses the file stored by the data source owning the shared fetch instead of downloading it again,
+    the data source downloads it itself if the shared download failed
+    :param wait_for_shared_fetch: if the shared download is still running, raises SharedFetchPendingException for the
+    task to be retried later (without holding a worker), else the data source downloads the file itself
+    """
+    current_shared_fetch = SharedFetch.get(shared_fetch.id)
+    if wait_for_shared_fetch and current_shared_fetch and current_shared_fetch.state == JOB_STATUS_RUNNING:
+        raise SharedFetchPendingException('shared fetch {} of url {} is running'.format(shared_fetch.id,
+                                                                                        data_source.input.url))
+    if not current_shared_fetch or current_shared_fetch.state != JOB_STATUS_DONE:
+        logger.debug('shared fetch {} is not available, downloading url {}'.format(shared_fetch.id,
+                                                                                    data_source.input.url))
+        return download_dataset(data_source, destination_path)
+    last_data_set = data_source.get_last_data_set_if_exists()
+    if last_data_set and data_source.data_format in DATA_FORMAT_GENERATE_EXPORT and \
+            last_data_set.is_identical_to(current_shared_fetch.digest):
+        raise FileNotModifiedException('shared file of url {} is identical to the last data set of data source {}'
+                                       .format(data_source.input.url, data_source.id))
+    file_name = data_source.input.expected_file_name or current_shared_fetch.file_name
+    if file_name == current_shared_fetch.file_name:
+        # the new data set references the stored file (see save_dataset)
+        return DownloadedFile(None, file_name, current_shared_fetch.digest, current_shared_fetch.fetch_validators,
+                              gridfs_id=current_shared_fetch.gridfs_id)
+    # the file is stored again under its expected name
+    full_file_name = os.path.join(destination_path, file_name)
+    with open(full_file_name, 'wb') as out_file:
+        shutil.copyfileobj(GridFsHandler().get_file_from_gridfs(current_shared_fetch.gridfs_id), out_file)
+    check_downloaded_file(data_source, full_file_name)
+    return DownloadedFile(full_file_name, file_name, current_shared_fetch.digest,
+                          current_shared_fetch.fetch_validators)
+
+
+def save_downloaded_dataset(contributor: Contributor, data_source: DataSource,
+                            download: Callable[[], DownloadedFile], shared_fetch: SharedFetch = None) -> bool:
+    """
+    when the data source owns the shared fetch, its resulting file is made available to the other data sources
+    """
+    owns_shared_fetch = shared_fetch is not None and shared_fetch.owned
+    try:
+        updated = save_dataset(contributor, data_source, download)
+    except Exception:
+        if owns_shared_fetch:
+            shared_fetch.fail()
+        raise
+    if owns_shared_fetch:
+        last_data_set = data_source.get_last_data_set_if_exists()
+        if last_data_set:
+            shared_fetch.complete(last_data_set)
+        else:
+            shared_fetch.fail()
+    return updated
+
+
+def save_dataset(contributor: Contributor, data_source: DataSource, download: Callable[[], DownloadedFile]) -> bool:
+    url = data_source.input.url
+    try:
+        downloaded_file = download()
+    except FileNotModifiedException:
+        logger.debug('file from url {} for contributor {} has not been modified since last fetch, skipping'
+                     .format(url, contributor.id))
+        data_source.fetch_unchanged(contributor)
+        return False
+    except (FetcherException, GuessFileNameFromUrlException, ParameterException, InvalidFile) as e:
+        data_source.fetch_fails(contributor)
+        raise e
+
+    if data_source.data_format in DATA_FORMAT_GENERATE_EXPORT:
+        last_data_set = data_source.get_last_data_set_if_exists()
+        if last_data_set and last_data_set.is_identical_to(downloaded_file.digest):
+            logger.debug('fetched file {} for contributor {} has not changed since last fetch, skipping'
+                         .format(downloaded_file.file_name, contributor.id))
+            # validators may have changed for identical content, keep the new ones for next conditional fetch
+            last_data_set.fetch_validators = downloaded_file.fetch_validators
+            data_source.fetch_unchanged(contributor)
+            return False
+    logger.debug('Add DataSet object for contributor: {}, data_source: {}'.format(
+        contributor.id, data_source.id
+    ))
+    data_set = DataSet(fetch_validators=downloaded_file.fetch_validators)
+    if downloaded_file.gridfs_id:
+        with GridFsHandler().open_file_from_gridfs(downloaded_file.gridfs_id) as file:
+            describe_data_set_file(data_set, file, data_source.data_format)
+        data_set.reference_file(downloaded_file.gridfs_id)
+    else:
+        describe_data_set_file(data_set, downloaded_file.full_file_name, data_source.data_format)
+        data_set.add_file_from_path(downloaded_file.full_file_name, downloaded_file.file_name, downloaded_file.digest)
+    data_source.add_data_set_and_update_owner(data_set, contributor)
+    return data_source.data_format in DATA_FORMAT_GENERATE_EXPORT
+
+
+def fetch_and_save_dataset(contributor: Contributor, data_source_id: str, fetch_cycle_id: str = None,
+                           wait_for_shared_fetch: bool = False) -> bool:
+    data_source = contributor.get_data_source(data_source_id)
+    logger.info("fetching data from url {}".format(data_source.input.url))
     data_source.starts_fetch(contributor)
+    shared_fetch = join_shared_fetch(data_source, fetch_cycle_id)
     with tempfile.TemporaryDirectory() as tmp_dir_name:
-        last_data_set = data_source.get_last_data_set_if_exists()
-        try:
-            fetcher = FetcherManager.select_from_url(url)
-            dest_full_file_name, expected_file_name = fetcher.fetch(url, tmp_dir_name, options=data_source.input.options,
-                                                                    expected_filename=data_source.input.expected_file_name)
-            if data_source.data_format == DATA_FORMAT_GTFS and not zipfile.is_zipfile(dest_full_file_name):
-                raise InvalidFile('downloaded file from url {} is not a zip file'.format(url))
-        except (FetcherException, GuessFileNameFromUrlException, ParameterException, InvalidFile) as e:
-            data_source.fetch_fails(contributor)
-            raise e
-
-        if data_source.data_format in DATA_FORMAT_GENERATE_EXPORT:
-            if last_data_set and last_data_set.is_identical_to(dest_full_file_name):
-                logger.debug('fetched file {} for contributor {} has not changed since last fetch, skipping'
-                             .format(expected_file_name, contributor.id))
-                data_source.fetch_unchanged(contributor)
-                return False
-        logger.debug('Add DataSet object for contributor: {}, data_source: {}'.format(
-            contributor.id, data_source.id
-        ))
-        validity_period = ValidityPeriodFinder.select_computer_and_find(dest_full_file_name, data_source.data_format)
-        data_set = DataSet(validity_period=validity_period)
-        data_set.add_file_from_path(dest_full_file_name, expected_file_name)
-        data_source.add_data_set_and_update_owner(data_set, contributor)
-        return data_source.data_format in DATA_FORMAT_GENERATE_EXPORT
+        if shared_fetch and not shared_fetch.owned:
+            download = partial(reuse_shared_fetch, data_source, shared_fetch, tmp_dir_name, wait_for_shared_fetch)
+        else:
+            download = partial(download_dataset, data_source, tmp_dir_name)
+        return save_downloaded_dataset(contributor, data_source, download, shared_fetch)
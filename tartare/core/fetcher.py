@@ -27,44 +27,154 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 import ftplib
+import hashlib
+import json
 import logging
 import os
 import re
 import shutil
+import time
 import urllib.request
 from abc import ABCMeta, abstractmethod
-from http.client import HTTPResponse
-from typing import Tuple, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Tuple, Optional, Dict, Mapping, Iterator
 from urllib.error import URLError
 from urllib.parse import urlparse, urlunparse, ParseResult
 
-from requests import HTTPError
+import requests
 
-from tartare.core.models import PlatformOptions
-from tartare.exceptions import ParameterException, FetcherException, GuessFileNameFromUrlException
+from tartare import app
+from tartare.core import http_session
+from tartare.core.models import PlatformOptions, FetchValidators, MongoFetchValidatorsSchema
+from tartare.exceptions import ParameterException, FetcherException, GuessFileNameFromUrlException, \
+    FileNotModifiedException
+from tartare.helper import DigestStream
 
 logger = logging.getLogger(__name__)
 
 http_scheme_start = 'http://'
 https_scheme_start = 'https://'
 ftp_scheme_start = 'ftp://'
+default_ports = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+class GuessedFileNameCache(object):
+    """
+    file names guessed from urls, kept FETCH_GUESSED_FILE_NAME_TTL seconds by worker
+    only names are kept: files are always fetched from the url itself as redirection targets may expire
+    an entry is invalidated when a fetch from its url fails, expired entries are removed on each access
+    """
+
+    def __init__(self) -> None:
+        self.entries = OrderedDict()  # type: OrderedDict[str, Tuple[str, float]]
+
+    def evict_expired(self) -> None:
+        # entries are ordered by insertion time
+        expired_before = time.monotonic() - app.config['FETCH_GUESSED_FILE_NAME_TTL']
+        while self.entries and next(iter(self.entries.values()))[1] < expired_before:
+            self.entries.popitem(last=False)
+
+    def get(self, url: str) -> Optional[str]:
+        self.evict_expired()
+        entry = self.entries.get(url)
+        return entry[0] if entry else None
+
+    def set(self, url: str, file_name: str) -> None:
+        self.evict_expired()
+        self.entries.pop(url, None)
+        self.entries[url] = (file_name, time.monotonic())
+
+    def invalidate(self, url: str) -> None:
+        self.entries.pop(url, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+guessed_file_names = GuessedFileNameCache()
+
+
+class PartialDownload(object):
+    """
+    file being downloaded, kept with the validators of the remote file in a scratch directory
+    so that a download interrupted by a network error can be resumed by the next fetch
+    without scratch directory, the download is done directly into the destination file and cannot be resumed
+    """
+
+    def __init__(self, dest_full_file_name: str, scratch_path: str = None) -> None:
+        self.dest_full_file_name = dest_full_file_name
+        self.scratch_path = scratch_path
+        self.file_name = os.path.join(scratch_path, os.path.basename(dest_full_file_name) + '.part') \
+            if scratch_path else dest_full_file_name
+        self.validators_file_name = self.file_name + '.json'
+
+    def get_resume_offset(self) -> int:
+        return os.path.getsize(self.file_name) if self.scratch_path and os.path.isfile(self.file_name) else 0
+
+    def get_validators(self) -> Optional[FetchValidators]:
+        if not self.scratch_path or not os.path.isfile(self.validators_file_name):
+            return None
+        with open(self.validators_file_name) as validators_file:
+            return MongoFetchValidatorsSchema(strict=True).load(json.load(validators_file)).data
+
+    @contextmanager
+    def open(self, offset: int = 0, validators: FetchValidators = None) -> Iterator[DigestStream]:
+        """
+        :param offset: size of the already downloaded content to keep, it is hashed before writing the remaining one
+        :param validators: validators of the remote file, checked before resuming the download
+        """
+        if self.scratch_path:
+            os.makedirs(self.scratch_path, exist_ok=True)
+            with open(self.validators_file_name, 'w') as validators_file:
+                json.dump(MongoFetchValidatorsSchema().dump(validators).data if validators else {}, validators_file)
+        with open(self.file_name, 'r+b' if offset else 'wb') as out_file:
+            digest_stream = DigestStream(out_file)
+            if offset:
+                out_file.truncate(offset)
+                for _ in iter(lambda: digest_stream.read(DigestStream.chunk_size), b''):
+                    pass
+            yield digest_stream
+
+    def complete(self) -> None:
+        if self.scratch_path:
+            shutil.move(self.file_name, self.dest_full_file_name)
+            # also removes partial downloads of previous file names of the data source
+            shutil.rmtree(self.scratch_path, ignore_errors=True)
+
+    def discard(self) -> None:
+        if self.scratch_path:
+            shutil.rmtree(self.scratch_path, ignore_errors=True)
 
 
 class AbstractFetcher(metaclass=ABCMeta):
+    def __init__(self, scratch_path: str = None) -> None:
+        # directory where partial downloads are kept to be resumed
+        self.scratch_path = scratch_path
+        # validators sent back by the server during the last fetch, to be kept for the next conditional fetch
+        self.fetch_validators = None  # type: Optional[FetchValidators]
+        # md5 and sha256 of the last fetched file, computed while writing it
+        self.digest = {}  # type: Dict[str, str]
+
     @abstractmethod
-    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None) -> Tuple[str, str]:
+    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None,
+              validators: FetchValidators = None) -> Tuple[str, str]:
         """
         :param url: url to fetch
         :param destination_path: the existing directory to use as destination path
         :param options: contains informations about authentication
+        :param validators: validators of the previous fetch used to make a conditional request
         :return: tuple(dest_full_file_name, expected_file_name) where
           - dest_full_file_name is full destination file name (/tmp/tmp123/config.json)
           - expected_file_name is destination file name (config.json)
+        :raise FileNotModifiedException: if the server tells the file has not changed since the previous fetch
         """
         pass
 
     @classmethod
-    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None) -> None:
+    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None,
+                                          validators: FetchValidators = None, scratch_path: str = None) \
+            -> Tuple[Optional[FetchValidators], Dict[str, str]]:
         pass
 
     @classmethod
@@ -88,29 +198,19 @@ class AbstractFetcher(metaclass=ABCMeta):
             return url, username, password, parsed
 
     @classmethod
-    def fetch_to_target(cls, url: str, dest_full_file_name: str) -> None:
+    def fetch_to_target(cls, url: str, dest_full_file_name: str) -> Tuple[Optional[FetchValidators], Dict[str, str]]:
         try:
-            # spoofing user-agent, see https://docs.python.org/3.4/library/urllib.request.html#urllib.request.Request
-            request = urllib.request.Request(url, headers={
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-            })
-            opener = urllib.request.build_opener()
-            urllib.request.install_opener(opener)
-            with urllib.request.urlopen(request) as response, open(dest_full_file_name, 'wb') as out_file:
+            with urllib.request.urlopen(url) as response, open(dest_full_file_name, 'wb') as out_file:
+                digest_stream = DigestStream(out_file)
                 # from mypy: Argument 1 to "copyfileobj" has incompatible type "Union[HTTPResponse, BinaryIO]";
                 # expected "IO[bytes]". It should be fixed in mypy 0.620
-                shutil.copyfileobj(response, out_file)  # type: ignore
-        except (HTTPError, URLError) as e:
+                shutil.copyfileobj(response, digest_stream)  # type: ignore
+                return None, digest_stream.get_digest()
+        except URLError as e:
             raise FetcherException('error during download of file: {}'.format(str(e)))
 
     @classmethod
-    def guess_file_name_from_url(cls, url: str) -> str:
-        class NoRedirection(urllib.request.HTTPErrorProcessor):
-            def http_response(self, request: urllib.request.Request, response: HTTPResponse) -> HTTPResponse:  # type: ignore
-                return response
-
-            https_response = http_response  # type: ignore
-
+    def guess_file_name_from_url_without_cache(cls, url: str) -> str:
         if FetcherManager.http_matches_url(url) or FetcherManager.ftp_matches_url(url):
             parsed = urlparse(url)
             if parsed.path:
@@ -118,23 +218,32 @@ class AbstractFetcher(metaclass=ABCMeta):
                 filename, file_extension = os.path.splitext(last_part)
                 if filename and file_extension and not parsed.query:
                     return last_part
-            request = urllib.request.Request(method='HEAD', url=url)
-            response = urllib.request.build_opener(NoRedirection).open(request)
-
-            if isinstance(response, HTTPResponse):
-                if response.status == 302:
-                    location = response.getheader('Location')
-                    if location:
-                        return cls.guess_file_name_from_url(location)
-                elif response.status == 200:
-                    content_disposition = response.getheader('Content-Disposition')
-                    if content_disposition and 'filename=' in content_disposition:
-                        match = re.search(r"attachment; filename=(.+)", content_disposition)
-                        if match and len(match.groups()) == 1:
-                            return match.groups()[0]
+        if FetcherManager.http_matches_url(url):
+            response = http_session.head(url, allow_redirects=False)
+            if response.status_code == 302:
+                location = response.headers.get('Location')
+                if location:
+                    return cls.guess_file_name_from_url_without_cache(location)
+            elif response.status_code == 200:
+                content_disposition = response.headers.get('Content-Disposition')
+                if content_disposition and 'filename=' in content_disposition:
+                    match = re.search(r"attachment; filename=(.+)", content_disposition)
+                    if match and len(match.groups()) == 1:
+                        return match.groups()[0]
 
         raise GuessFileNameFromUrlException('unable to guess file name from url {}'.format(url))
 
+    @classmethod
+    def guess_file_name_from_url(cls, url: str) -> str:
+        """
+        file names are cached to avoid HEAD requests on each fetch of the same url
+        """
+        file_name = guessed_file_names.get(url)
+        if not file_name:
+            file_name = cls.guess_file_name_from_url_without_cache(url)
+            guessed_file_names.set(url, file_name)
+        return file_name
+
 
 class FetcherManager:
     @classmethod
@@ -146,55 +255,236 @@ class FetcherManager:
         return url.startswith(ftp_scheme_start)
 
     @classmethod
-    def select_from_url(cls, url: str) -> AbstractFetcher:
+    def select_from_url(cls, url: str, scratch_path: str = None) -> AbstractFetcher:
         if cls.http_matches_url(url):
-            return HttpFetcher()
+            return HttpFetcher(scratch_path)
         elif cls.ftp_matches_url(url):
-            return FtpFetcher()
+            return FtpFetcher(scratch_path)
         raise ParameterException('url "{}" is not supported to fetch data from'.format(url))
 
+    @classmethod
+    def get_fetch_key(cls, url: str, options: PlatformOptions = None) -> str:
+        """
+        identifies what is downloaded from an url: urls differing only by scheme/host case, default port or fragment
+        share the same key if they are fetched with the same credentials (hashed so that they are not stored)
+        """
+        url, username, password, _ = AbstractFetcher.get_url_and_credentials(url, options)
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        netloc = (parsed.hostname or '').lower()
+        if parsed.port and parsed.port != default_ports.get(scheme):
+            netloc = '{}:{}'.format(netloc, parsed.port)
+        normalized_url = urlunparse((scheme, netloc, parsed.path or '/', parsed.params, parsed.query, ''))
+        return hashlib.sha256('\n'.join([normalized_url, username or '', password or '']).encode()).hexdigest()
+
 
 class FtpFetcher(AbstractFetcher):
-    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None) -> Tuple[str, str]:
+    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None,
+              validators: FetchValidators = None) -> Tuple[str, str]:
         expected_file_name = self.guess_file_name_from_url(url)
         dest_full_file_name = os.path.join(destination_path, expected_file_name)
-        self.check_authent_and_fetch_to_target(url, dest_full_file_name, options)
+        try:
+            self.fetch_validators, self.digest = self.check_authent_and_fetch_to_target(
+                url, dest_full_file_name, options, validators, self.scratch_path)
+        except FetcherException:
+            guessed_file_names.invalidate(url)
+            raise
         return dest_full_file_name, expected_file_name
 
     @classmethod
-    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None) -> None:
+    def get_validators_from_session(cls, session: ftplib.FTP, path: str) -> FetchValidators:
+        validators = FetchValidators()
+        try:
+            facts = next((facts for name, facts in session.mlsd(os.path.dirname(path), ['size', 'modify'])
+                          if name == os.path.basename(path)), {})  # type: Dict[str, str]
+            if 'size' in facts and 'modify' in facts:
+                validators.content_length = int(facts['size'])
+                validators.last_modified = facts['modify']
+                return validators
+        except ftplib.error_perm:
+            # MLSD is not supported by all servers
+            pass
+        try:
+            session.voidcmd('TYPE I')
+            validators.content_length = int(session.size(path))
+            validators.last_modified = session.sendcmd('MDTM {}'.format(path))[4:].strip()
+        except ftplib.error_perm:
+            # SIZE and MDTM are extensions that may not be supported by the server
+            pass
+        return validators
+
+    @classmethod
+    def can_identify_file(cls, remote_validators: FetchValidators) -> bool:
+        return bool(remote_validators.content_length and remote_validators.last_modified)
+
+    @classmethod
+    def is_same_file(cls, remote_validators: FetchValidators, validators: Optional[FetchValidators]) -> bool:
+        return bool(validators and cls.can_identify_file(remote_validators) and
+                    validators.content_length == remote_validators.content_length and
+                    validators.last_modified == remote_validators.last_modified)
+
+    @classmethod
+    def check_not_modified(cls, url: str, remote_validators: FetchValidators,
+                           validators: Optional[FetchValidators]) -> None:
+        if cls.is_same_file(remote_validators, validators):
+            raise FileNotModifiedException('file from url {} has not been modified since last fetch'.format(url))
+
+    @classmethod
+    def retrieve_from_session(cls, session: ftplib.FTP, url: str, path: str, remote_validators: FetchValidators,
+                              dest_full_file_name: str, scratch_path: str = None) \
+            -> Tuple[Optional[FetchValidators], Dict[str, str]]:
+        partial_download = PartialDownload(dest_full_file_name, scratch_path)
+        offset = partial_download.get_resume_offset()
+        # resuming is only safe if the remote file is still the one partially downloaded
+        if not cls.is_same_file(remote_validators, partial_download.get_validators()) or \
+                offset >= remote_validators.content_length:
+            offset = 0
+        if offset:
+            logger.info('resuming download of {} from byte {}'.format(url, offset))
+        with partial_download.open(offset, remote_validators) as digest_stream:
+            session.retrbinary('RETR {}'.format(path), digest_stream.write, rest=offset or None)  # type: ignore
+            session.quit()
+        partial_download.complete()
+        return remote_validators if cls.can_identify_file(remote_validators) else None, digest_stream.get_digest()
+
+    @classmethod
+    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None,
+                                          validators: FetchValidators = None, scratch_path: str = None) \
+            -> Tuple[Optional[FetchValidators], Dict[str, str]]:
+        """
+        the size and modification time of the remote file are checked first so that an unchanged file is not
+        transferred (raising FileNotModifiedException)
+        """
         url, username, password, parsed = cls.get_url_and_credentials(url, options)
-        if username and password and parsed:
-            try:
-                session = ftplib.FTP(parsed.hostname, username, password)
-                with open(dest_full_file_name, 'wb') as dest_file:
-                    session.retrbinary('RETR {expected_filename}'.format(expected_filename=parsed.path), dest_file.write)  # type: ignore
-                    session.quit()
-            except Exception as e:
-                raise FetcherException('error during download of file: {}'.format(str(e)))
-        else:
-            cls.fetch_to_target(url, dest_full_file_name)
+        if not (username and password and parsed):
+            # anonymous login
+            parsed, username, password = urlparse(url), '', ''
+        try:
+            # validators are checked and the file retrieved in the same session
+            session = ftplib.FTP()
+            session.connect(parsed.hostname, parsed.port or 0)
+            session.login(username, password)
+            remote_validators = cls.get_validators_from_session(session, parsed.path)
+            cls.check_not_modified(url, remote_validators, validators)
+            return cls.retrieve_from_session(session, url, parsed.path, remote_validators, dest_full_file_name,
+                                             scratch_path)
+        except FileNotModifiedException:
+            session.quit()
+            raise
+        except Exception as e:
+            raise FetcherException('error during download of file: {}'.format(str(e)))
 
 
 class HttpFetcher(AbstractFetcher):
     @classmethod
-    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None) -> None:
-        url, username, password, parsed = cls.get_url_and_credentials(url, options)
-        if username and password:
-            try:
-                password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-                top_level = '{}://{}'.format(parsed.scheme, parsed.hostname)
-                password_manager.add_password(None, top_level, username, password)
-                opener = urllib.request.build_opener(urllib.request.HTTPBasicAuthHandler(password_manager))
-                with opener.open(url) as response, open(dest_full_file_name, 'wb') as out_file:
-                    shutil.copyfileobj(response, out_file)  # type: ignore
-            except urllib.error.HTTPError as e:
-                raise FetcherException('error during download of file: {}'.format(str(e)))
+    def get_conditional_headers(cls, validators: Optional[FetchValidators]) -> Dict[str, str]:
+        headers = {}
+        if validators:
+            if validators.etag:
+                headers['If-None-Match'] = validators.etag
+            if validators.last_modified:
+                headers['If-Modified-Since'] = validators.last_modified
+        return headers
+
+    @classmethod
+    def get_validators_from_headers(cls, headers: Mapping[str, str]) -> Optional[FetchValidators]:
+        content_length = str(headers.get('Content-Length', ''))
+        validators = FetchValidators(
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            content_length=int(content_length) if content_length.isdigit() else None
+        )
+        return validators if validators.can_be_used_for_conditional_fetch() else None
+
+    @classmethod
+    def get_resumed_total_length(cls, response: requests.Response, offset: int) -> Optional[int]:
+        """
+        :return: total length of the file if the response is the expected partial content starting at offset
+        """
+        match = re.match(r'bytes (\d+)-\d+/(\d+)', response.headers.get('Content-Range', ''))
+        if response.status_code != 206 or not match or int(match.group(1)) != offset:
+            return None
+        return int(match.group(2))
+
+    @classmethod
+    def fetch_to_target(cls, url: str, dest_full_file_name: str, *, validators: FetchValidators = None,
+                        auth: Tuple[str, str] = None, scratch_path: str = None) \
+            -> Tuple[Optional[FetchValidators], Dict[str, str]]:
+        # spoofing user-agent as some servers refuse unknown clients
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
+        }
+        headers.update(cls.get_conditional_headers(validators))
+        partial_download = PartialDownload(dest_full_file_name, scratch_path)
+        offset = partial_download.get_resume_offset()
+        partial_validators = partial_download.get_validators()
+        if offset and partial_validators and partial_validators.can_be_used_for_conditional_fetch():
+            # the server only sends the remaining bytes if the file has not changed, the whole file otherwise
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = partial_validators.etag or partial_validators.last_modified
         else:
-            cls.fetch_to_target(url, dest_full_file_name)
+            offset = 0
+        restart = False
+        try:
+            with http_session.request('GET', url, headers=headers, auth=auth, stream=True) as response:
+                if response.status_code == 304:
+                    partial_download.discard()
+                    raise FileNotModifiedException(
+                        'file from url {} has not been modified since last fetch'.format(url))
+                if response.status_code == 416 and offset:
+                    # the requested range does not fit the remote file anymore
+                    partial_download.discard()
+                    logger.warning('cannot resume download of {}, fetching the whole file again'.format(url))
+                    restart = True
+                elif response.status_code >= 400:
+                    raise FetcherException('error during download of file: HTTP Error {}: {}'.format(
+                        response.status_code, response.reason))
+                else:
+                    response_validators = cls.get_validators_from_headers(response.headers)
+                    total_length = cls.get_resumed_total_length(response, offset) if offset else None
+                    if total_length and response_validators:
+                        logger.info('resuming download of {} from byte {}'.format(url, offset))
+                        response_validators.content_length = total_length
+                    elif response.status_code == 206:
+                        # partial content that can not be appended to what was already downloaded
+                        partial_download.discard()
+                        if not offset:
+                            raise FetcherException(
+                                'error during download of file: unexpected partial content from url {}'.format(url))
+                        logger.warning('cannot resume download of {}, fetching the whole file again'.format(url))
+                        restart = True
+                    else:
+                        offset = 0
+                if not restart:
+                    # destination file is only opened once the response is received so that a 304 writes nothing
+                    with partial_download.open(offset, response_validators) as digest_stream:
+                        for chunk in response.iter_content(DigestStream.chunk_size):
+                            digest_stream.write(chunk)
+                    partial_download.complete()
+                    return response_validators, digest_stream.get_digest()
+        except requests.exceptions.RequestException as e:
+            raise FetcherException('error during download of file: {}'.format(str(e)))
+        # the partial download has been discarded, so no range is requested this time
+        return cls.fetch_to_target(url, dest_full_file_name, validators=validators, auth=auth,
+                                   scratch_path=scratch_path)
 
-    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None) -> Tuple[str, str]:
-        expected_file_name = self.guess_file_name_from_url(url) if not expected_filename else expected_filename
+    @classmethod
+    def check_authent_and_fetch_to_target(cls, url: str, dest_full_file_name: str, options: PlatformOptions = None,
+                                          validators: FetchValidators = None, scratch_path: str = None) \
+            -> Tuple[Optional[FetchValidators], Dict[str, str]]:
+        url, username, password, parsed = cls.get_url_and_credentials(url, options)
+        auth = (username, password) if username and password else None
+        return cls.fetch_to_target(url, dest_full_file_name, validators=validators, auth=auth,
+                                   scratch_path=scratch_path)
+
+    def fetch(self, url: str, destination_path: str, expected_filename: str = None, options: PlatformOptions = None,
+              validators: FetchValidators = None) -> Tuple[str, str]:
+        expected_file_name = expected_filename if expected_filename else self.guess_file_name_from_url(url)
         dest_full_file_name = os.path.join(destination_path, expected_file_name)
-        self.check_authent_and_fetch_to_target(url, dest_full_file_name, options)
+        try:
+            self.fetch_validators, self.digest = self.check_authent_and_fetch_to_target(
+                url, dest_full_file_name, options, validators, self.scratch_path)
+        except FetcherException:
+            guessed_file_names.invalidate(url)
+            raise
         return dest_full_file_name, expected_file_name
@@ -0,0 +1,215 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+
+from gridfs.errors import CorruptGridFile
+from gridfs.grid_file import GridOut
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+
+class CachedGridFile(io.BufferedReader):
+    """
+    local copy of a GridFS file, opened with the attributes of GridOut used by tartare
+    """
+    def __init__(self, path: str, grid_out: GridOut) -> None:
+        super().__init__(io.FileIO(path, 'rb'))
+        self._id = grid_out._id
+        self.filename = grid_out.filename
+        self.md5 = grid_out.md5
+        self.metadata = grid_out.metadata
+        self.length = grid_out.length
+        self.upload_date = grid_out.upload_date
+
+    @property
+    def name(self) -> str:  # type: ignore
+        # like GridOut, used as file name by uploads
+        return self.filename
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class ReadAheadGridOut(io.RawIOBase):
+    """
+    GridOut reader for random access (zip archives): GridOut fetches chunks one query at a time and drops them when
+    seeking, this reader fetches read_ahead_chunks chunks by query and keeps the last cached_chunks chunks read
+    """
+    def __init__(self, grid_out: GridOut, chunks: Collection, read_ahead_chunks: int = 4,
+                 cached_chunks: int = 16) -> None:
+        super().__init__()
+        self._id = grid_out._id
+        self.filename = grid_out.filename
+        self.md5 = grid_out.md5
+        self.metadata = grid_out.metadata
+        self.length = grid_out.length
+        self.upload_date = grid_out.upload_date
+        self.chunk_size = grid_out.chunk_size
+        self.chunks = chunks
+        self.read_ahead_chunks = max(read_ahead_chunks, 1)
+        self.cached_chunks = max(cached_chunks, self.read_ahead_chunks)
+        self.chunk_cache = OrderedDict()  # type: OrderedDict[int, bytes]
+        self.position = 0
+        self.nb_chunk_queries = 0
+
+    @property
+    def name(self) -> str:  # type: ignore
+        return self.filename
+
+    def __len__(self) -> int:
+        return self.length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.length + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+        if position < 0:
+            raise ValueError('negative seek position {}'.format(position))
+        self.position = position
+        return self.position
+
+    def get_chunk(self, chunk_number: int) -> bytes:
+        if chunk_number in self.chunk_cache:
+            self.chunk_cache.move_to_end(chunk_number)
+            return self.chunk_cache[chunk_number]
+        self.nb_chunk_queries += 1
+        for chunk in self.chunks.find({'files_id': self._id,
+                                       'n': {'$gte': chunk_number, '$lt': chunk_number + self.read_ahead_chunks}}):
+            self.chunk_cache[chunk['n']] = bytes(chunk['data'])
+            self.chunk_cache.move_to_end(chunk['n'])
+        while len(self.chunk_cache) > self.cached_chunks:
+            self.chunk_cache.popitem(last=False)
+        if chunk_number not in self.chunk_cache:
+            raise CorruptGridFile('no chunk #{}'.format(chunk_number))
+        return self.chunk_cache[chunk_number]
+
+    def readinto(self, buffer: bytearray) -> int:
+        # fills the whole buffer when possible: zipfile does not expect short reads
+        size = min(len(buffer), max(self.length - self.position, 0))
+        read_size = 0
+        while read_size < size:
+            chunk_number, chunk_offset = divmod(self.position, self.chunk_size)
+            data = self.get_chunk(chunk_number)[chunk_offset:chunk_offset + size - read_size]
+            if not data:
+                raise CorruptGridFile('truncated chunk #{}'.format(chunk_number))
+            buffer[read_size:read_size + len(data)] = data
+            read_size += len(data)
+            self.position += len(data)
+        return read_size
+
+
+class GridFsDiskCache(object):
+    """
+    read-through cache of GridFS files on the local disk of the worker, GridFS files never change so they are cached
+    by id, the least recently used files are removed when the cache exceeds its max size
+    files are downloaded in a temporary file then renamed so that concurrent workers only see complete files,
+    a removed file stays readable by the workers which opened it
+    """
+    # temporary files older than this time in seconds are left by interrupted downloads
+    stale_download_time = 3600
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_path(self, id: str) -> str:
+        return os.path.join(self.directory, id)
+
+    def open(self, grid_out: GridOut) -> CachedGridFile:
+        path = self.get_path(str(grid_out._id))
+        try:
+            cached_file = CachedGridFile(path, grid_out)
+            # modification time is the last use time for eviction
+            os.utime(path)
+            return cached_file
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        fd, download_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as download_file:
+                shutil.copyfileobj(grid_out, download_file, 1024 * 1024)
+            os.rename(download_path, path)
+        except BaseException:
+            os.remove(download_path)
+            raise
+        cached_file = CachedGridFile(path, grid_out)
+        self.evict(keep_path=path)
+        return cached_file
+
+    def evict(self, keep_path: str = None) -> None:
+        entries = []  # type: List[Tuple[float, int, str]]
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.'):
+                if stat.st_mtime < time.time() - self.stale_download_time:
+                    self.remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        cache_size = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            if path != keep_path:
+                logger.debug('removing {} from gridfs cache'.format(path))
+                self.remove(path)
+                cache_size -= size
+
+    @staticmethod
+    def remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already removed by another worker
+            pass
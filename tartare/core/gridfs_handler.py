@@ -27,36 +27,194 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 import logging
+from collections import defaultdict
+from datetime import datetime
 
 from gridfs import GridFS
+from gridfs.errors import NoFile
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 from pymongo.database import Database
 
-from tartare import mongo
-from typing import Union, BinaryIO
-from io import IOBase
+from tartare import app, mongo
+from typing import Union, BinaryIO, Dict, Optional, Any, List, Callable
+from io import IOBase, BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED
 from gridfs.grid_file import GridOut
 
+from tartare.core.gridfs_cache import GridFsDiskCache, ReadAheadGridOut
+from tartare.helper import DigestStream
+
 
 class GridFsHandler(object):
+    """
+    in content addressed mode (GRIDFS_CONTENT_ADDRESSED), a file saved with the same content and name as a stored one
+    is not stored again: the stored file is referenced once more (refcount of fs.files) and its id is returned,
+    copying a file is only a new reference
+    deleting the last reference of a file only marks it as deleted (deleted_at), its chunks are removed later in bulk
+    by sweep_deleted_files (see tartare.tasks.sweep_deleted_gridfs_files)
+    """
     def __init__(self, database: Database=None) -> None:
         if database is None:
             database = mongo.db
         self.gridfs = GridFS(database)
+        self.files = database['fs.files']
+        self.chunks = database['fs.chunks']
+
+    def save_file_in_gridfs(self, file: Union[str, bytes, IOBase, BinaryIO, GridOut], digest: Dict[str, str] = None,
+                            **kwargs: str) -> str:
+        """
+            :param digest: md5 and sha256 of the file stored as metadata, computed while saving if not provided
+            :rtype: the id of the gridfs
+        """
+        if isinstance(file, str):
+            return str(self.gridfs.put(file, **kwargs))
+        content_addressed = app.config.get('GRIDFS_CONTENT_ADDRESSED', False)
+        if content_addressed and digest and 'sha256' in digest:
+            stored_id = self.find_and_reference(digest['sha256'], kwargs.get('filename'))
+            if stored_id:
+                return stored_id
+        if digest:
+            id = self.gridfs.put(file, metadata=digest, refcount=1, **kwargs)
+        else:
+            digest_stream = DigestStream(BytesIO(file) if isinstance(file, bytes) else file)
+            with self.gridfs.new_file(refcount=1, **kwargs) as grid_in:
+                grid_in.write(digest_stream)
+                grid_in.metadata = digest_stream.get_digest()
+            return self.deduplicate(grid_in._id, grid_in.metadata, kwargs.get('filename'))
+        return str(id)
 
-    def save_file_in_gridfs(self, file: Union[str, bytes, IOBase, BinaryIO, GridOut], **kwargs: str) -> str:
+    def save_zip_file_in_gridfs(self, filename: str, write_members: Callable[[ZipFile], None],
+                                compression: int = ZIP_DEFLATED) -> str:
         """
+            the archive is written directly into gridfs, its digest is computed while writing
+            :param write_members: called with the ZipFile opened for writing
             :rtype: the id of the gridfs
         """
-        return str(self.gridfs.put(file, **kwargs))
+        grid_in = self.gridfs.new_file(refcount=1, filename=filename)
+        digest_stream = DigestStream(grid_in)  # type: Any
+        try:
+            with ZipFile(digest_stream, 'w', compression) as zip_out:
+                write_members(zip_out)
+        except BaseException:
+            grid_in.abort()
+            raise
+        grid_in.metadata = digest_stream.get_digest()
+        grid_in.close()
+        return self.deduplicate(grid_in._id, grid_in.metadata, filename)
+
+    def deduplicate(self, id: ObjectId, digest: Dict[str, str], filename: Optional[str]) -> str:
+        if app.config.get('GRIDFS_CONTENT_ADDRESSED', False):
+            # the digest is only known once saved, the new file is dropped if the same content was already stored
+            stored_id = self.find_and_reference(digest['sha256'], filename, exclude_id=id)
+            if stored_id:
+                self.gridfs.delete(id)
+                return stored_id
+        return str(id)
+
+    def find_and_reference(self, sha256: str, filename: Optional[str], exclude_id: ObjectId = None) -> Optional[str]:
+        query = {'metadata.sha256': sha256, 'filename': filename, 'refcount': {'$gte': 1}}  # type: Dict[str, Any]
+        if exclude_id:
+            query['_id'] = {'$ne': exclude_id}
+        stored_file = self.files.find_one_and_update(query, {'$inc': {'refcount': 1}}, projection={'_id': True})
+        return str(stored_file['_id']) if stored_file else None
+
+    def reference(self, id: str) -> None:
+        # a file marked as deleted is referenced again unless it is being swept
+        if self.files.update_one({'_id': ObjectId(id), 'refcount': {'$exists': True}, 'swept_at': {'$exists': False}},
+                                 {'$inc': {'refcount': 1}, '$unset': {'deleted_at': ''}}).matched_count:
+            return
+        # files saved before reference counting are referenced once
+        if not self.files.update_one({'_id': ObjectId(id), 'refcount': {'$exists': False}},
+                                     {'$set': {'refcount': 2}}).matched_count:
+            raise NoFile('no file in gridfs with id "{}"'.format(id))
+
+    def get_digest(self, id: str) -> Dict[str, str]:
+        file = self.get_file_from_gridfs(id)
+        # files saved before digests were stored only have the md5 computed by GridFS
+        return file.metadata if file.metadata else {'md5': file.md5}
+
+    def get_file_from_gridfs(self, id: str, read_ahead: bool = False) -> GridOut:
+        """
+            :param read_ahead: to seek in the file (zip archives), returns a ReadAheadGridOut fetching and keeping
+            several chunks by query (see GRIDFS_READ_AHEAD_CHUNKS and GRIDFS_CACHED_CHUNKS)
+        """
+        grid_out = self.gridfs.get(ObjectId(id))
+        if not read_ahead:
+            return grid_out
+        return ReadAheadGridOut(grid_out, self.chunks, app.config.get('GRIDFS_READ_AHEAD_CHUNKS', 4),
+                                app.config.get('GRIDFS_CACHED_CHUNKS', 16))
 
-    def get_file_from_gridfs(self, id: str) -> GridOut:
-        return self.gridfs.get(ObjectId(id))
+    def open_file_from_gridfs(self, id: str) -> GridOut:
+        """
+            file to read several times or to seek in (zip archives), read from the local cache of the worker
+            (see GRIDFS_CACHE_MAX_SIZE) as a CachedGridFile with the same attributes as GridOut
+            the returned file holds a file descriptor when cached and must be closed (use it as a context manager)
+        """
+        max_size = app.config.get('GRIDFS_CACHE_MAX_SIZE', 0) * 1024 * 1024
+        grid_out = self.get_file_from_gridfs(id)
+        if not max_size or grid_out.length > max_size:
+            return ReadAheadGridOut(grid_out, self.chunks, app.config.get('GRIDFS_READ_AHEAD_CHUNKS', 4),
+                                    app.config.get('GRIDFS_CACHED_CHUNKS', 16))
+        return GridFsDiskCache(app.config['GRIDFS_CACHE_DIR'], max_size).open(grid_out)
 
     def delete_file_from_gridfs(self, id: str) -> None:
-        logging.getLogger(__name__).info('deleting file from gridfs with id "{}"'.format(id))
-        self.gridfs.delete(ObjectId(id))
+        # the reference is always removed (files saved before reference counting go to -1), the file is then only
+        # marked as deleted if it has not been referenced again in between
+        stored_file = self.files.find_one_and_update({'_id': ObjectId(id)}, {'$inc': {'refcount': -1}},
+                                                     projection={'refcount': True},
+                                                     return_document=ReturnDocument.AFTER)
+        if stored_file and stored_file['refcount'] > 0:
+            logging.getLogger(__name__).info('dereferencing file from gridfs with id "{}"'.format(id))
+            return
+        logging.getLogger(__name__).info('marking file from gridfs with id "{}" as deleted'.format(id))
+        self.files.update_one({'_id': ObjectId(id), 'refcount': {'$lte': 0}},
+                              {'$set': {'refcount': 0, 'deleted_at': datetime.utcnow()}})
+
+    def mark_as_deleted(self, refcounts: Dict[str, Optional[int]]) -> None:
+        """
+            :param refcounts: refcount of each file when it was found unreferenced, a file referenced since
+            (refcount changed) is not marked
+        """
+        ids_by_refcount = defaultdict(list)  # type: Dict[Optional[int], List[ObjectId]]
+        for id, refcount in refcounts.items():
+            ids_by_refcount[refcount].append(ObjectId(id))
+        for refcount, ids in ids_by_refcount.items():
+            self.files.update_many({'_id': {'$in': ids}, 'refcount': refcount},
+                                   {'$set': {'refcount': 0, 'deleted_at': datetime.utcnow()}})
+
+    def sweep_deleted_files(self, deleted_before: datetime, batch_size: int = 1000) -> int:
+        """
+            removes files marked as deleted before the given date (UTC) with their chunks
+            files are first claimed (swept_at) so that they can no longer be referenced again, then chunks are removed
+            before file documents so that an interrupted sweep leaves no orphan chunks and is completed by the next one
+            :rtype: the number of removed files
+        """
+        nb_removed_files = 0
+        query = {'deleted_at': {'$lt': deleted_before}, 'refcount': {'$lte': 0}}  # type: Dict[str, Any]
+        while True:
+            ids = [file['_id'] for file in self.files.find(query, projection={'_id': True}).limit(batch_size)]
+            if not ids:
+                return nb_removed_files
+            # files referenced again since they were listed are no longer matched
+            self.files.update_many(dict(query, _id={'$in': ids}), {'$set': {'swept_at': datetime.utcnow()}})
+            claimed_ids = [file['_id'] for file in
+                           self.files.find({'_id': {'$in': ids}, 'swept_at': {'$exists': True}},
+                                           projection={'_id': True})]
+            self.chunks.delete_many({'files_id': {'$in': claimed_ids}})
+            nb_removed_files += self.files.delete_many({'_id': {'$in': claimed_ids}}).deleted_count
+
+    def get_refcounts_of_files_uploaded_before(self, uploaded_before: datetime) -> Dict[str, Optional[int]]:
+        """
+            :rtype: refcount of each file not marked as deleted, None for files saved before reference counting
+        """
+        return {str(file['_id']): file.get('refcount') for file in
+                self.files.find({'uploadDate': {'$lt': uploaded_before}, 'deleted_at': {'$exists': False}},
+                                projection={'_id': True, 'refcount': True})}
 
     def copy_file(self, id: str) -> str:
+        if app.config.get('GRIDFS_CONTENT_ADDRESSED', False):
+            self.reference(id)
+            return id
         file = self.get_file_from_gridfs(id)
-        return self.save_file_in_gridfs(file=file, filename=file.filename)
+        return self.save_file_in_gridfs(file=file, digest=file.metadata, filename=file.filename)
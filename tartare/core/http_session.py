@@ -0,0 +1,90 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import os
+import threading
+from typing import Any, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tartare import app
+
+
+class HttpSessionManager(object):
+    """
+    keep-alive sessions shared by all http calls of a worker process so that TCP connections and TLS sessions
+    are reused between calls to the same host
+    requests sessions are not thread safe so each thread gets its own one
+    """
+    _local = threading.local()
+
+    @classmethod
+    def get_timeout(cls) -> Tuple[int, int]:
+        return app.config['HTTP_CONNECT_TIMEOUT'], app.config['HTTP_READ_TIMEOUT']
+
+    @classmethod
+    def create_session(cls) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=app.config['HTTP_POOL_CONNECTIONS'],
+                              pool_maxsize=app.config['HTTP_POOL_MAXSIZE'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        for host, pool_maxsize in app.config['HTTP_POOL_MAXSIZE_BY_HOST'].items():
+            host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            # adapters are selected by url prefix: the host must be followed by a port or a path so that
+            # other hosts starting with the same name do not match
+            for scheme in ['http', 'https']:
+                session.mount('{}://{}/'.format(scheme, host), host_adapter)
+                session.mount('{}://{}:'.format(scheme, host), host_adapter)
+        return session
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        # a session inherited from a parent process (celery prefork) would share its sockets
+        if getattr(cls._local, 'pid', None) != os.getpid():
+            cls._local.session = cls.create_session()
+            cls._local.pid = os.getpid()
+        return cls._local.session
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    kwargs.setdefault('timeout', HttpSessionManager.get_timeout())
+    return HttpSessionManager.get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def head(url: str, **kwargs: Any) -> requests.Response:
+    return request('HEAD', url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request('POST', url, **kwargs)
@@ -35,9 +35,12 @@ from datetime import date, timedelta
 from datetime import datetime
 from io import IOBase
 from typing import Optional, List, Union, Dict, Any, TypeVar, BinaryIO, Tuple, Type, Set
+from zipfile import ZipFile, is_zipfile
 
 import pymongo
 import pytz
+from gridfs.grid_file import GridOut
+from pymongo.errors import DuplicateKeyError
 from marshmallow import Schema, post_load, utils, fields, validates, validates_schema, ValidationError
 from marshmallow_oneofschema import OneOfSchema
 
@@ -45,9 +48,11 @@ from tartare import app
 from tartare import mongo
 from tartare.core.constants import *
 from tartare.core.gridfs_handler import GridFsHandler
+from tartare.core.readers import GtfsReader
+from tartare.core.service_calendar import ServiceCalendar
 from tartare.exceptions import ValidityPeriodException, EntityNotFound, ParameterException, IntegrityException, \
-    RuntimeException
-from tartare.helper import get_values_by_key, get_md5_content_file
+    RuntimeException, InvalidFile
+from tartare.helper import get_values_by_key
 
 
 @app.before_first_request
@@ -55,6 +60,45 @@ def init_mongo() -> None:
     mongo.db['contributors'].create_index("data_prefix", unique=True)
     mongo.db['contributors'].create_index([("data_sources.id", pymongo.DESCENDING)], unique=True, sparse=True)
     mongo.db['coverages'].create_index([("data_sources.id", pymongo.DESCENDING)], unique=True, sparse=True)
+    mongo.db['fs.files'].create_index([("metadata.sha256", pymongo.ASCENDING), ("filename", pymongo.ASCENDING)])
+    mongo.db['fs.files'].create_index("deleted_at", sparse=True)
+    mongo.db['coverage_exports'].create_index("gridfs_id")
+
+
+def _collect_values_at_path(value: Any, path: List[str], out: Set[str]) -> None:
+    if isinstance(value, list):
+        for item in value:
+            _collect_values_at_path(item, path, out)
+    elif not path:
+        if value:
+            out.add(value)
+    elif isinstance(value, dict):
+        _collect_values_at_path(value.get(path[0]), path[1:], out)
+
+
+def get_referenced_gridfs_ids() -> Set[str]:
+    """
+    ids of the GridFS files used by contributors, coverages, exports and shared fetches
+
+    only the fields referencing GridFS files are read, any new one must be added to referencing_fields
+    """
+    environments_ntfs_ids = ['environments.{}.current_ntfs_id'.format(environment)
+                             for environment in ['production', 'preproduction', 'integration']]
+    referencing_fields = {
+        Contributor.mongo_collection: ['data_sources.data_sets.gridfs_id'],
+        Coverage.mongo_collection: ['data_sources.data_sets.gridfs_id'] + environments_ntfs_ids,
+        ContributorExport.mongo_collection: ['data_sources.gridfs_id'],
+        CoverageExport.mongo_collection: ['gridfs_id'],
+        SharedFetch.mongo_collection: ['gridfs_id'],
+    }
+    referenced_ids = set()  # type: Set[str]
+    for collection, fields_paths in referencing_fields.items():
+        projection = {field_path: True for field_path in fields_paths}
+        projection['_id'] = False
+        for raw in mongo.db[collection].find(projection=projection):
+            for field_path in fields_paths:
+                _collect_values_at_path(raw, field_path.split('.'), referenced_ids)
+    return referenced_ids
 
 
 class ChoiceField(fields.Field):
@@ -182,6 +226,18 @@ class DataSourceAndProcessContainer(metaclass=ABCMeta):
                             and existing_data_source.input.options.authent.password:
                         data_source.input.options.authent.password = existing_data_source.input.options.authent.password
 
+    def fill_data_set_internal_fields_from_existing_object(self,
+                                                           existing_object: 'DataSourceAndProcessContainer') -> None:
+        existing_data_sets = {data_set.id: data_set for data_source in existing_object.data_sources
+                              for data_set in data_source.data_sets}
+        for data_source in self.data_sources:
+            for data_set in data_source.data_sets:
+                existing_data_set = existing_data_sets.get(data_set.id)
+                if existing_data_set and existing_data_set is not data_set:
+                    data_set.fetch_validators = existing_data_set.fetch_validators
+                    data_set.zip_members = existing_data_set.zip_members
+                    data_set.service_profile = existing_data_set.service_profile
+
     def delete_files_linked(self) -> None:
         for gridfs_id in [data_set.gridfs_id for data_source in self.data_sources for data_set in
                           data_source.data_sets]:
@@ -297,14 +353,154 @@ class DataSetStatus(object):
         self.updated_at = updated_at
 
 
+class FetchValidators(object):
+    def __init__(self, etag: str = None, last_modified: str = None, content_length: int = None) -> None:
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_length = content_length
+
+    def can_be_used_for_conditional_fetch(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+    def __repr__(self) -> str:
+        return str(vars(self))
+
+
+class ZipMember(object):
+    def __init__(self, name: str, file_size: int) -> None:
+        self.name = name
+        self.file_size = file_size
+
+    @classmethod
+    def list_from_zip_file(cls, file: Union[str, BinaryIO, GridOut]) -> Optional[List['ZipMember']]:
+        """
+        only the central directory of the archive is read, None if the file is not a zip file or has more members
+        than DATA_SET_MAX_INDEXED_ZIP_MEMBERS (readers then open the archive)
+        """
+        if not is_zipfile(file):
+            return None
+        with ZipFile(file, 'r') as zip_file:
+            zip_infos = zip_file.infolist()
+        if len(zip_infos) > app.config['DATA_SET_MAX_INDEXED_ZIP_MEMBERS']:
+            return None
+        return [cls(zip_info.filename, zip_info.file_size) for zip_info in zip_infos]
+
+    def __repr__(self) -> str:
+        return str(vars(self))
+
+
+class ServiceProfile(object):
+    """
+    number of running services and trips for each day from start_date (see ServiceCalendar) and number of rows of
+    the tables of a GTFS read to compute them (calendar, calendar_dates and trips)
+    """
+
+    def __init__(self, start_date: date, services_by_day: List[int], trips_by_day: List[int],
+                 rows_by_table: Dict[str, int]) -> None:
+        self.start_date = start_date
+        self.services_by_day = services_by_day
+        self.trips_by_day = trips_by_day
+        self.rows_by_table = rows_by_table
+
+    @classmethod
+    def from_zip_file(cls, file: Union[str, BinaryIO, GridOut],
+                      file_names: Optional[List[str]] = None) -> Optional['ServiceProfile']:
+        """
+        the archive is opened once, only calendar files and the service_id column of trips.txt are read
+        None if the file is not a zip file or has no calendar
+        """
+        if not is_zipfile(file):
+            return None
+        with ZipFile(file, 'r') as files_zip:
+            file_names = file_names if file_names is not None else files_zip.namelist()
+            if ServiceCalendar.calendar_file_name not in file_names and \
+                    ServiceCalendar.calendar_dates_file_name not in file_names:
+                return None
+            service_calendar = ServiceCalendar.from_zip_file(files_zip, file_names)
+            trips_by_service, nb_trips = None, None
+            if 'trips.txt' in file_names:
+                reader = GtfsReader()
+                reader.load_csv_data_from_zip_file(files_zip, 'trips.txt', usecols=['service_id'])
+                trips_by_service, nb_trips = reader.data['service_id'].value_counts(), len(reader.data)
+        # keys without '.txt' as mongo keys cannot contain dots
+        rows_by_table = {}  # type: Dict[str, int]
+        if ServiceCalendar.calendar_file_name in file_names:
+            rows_by_table['calendar'] = service_calendar.nb_calendar_rows
+        if ServiceCalendar.calendar_dates_file_name in file_names:
+            rows_by_table['calendar_dates'] = service_calendar.nb_calendar_dates_rows
+        if nb_trips is not None:
+            rows_by_table['trips'] = nb_trips
+        services_by_day = service_calendar.get_counts_by_day()
+        trips_by_day = service_calendar.get_counts_by_day(trips_by_service) if trips_by_service is not None \
+            else services_by_day * 0
+        return cls(service_calendar.start_date, services_by_day.tolist(), trips_by_day.tolist(), rows_by_table)
+
+    def __get_count(self, counts: List[int], day: date) -> int:
+        index = (day - self.start_date).days
+        return counts[index] if 0 <= index < len(counts) else 0
+
+    def get_services_count(self, day: date) -> int:
+        return self.__get_count(self.services_by_day, day)
+
+    def get_trips_count(self, day: date) -> int:
+        return self.__get_count(self.trips_by_day, day)
+
+    def get_days_without_service(self, start_date: date, end_date: date) -> List[date]:
+        return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)
+                if not self.get_services_count(start_date + timedelta(days=offset))]
+
+    def __repr__(self) -> str:
+        return str(vars(self))
+
+
 class DataSet(object):
     def __init__(self, id: str = None, gridfs_id: str = None, validity_period: Optional[ValidityPeriod] = None,
-                 created_at: datetime = None, status_history: List[DataSetStatus] = None) -> None:
+                 created_at: datetime = None, status_history: List[DataSetStatus] = None,
+                 fetch_validators: Optional[FetchValidators] = None,
+                 zip_members: Optional[List[ZipMember]] = None,
+                 service_profile: Optional[ServiceProfile] = None) -> None:
         self.id = id if id else str(uuid.uuid4())
         self.gridfs_id = gridfs_id
         self.created_at = created_at if created_at else datetime.now(pytz.utc)
         self.validity_period = validity_period
         self.status_history = status_history if status_history else []
+        self.fetch_validators = fetch_validators
+        # names and sizes of the members of the zip file captured when the data set is created
+        self.zip_members = zip_members
+        self.service_profile = service_profile
+
+    def index_zip_members(self, file: Union[str, IOBase, BinaryIO, GridOut]) -> None:
+        if isinstance(file, str):
+            self.zip_members = ZipMember.list_from_zip_file(file)
+        else:
+            position = file.tell()
+            self.zip_members = ZipMember.list_from_zip_file(file)
+            file.seek(position)
+
+    def compute_service_profile(self, file: Union[str, IOBase, BinaryIO, GridOut], data_format: str) -> None:
+        """
+        only for data formats of DATA_FORMAT_WITH_SERVICE_PROFILE, the data set has no profile if it cannot be
+        computed (the profile is informative, malformed calendar files do not prevent saving the data set)
+        """
+        if data_format not in DATA_FORMAT_WITH_SERVICE_PROFILE:
+            return
+        position = None if isinstance(file, str) else file.tell()
+        try:
+            self.service_profile = ServiceProfile.from_zip_file(file, self.get_file_names())
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                'impossible to compute service profile of data set {}: {}'.format(self.id, str(e)))
+        finally:
+            if not isinstance(file, str):
+                file.seek(position)
+
+    def get_file_names(self) -> Optional[List[str]]:
+        """
+        None if the members of the data set are unknown (data set not zipped or created before they were indexed)
+        """
+        if self.zip_members is None:
+            return None
+        return [member.name for member in self.zip_members]
 
     def get_md5(self) -> Optional[str]:
         if not self.gridfs_id:
@@ -312,15 +508,29 @@ class DataSet(object):
         file = GridFsHandler().get_file_from_gridfs(self.gridfs_id)
         return file.md5
 
-    def is_identical_to(self, file_path: str) -> bool:
-        return self.get_md5() == get_md5_content_file(file_path)
+    def get_digest(self) -> Dict[str, str]:
+        if not self.gridfs_id:
+            return {}
+        return GridFsHandler().get_digest(self.gridfs_id)
+
+    def is_identical_to(self, digest: Dict[str, str]) -> bool:
+        own_digest = self.get_digest()
+        key = 'sha256' if 'sha256' in own_digest and 'sha256' in digest else 'md5'
+        return bool(own_digest.get(key)) and own_digest.get(key) == digest.get(key)
 
-    def add_file_from_path(self, file_full_path: str, file_name: str) -> None:
+    def add_file_from_path(self, file_full_path: str, file_name: str, digest: Dict[str, str] = None) -> None:
         with open(file_full_path, 'rb') as file:
-            self.add_file_from_io(file, file_name)
+            self.add_file_from_io(file, file_name, digest)
 
-    def add_file_from_io(self, io: Union[IOBase, BinaryIO], file_name: str) -> None:
-        self.gridfs_id = GridFsHandler().save_file_in_gridfs(io, filename=file_name, data_set_id=self.id)
+    def add_file_from_io(self, io: Union[IOBase, BinaryIO], file_name: str, digest: Dict[str, str] = None) -> None:
+        if self.zip_members is None and io.seekable():
+            self.index_zip_members(io)
+        self.gridfs_id = GridFsHandler().save_file_in_gridfs(io, digest=digest, filename=file_name,
+                                                             data_set_id=self.id)
+
+    def reference_file(self, gridfs_id: str) -> None:
+        GridFsHandler().reference(gridfs_id)
+        self.gridfs_id = gridfs_id
 
     def __repr__(self) -> str:
         return str(vars(self))
@@ -805,6 +1015,7 @@ class Contributor(DataSourceAndProcessContainer):
 
     def update_with_object(self, contributor_object: 'Contributor') -> None:
         contributor_object.fill_data_source_passwords_from_existing_object(self)
+        contributor_object.fill_data_set_internal_fields_from_existing_object(self)
         mongo.db[self.mongo_collection].update_one(
             {'_id': self.id},
             {'$set': MongoContributorSchema().dump(contributor_object).data})
@@ -883,6 +1094,7 @@ class Coverage(DataSourceAndProcessContainer):
 
     def update_with_object(self, coverage_object: 'Coverage') -> None:
         coverage_object.fill_data_source_passwords_from_existing_object(self)
+        coverage_object.fill_data_set_internal_fields_from_existing_object(self)
         coverage_object.__fill_platform_passwords_from_existing_coverage(self)
         mongo.db[self.mongo_collection].update_one(
             {'_id': self.id},
@@ -912,12 +1124,45 @@ class MongoDataSetStatusSchema(Schema):
     updated_at = fields.DateTime(required=True)
 
 
+class MongoFetchValidatorsSchema(Schema):
+    etag = fields.String(required=False, allow_none=True)
+    last_modified = fields.String(required=False, allow_none=True)
+    content_length = fields.Integer(required=False, allow_none=True)
+
+    @post_load
+    def make_fetch_validators(self, data: dict) -> FetchValidators:
+        return FetchValidators(**data)
+
+
+class MongoZipMemberSchema(Schema):
+    name = fields.String(required=True)
+    file_size = fields.Integer(required=True)
+
+    @post_load
+    def make_zip_member(self, data: dict) -> ZipMember:
+        return ZipMember(**data)
+
+
+class MongoServiceProfileSchema(Schema):
+    start_date = fields.Date(required=True)
+    services_by_day = fields.List(fields.Integer(), required=True)
+    trips_by_day = fields.List(fields.Integer(), required=True)
+    rows_by_table = fields.Dict(required=True)
+
+    @post_load
+    def make_service_profile(self, data: dict) -> ServiceProfile:
+        return ServiceProfile(**data)
+
+
 class MongoDataSetSchema(Schema):
     id = fields.String(required=True)
     gridfs_id = fields.String(required=True)
     created_at = fields.DateTime(required=True)
     validity_period = fields.Nested(MongoValidityPeriodSchema, required=False, allow_none=True)
     status_history = fields.Nested(MongoDataSetStatusSchema, many=True)
+    fetch_validators = fields.Nested(MongoFetchValidatorsSchema, required=False, allow_none=True)
+    zip_members = fields.Nested(MongoZipMemberSchema, many=True, required=False, allow_none=True)
+    service_profile = fields.Nested(MongoServiceProfileSchema, required=False, allow_none=True)
 
     @post_load
     def make_data_set(self, data: dict) -> DataSet:
@@ -1036,8 +1281,9 @@ class Historisable(object):
             gridfs_ids = []  # type: List[str]
             if num_deleted:
                 get_values_by_key(old_rows, gridfs_ids)
+            gridfs_handler = GridFsHandler()
             for gridf_id in gridfs_ids:
-                GridFsHandler().delete_file_from_gridfs(gridf_id)
+                gridfs_handler.delete_file_from_gridfs(gridf_id)
 
 
 class MongoDataSourceLicenseSchema(Schema):
@@ -1667,6 +1913,86 @@ class MongoJobSchema(Schema):
         return Job(**data)
 
 
+class SharedFetch(object):
+    """
+    download of an url (with its credentials) shared by the data sources fetching it during an automatic update cycle:
+    the first data source claims it and downloads the file, the other ones reuse the file it stored
+    """
+    mongo_collection = 'shared_fetches'
+
+    def __init__(self, id: str, state: str = JOB_STATUS_RUNNING, gridfs_id: str = None, file_name: str = None,
+                 digest: Dict[str, str] = None, fetch_validators: FetchValidators = None,
+                 claimed_at: datetime = None) -> None:
+        self.id = id
+        self.state = state
+        self.gridfs_id = gridfs_id
+        self.file_name = file_name
+        self.digest = digest if digest else {}
+        self.fetch_validators = fetch_validators
+        self.claimed_at = claimed_at if claimed_at else datetime.now(pytz.utc)
+        self.owned = False
+
+    @classmethod
+    def from_cycle(cls, cycle_id: str, fetch_key: str) -> 'SharedFetch':
+        return cls(id='{}:{}'.format(cycle_id, fetch_key))
+
+    def claim(self) -> bool:
+        try:
+            mongo.db[self.mongo_collection].insert_one(MongoSharedFetchSchema().dump(self).data)
+            self.owned = True
+        except DuplicateKeyError:
+            self.owned = False
+        return self.owned
+
+    def update(self) -> None:
+        mongo.db[self.mongo_collection].update_one({'_id': self.id},
+                                                   {'$set': MongoSharedFetchSchema().dump(self).data})
+
+    def complete(self, data_set: DataSet) -> None:
+        grid_out = GridFsHandler().get_file_from_gridfs(data_set.gridfs_id)
+        self.gridfs_id = data_set.gridfs_id
+        self.file_name = grid_out.filename
+        self.digest = data_set.get_digest()
+        self.fetch_validators = data_set.fetch_validators
+        self.state = JOB_STATUS_DONE
+        self.update()
+
+    def fail(self) -> None:
+        self.state = JOB_STATUS_FAILED
+        self.update()
+
+    @classmethod
+    def get(cls, shared_fetch_id: str) -> Optional['SharedFetch']:
+        raw = mongo.db[cls.mongo_collection].find_one({'_id': shared_fetch_id})
+        if not raw:
+            return None
+        return MongoSharedFetchSchema().load(raw).data
+
+    @classmethod
+    def delete_claimed_before(cls, nb_hours: int, current_date: datetime = None) -> int:
+        current_date = current_date if current_date else datetime.now(pytz.utc)
+        raw = mongo.db[cls.mongo_collection].delete_many(
+            {'claimed_at': {'$lt': (current_date - timedelta(hours=nb_hours)).isoformat()}})
+        return raw.deleted_count
+
+    def __repr__(self) -> str:
+        return str(vars(self))
+
+
+class MongoSharedFetchSchema(Schema):
+    id = fields.String(required=True, load_from='_id', dump_to='_id')
+    state = JobStatus(required=True)
+    gridfs_id = fields.String(required=False, allow_none=True)
+    file_name = fields.String(required=False, allow_none=True)
+    digest = fields.Dict(required=False)
+    fetch_validators = fields.Nested(MongoFetchValidatorsSchema, required=False, allow_none=True)
+    claimed_at = fields.DateTime(required=False)
+
+    @post_load
+    def make(self, data: dict) -> SharedFetch:
+        return SharedFetch(**data)
+
+
 class ContributorExport(Historisable):
     mongo_collection = 'contributor_exports'
 
@@ -1766,6 +2092,10 @@ class CoverageExport(Historisable):
         lasts = MongoCoverageExportSchema(many=True).load(raw).data
         return lasts[0] if lasts else None
 
+    @classmethod
+    def exists_with_file(cls, gridfs_id: str) -> bool:
+        return mongo.db[cls.mongo_collection].find_one({'gridfs_id': gridfs_id}, projection={'_id': True}) is not None
+
     def __repr__(self) -> str:
         return str(vars(self))
 
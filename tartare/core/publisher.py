@@ -31,9 +31,8 @@ import logging
 from abc import ABCMeta
 from typing import List, BinaryIO, Optional
 
-import requests
-
 from tartare import app
+from tartare.core import http_session
 from tartare.core.constants import PLATFORM_PROTOCOL_FTP, PLATFORM_PROTOCOL_HTTP
 from tartare.core.gridfs_handler import GridFsHandler
 from tartare.core.models import DataSource, Platform, PlatformOptions
@@ -56,11 +55,11 @@ class HttpProtocol(AbstractProtocol):
         timeout = app.config.get('TYR_UPLOAD_TIMEOUT')
         logger.info('publishing file {filename} on {url}...'.format(filename=filename, url=self.url))
         if self.options and self.options.authent:
-            response = requests.post(self.url,
-                                     auth=(self.options.authent.username, self.options.authent.password),
-                                     files={'file': (filename, file)}, timeout=timeout)
+            response = http_session.post(self.url,
+                                         auth=(self.options.authent.username, self.options.authent.password),
+                                         files={'file': (filename, file)}, timeout=timeout)
         else:
-            response = requests.post(self.url, files={'file': (filename, file)}, timeout=timeout)
+            response = http_session.post(self.url, files={'file': (filename, file)}, timeout=timeout)
         if response.status_code != 200:
             message = 'error during publishing on {url}, status code => {status_code}'.format(
                 url=self.url, status_code=response.status_code)
@@ -122,7 +121,5 @@ class Publisher(metaclass=ABCMeta):
         for input_data_source_id in input_data_source_ids:
             data_source = DataSource.get_one(input_data_source_id)
             data_set = data_source.get_last_data_set()
-            data_set_file = GridFsHandler().get_file_from_gridfs(data_set.gridfs_id)
-            data_set_file_name = data_set_file.filename
-
-            self.protocol_uploader.publish(data_set_file, data_set_file_name)
+            with GridFsHandler().open_file_from_gridfs(data_set.gridfs_id) as data_set_file:
+                self.protocol_uploader.publish(data_set_file, data_set_file.filename)
@@ -27,18 +27,54 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
+import codecs
+import io
 import json
 import logging
 import os
-import tempfile
 from abc import ABCMeta
-from typing import List, Any, Optional, Callable, Generator, Union, BinaryIO
+from contextlib import contextmanager
+from string import Formatter
+from typing import List, Any, Optional, Callable, Generator, Union, BinaryIO, IO, Dict, Tuple, Iterable
 from zipfile import ZipFile, is_zipfile
 
+import numpy as np
 import pandas as pd
 from gridfs import GridOut
+from pandas.api.types import is_categorical_dtype
 
-from tartare.exceptions import InvalidFile, ColumnNotFound
+from tartare.core.constants import DATA_FORMAT_GTFS, DATA_FORMAT_NTFS
+from tartare.exceptions import InvalidFile, ColumnNotFound, UnsortedFile
+
+
+def transform_values(values: pd.Series, transform: Callable[[pd.Series], Any], missing: Any = np.nan) -> pd.Series:
+    """
+    transform is a vectorized function of a series, for a categorical series it is only applied on the distinct
+    values (categories), missing values give missing
+    """
+    if not is_categorical_dtype(values):
+        return pd.Series(transform(values), index=values.index, name=values.name)
+    transformed = np.asarray(transform(pd.Series(values.cat.categories)))
+    codes = values.cat.codes.values
+    if (codes == -1).any():
+        transformed = np.append(transformed, missing)
+    return pd.Series(transformed[codes], index=values.index, name=values.name)
+
+
+def map_values(values: pd.Series, mapping: Union[Dict[Any, Any], pd.Series]) -> pd.Series:
+    """
+    values missing in mapping give NaN
+    """
+    return transform_values(values, lambda distinct_values: distinct_values.map(mapping))
+
+
+def format_values(values: pd.Series, value_format: str = '{0}') -> pd.Series:
+    """
+    missing values of categorical series give 'nan' (as str(value))
+    """
+    if value_format == '{0}':
+        return transform_values(values, lambda distinct_values: distinct_values.astype(str), str(np.nan))
+    return transform_values(values, lambda distinct_values: distinct_values.map(value_format.format), str(np.nan))
 
 
 class AbstractPandaReader(metaclass=ABCMeta):
@@ -78,15 +114,209 @@ class AbstractPandaReader(metaclass=ABCMeta):
         except KeyError:
             raise ColumnNotFound('column "{}" missing'.format(column_name))
 
+    # vectorized transformations, to be used instead of get_mapping_from_columns and apply on large files
+
+    def get_column(self, column_name: str) -> pd.Series:
+        try:
+            return self.data[column_name]
+        except KeyError:
+            raise ColumnNotFound('column "{}" missing'.format(column_name))
+
+    def get_mapping(self, key_column: str, value_column: str, mask: Optional[pd.Series] = None) -> Dict[Any, Any]:
+        """
+        :return: a dict with values of key_column as keys and values of value_column as values (for rows matching
+        mask if given)
+        """
+        keys, values = self.get_column(key_column), self.get_column(value_column)
+        if mask is not None:
+            keys, values = keys[mask], values[mask]
+        return dict(zip(keys.tolist(), values.tolist()))
+
+    def get_mapped_column(self, key_column: str, mapping: Union[Dict[Any, Any], pd.Series]) -> pd.Series:
+        """
+        :return: values of key_column replaced by mapping[value] (NaN for values missing in mapping)
+        """
+        return map_values(self.get_column(key_column), mapping)
+
+    def map_column(self, column_name: str, mapping: Union[Dict[Any, Any], pd.Series],
+                   key_column: Optional[str] = None) -> None:
+        """
+        values of column_name are replaced by mapping[value of key_column] (column_name by default), rows with a key
+        missing in mapping keep their value (the column is created empty if missing)
+        """
+        key_column = key_column or column_name
+        if column_name not in self.data.columns:
+            self.data[column_name] = np.nan
+        self.assign_where(column_name, self.get_column(key_column).isin(mapping),
+                          self.get_mapped_column(key_column, mapping))
+
+    def assign_where(self, column_name: str, mask: pd.Series, value: Any) -> None:
+        """
+        :param value: a scalar or a series aligned on the data, set in column_name for rows matching mask
+        """
+        column = self.get_column(column_name)
+        if is_categorical_dtype(column):
+            column = column.astype(object)
+        if isinstance(value, pd.Series) and is_categorical_dtype(value):
+            value = value.astype(object)
+        self.data[column_name] = column.where(~mask, value)
+
+    def format_columns(self, column_name: str, pattern: str, **constants: Any) -> None:
+        """
+        column_name is set to pattern formatted for each row, fields of the pattern are the names of the columns to
+        use or of the constants given, ex: format_columns('code', '{prefix}:{route_id}', prefix='OIF')
+        """
+        formatted = pd.Series('', index=self.data.index, dtype=object)
+        for literal_text, field_name, format_spec, conversion in Formatter().parse(pattern):
+            if literal_text:
+                formatted += literal_text
+            if field_name is None:
+                continue
+            value_format = '{0' + ('!' + conversion if conversion else '') + \
+                           (':' + format_spec if format_spec else '') + '}'
+            if field_name in constants:
+                formatted += value_format.format(constants[field_name])
+            else:
+                formatted += format_values(self.get_column(field_name), value_format)
+        self.data[column_name] = formatted
+
+    def join(self, lookup: pd.DataFrame, on: str, how: str = 'left') -> None:
+        """
+        adds the columns of the lookup data frame to the rows with the same value of column on,
+        rows order is kept (lookup should have unique values of column on)
+        """
+        self.get_column(on)
+        if on not in lookup.columns:
+            raise ColumnNotFound('column "{}" missing in lookup'.format(on))
+        if is_categorical_dtype(self.data[on]) or is_categorical_dtype(lookup[on]):
+            # keys with different categories cannot be merged
+            lookup = lookup.assign(**{on: lookup[on].astype(object)})
+            self.data[on] = self.data[on].astype(object)
+        self.data = self.data.merge(lookup, on=on, how=how)
+
+
+class JsonArrayParser:
+    """
+    yields the items of the json array of json_file one at a time, the file is read by blocks of read_size
+    characters (or bytes decoded as utf-8) so only the current item is held in memory
+    a file containing a single json value yields this value
+    """
+
+    def __init__(self, json_file: Union[IO, GridOut], read_size: int = 64 * 1024) -> None:
+        self.json_file = json_file
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.end_of_file = False
+
+    def __read_block(self, size: int) -> None:
+        block = self.json_file.read(size)
+        self.end_of_file = not block
+        if isinstance(block, bytes):
+            block = self.bytes_decoder.decode(block, final=self.end_of_file)
+        self.buffer = self.buffer[self.position:] + block
+        self.position = 0
+
+    def __next_char(self) -> str:
+        """
+        skips whitespaces, '' at the end of the file
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer) or self.end_of_file:
+                return self.buffer[self.position:self.position + 1]
+            self.__read_block(self.read_size)
+
+    def __decode_value(self) -> Any:
+        if not self.__next_char():
+            raise ValueError('unexpected end of data')
+        size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a number ending with the buffer may continue in the next block
+                if end < len(self.buffer) or self.end_of_file:
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.end_of_file:
+                    raise
+            # the value is parsed again with the next block, blocks are larger for large values
+            self.__read_block(size)
+            size *= 2
+
+    def __iter__(self) -> Generator[Any, None, None]:
+        if self.__next_char() != '[':
+            yield self.__decode_value()
+        else:
+            self.position += 1
+            if self.__next_char() == ']':
+                self.position += 1
+            else:
+                while True:
+                    yield self.__decode_value()
+                    separator = self.__next_char()
+                    self.position += 1
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise ValueError('expecting "," or "]" after an item of the array')
+        if self.__next_char():
+            raise ValueError('extra data after the json value')
+
 
 class JsonReader(AbstractPandaReader):
-    def load_json_data_from_io(self, json_file: GridOut, usecols: Optional[List[str]] = None) -> None:
+    @staticmethod
+    def get_field(item: Any, column: str) -> Any:
+        """
+        :return: value of column in the json item flattened as json_normalize does ('fields.id_line' for
+        {"fields": {"id_line": ...}}), np.nan if missing
+        """
+        if not isinstance(item, dict):
+            return np.nan
+        if column in item:
+            value = item[column]
+        else:
+            value = item
+            for key in column.split('.'):
+                if not isinstance(value, dict) or key not in value:
+                    return np.nan
+                value = value[key]
+        return np.nan if isinstance(value, dict) else value
+
+    def load_json_data_from_io(self, json_file: Union[IO, GridOut], usecols: Optional[List[str]] = None) -> None:
+        """
+        with usecols, items are parsed one at a time and only distinct rows of usecols are kept
+        (columns missing in every item are dropped)
+        """
         try:
-            self.data = pd.io.json.json_normalize(json.load(json_file))
             if usecols:
-                self.data = self.data.filter(items=usecols).drop_duplicates()
+                self.data = self.__load_columns(json_file, usecols)
+            else:
+                self.data = pd.io.json.json_normalize(json.load(json_file))
         except ValueError as e:
-            raise InvalidFile('impossible to parse file {}, error {}'.format(json_file.filename, str(e)))
+            raise InvalidFile('impossible to parse file {}, error {}'.format(
+                getattr(json_file, 'filename', getattr(json_file, 'name', json_file)), str(e)))
+
+    def __load_columns(self, json_file: Union[IO, GridOut], usecols: List[str]) -> pd.DataFrame:
+        rows = []  # type: List[tuple]
+        distinct_rows = set()  # type: set
+        for item in JsonArrayParser(json_file):
+            row = tuple(self.get_field(item, column) for column in usecols)
+            try:
+                if row in distinct_rows:
+                    continue
+                distinct_rows.add(row)
+            except TypeError:
+                # unhashable values (lists) are deduplicated by drop_duplicates
+                pass
+            rows.append(row)
+        found_columns = [column for index, column in enumerate(usecols)
+                         if any(row[index] is not np.nan for row in rows)]
+        return pd.DataFrame.from_records(rows, columns=usecols).filter(items=found_columns).drop_duplicates()
 
 
 class CsvReader(AbstractPandaReader):
@@ -95,25 +325,227 @@ class CsvReader(AbstractPandaReader):
         with ZipFile(zip_file, 'r') as files_zip:
             return filename in files_zip.namelist()
 
-    def load_csv_data_from_zip_file(self, zip_file: GridOut, filename: str, sep: str = ',',
-                                    usecols: Optional[list] = None,
-                                    **kwargs: Any) -> None:
-        if not is_zipfile(zip_file):
+    @staticmethod
+    def check_zip_file(zip_file: Union[str, BinaryIO, ZipFile]) -> None:
+        if not isinstance(zip_file, ZipFile) and not is_zipfile(zip_file):
             msg = '{} is not a zip file or does not exist'.format(zip_file)
             logging.getLogger(__name__).error(msg)
             raise InvalidFile(msg)
-        with ZipFile(zip_file, 'r') as files_zip, tempfile.TemporaryDirectory() as tmp_path:
-            files_zip.extract(filename, tmp_path)
-            tmp_filename = '{}/{}'.format(tmp_path, filename)
-            self.load_csv_data(tmp_filename, sep, usecols, **kwargs)
 
-    def load_csv_data(self, csv_full_filename: str, sep: str = ',', usecols: Optional[List[str]] = None,
-                      **kwargs: Any) -> None:
+    @staticmethod
+    @contextmanager
+    def open_csv_from_zip_file(zip_file: Union[str, BinaryIO, ZipFile], filename: str, sep: str = ',',
+                               encoding: Optional[str] = None, **kwargs: Any) -> Generator:
+        """
+        member is read from the archive stream without being extracted, an already opened ZipFile is not closed
+        the python engine of pandas (regex or multi-character separators) needs a text stream
+        """
+        files_zip = zip_file if isinstance(zip_file, ZipFile) else ZipFile(zip_file, 'r')
+        try:
+            with files_zip.open(filename) as member:
+                if kwargs.get('engine') == 'python' or len(sep) > 1:
+                    yield io.TextIOWrapper(member, encoding=encoding or 'utf-8', newline='')
+                else:
+                    yield member
+        finally:
+            if files_zip is not zip_file:
+                files_zip.close()
+
+    def load_csv_data_from_zip_file(self, zip_file: Union[str, BinaryIO, ZipFile], filename: str, sep: str = ',',
+                                    usecols: Optional[list] = None, encoding: Optional[str] = None,
+                                    **kwargs: Any) -> None:
+        self.check_zip_file(zip_file)
+        with self.open_csv_from_zip_file(zip_file, filename, sep, encoding, **kwargs) as csv_file:
+            self.load_csv_data(csv_file, sep, usecols, encoding=encoding, filename=filename, **kwargs)
+
+    def get_csv_chunks_from_zip_file(self, zip_file: Union[str, BinaryIO, ZipFile], filename: str, chunksize: int,
+                                     sep: str = ',', usecols: Optional[list] = None, encoding: Optional[str] = None,
+                                     **kwargs: Any) -> Generator[pd.DataFrame, None, None]:
+        """
+        yields data frames of chunksize rows, self.data is the current chunk
+        """
+        self.check_zip_file(zip_file)
+        with self.open_csv_from_zip_file(zip_file, filename, sep, encoding, **kwargs) as csv_file:
+            try:
+                for chunk in self.read_csv(csv_file, filename, sep=sep, usecols=usecols, encoding=encoding,
+                                           chunksize=chunksize, **kwargs):
+                    self.data = chunk
+                    yield chunk
+            except ValueError as e:
+                raise InvalidFile('impossible to parse file {}, error {}'.format(filename, str(e)))
+
+    def get_csv_groups_from_zip_file(self, zip_file: Union[str, BinaryIO, ZipFile], filename: str, key_column: str,
+                                     chunksize: int, keys: Optional[Iterable] = None, sep: str = ',',
+                                     usecols: Optional[list] = None, encoding: Optional[str] = None,
+                                     **kwargs: Any) -> Generator[Tuple[Any, pd.DataFrame], None, None]:
+        """
+        yields (key, data frame of the rows of the key) for each value of key_column in the order of the file,
+        only a chunk of chunksize rows and the rows of the current key are held in memory
+        the rows of a key have to be consecutive (stop_times.txt grouped by trip), UnsortedFile is raised otherwise
+        :param keys: only rows with a key in keys are read
+        """
+        yielded_keys = set()  # type: set
+        pending_key, pending_rows = None, []  # type: Any, List[pd.DataFrame]
+        for chunk in self.get_csv_chunks_from_zip_file(zip_file, filename, chunksize, sep, usecols, encoding,
+                                                       **kwargs):
+            if key_column not in chunk.columns:
+                raise ColumnNotFound('column "{}" missing in file {}'.format(key_column, filename))
+            chunk = chunk[chunk[key_column].isin(keys) if keys is not None else chunk[key_column].notnull()]
+            # consecutive rows with the same key
+            runs = (chunk[key_column] != chunk[key_column].shift()).cumsum()
+            for _, rows in chunk.groupby(runs.values, sort=False):
+                key = rows[key_column].iloc[0]
+                if key == pending_key:
+                    pending_rows.append(rows)
+                    continue
+                if pending_rows:
+                    yield pending_key, pd.concat(pending_rows, ignore_index=True)
+                if key in yielded_keys:
+                    raise UnsortedFile('impossible to read file {} by {}, rows of {} are not consecutive'.format(
+                        filename, key_column, key))
+                yielded_keys.add(key)
+                pending_key, pending_rows = key, [rows]
+        if pending_rows:
+            yield pending_key, pd.concat(pending_rows, ignore_index=True)
+
+    def load_csv_data(self, csv_full_filename: Union[str, IO], sep: str = ',', usecols: Optional[List[str]] = None,
+                      filename: Optional[str] = None, **kwargs: Any) -> None:
+        filename = filename or str(csv_full_filename).split(os.path.sep)[-1]
         try:
-            self.data = pd.read_csv(csv_full_filename, sep=sep, usecols=usecols, **kwargs)
+            self.data = self.read_csv(csv_full_filename, filename, sep=sep, usecols=usecols, **kwargs)
         except ValueError as e:
-            filename = csv_full_filename.split(os.path.sep)[-1]
             raise InvalidFile('impossible to parse file {}, error {}'.format(filename, str(e)))
 
+    def read_csv(self, csv_file: Union[str, IO], filename: str, **kwargs: Any) -> Any:
+        return pd.read_csv(csv_file, **kwargs)
+
     def save_as_csv(self, csv_full_filename: str) -> None:
         self.data.to_csv(csv_full_filename, index=False)
+
+
+# ids are read as categories (each distinct value stored once), small ints are only used for required columns
+GTFS_DTYPES = {
+    'agency.txt': {'agency_id': 'category'},
+    'stops.txt': {'stop_id': 'category', 'parent_station': 'category', 'zone_id': 'category',
+                  'location_type': 'category', 'wheelchair_boarding': 'category'},
+    'routes.txt': {'route_id': 'category', 'agency_id': 'category', 'route_type': 'int16'},
+    'trips.txt': {'route_id': 'category', 'service_id': 'category', 'trip_id': 'category', 'shape_id': 'category',
+                  'block_id': 'category', 'direction_id': 'category', 'wheelchair_accessible': 'category',
+                  'bikes_allowed': 'category'},
+    'stop_times.txt': {'trip_id': 'category', 'stop_id': 'category', 'stop_sequence': 'int32',
+                       'pickup_type': 'category', 'drop_off_type': 'category', 'timepoint': 'category'},
+    'calendar.txt': {'service_id': 'category', 'monday': 'int8', 'tuesday': 'int8', 'wednesday': 'int8',
+                     'thursday': 'int8', 'friday': 'int8', 'saturday': 'int8', 'sunday': 'int8'},
+    'calendar_dates.txt': {'service_id': 'category', 'exception_type': 'int8'},
+    'frequencies.txt': {'trip_id': 'category', 'headway_secs': 'int32', 'exact_times': 'category'},
+    'transfers.txt': {'from_stop_id': 'category', 'to_stop_id': 'category', 'transfer_type': 'category'},
+    'shapes.txt': {'shape_id': 'category', 'shape_pt_sequence': 'int32'},
+}  # type: Dict[str, Dict[str, str]]
+
+NTFS_DTYPES = dict(GTFS_DTYPES, **{
+    'lines.txt': {'line_id': 'category', 'network_id': 'category', 'commercial_mode_id': 'category'},
+    'routes.txt': {'route_id': 'category', 'line_id': 'category', 'destination_id': 'category'},
+    'trips.txt': dict(GTFS_DTYPES['trips.txt'], physical_mode_id='category', company_id='category',
+                      dataset_id='category'),
+    'object_codes.txt': {'object_type': 'category', 'object_id': 'category', 'object_system': 'category'},
+    'object_properties.txt': {'object_type': 'category', 'object_id': 'category', 'object_property_name': 'category'},
+})  # type: Dict[str, Dict[str, str]]
+
+# 'HH:MM:SS' columns (hours can exceed 24) converted to int32 seconds
+GTFS_TIME_COLUMNS = {
+    'stop_times.txt': ['arrival_time', 'departure_time'],
+    'frequencies.txt': ['start_time', 'end_time'],
+}  # type: Dict[str, List[str]]
+
+
+def time_to_seconds(times: pd.Series) -> pd.Series:
+    """
+    only the distinct values of the categorical series are parsed, -1 for empty or invalid times
+    """
+    def parse(distinct_times: pd.Series) -> pd.Series:
+        hours_minutes_seconds = distinct_times.astype(str).str.extract(
+            r'^\s*(\d+):(\d{2}):(\d{2})\s*$', expand=True).apply(pd.to_numeric)
+        return (hours_minutes_seconds[0] * 3600 + hours_minutes_seconds[1] * 60 + hours_minutes_seconds[2]) \
+            .fillna(-1).astype('int32')
+
+    return transform_values(times.astype('category'), parse, -1).astype('int32')
+
+
+class GtfsReader(CsvReader):
+    """
+    reads GTFS/NTFS tables with compact dtypes (see GTFS_DTYPES and NTFS_DTYPES), dtype given when loading a file
+    overrides the dtype of the schema
+    if a required int column has empty values, the file is read again without the int dtypes of the schema
+    (not when reading by chunks)
+    """
+    def __init__(self, data_format: str = DATA_FORMAT_GTFS, parse_times: bool = True) -> None:
+        super().__init__()
+        self.dtypes = NTFS_DTYPES if data_format == DATA_FORMAT_NTFS else GTFS_DTYPES
+        self.parse_times = parse_times
+        self.use_int_dtypes = True
+
+    def __get_time_columns(self, filename: str, dtype: Any) -> List[str]:
+        if not self.parse_times:
+            return []
+        return [column for column in GTFS_TIME_COLUMNS.get(os.path.basename(filename), [])
+                if not isinstance(dtype, dict) or column not in dtype]
+
+    def __has_int_dtypes(self, filename: str) -> bool:
+        return self.use_int_dtypes and any(
+            column_dtype.startswith('int') for column_dtype in self.dtypes.get(os.path.basename(filename), {}).values())
+
+    def get_dtype(self, filename: str, dtype: Any = None) -> Any:
+        if dtype is not None and not isinstance(dtype, dict):
+            return dtype
+        schema = {column: column_dtype for column, column_dtype in self.dtypes.get(os.path.basename(filename),
+                                                                                  {}).items()
+                  if self.use_int_dtypes or not column_dtype.startswith('int')}
+        schema.update({column: 'category' for column in self.__get_time_columns(filename, dtype)})
+        schema.update(dtype or {})
+        return schema
+
+    def __parse_time_columns(self, data: pd.DataFrame, time_columns: List[str]) -> pd.DataFrame:
+        for column in time_columns:
+            if column in data.columns:
+                data[column] = time_to_seconds(data[column])
+        return data
+
+    def read_csv(self, csv_file: Union[str, IO], filename: str, **kwargs: Any) -> Any:
+        time_columns = self.__get_time_columns(filename, kwargs.get('dtype'))
+        kwargs['dtype'] = self.get_dtype(filename, kwargs.get('dtype'))
+        data = pd.read_csv(csv_file, **kwargs)
+        if kwargs.get('chunksize') or kwargs.get('iterator'):
+            return (self.__parse_time_columns(chunk, time_columns) for chunk in data)
+        return self.__parse_time_columns(data, time_columns)
+
+    @contextmanager
+    def __without_int_dtypes(self) -> Generator:
+        self.use_int_dtypes = False
+        try:
+            yield
+        finally:
+            self.use_int_dtypes = True
+
+    def load_csv_data_from_zip_file(self, zip_file: Union[str, BinaryIO, ZipFile], filename: str, sep: str = ',',
+                                    usecols: Optional[list] = None, encoding: Optional[str] = None,
+                                    **kwargs: Any) -> None:
+        try:
+            super().load_csv_data_from_zip_file(zip_file, filename, sep, usecols, encoding, **kwargs)
+        except InvalidFile as e:
+            if not self.__has_int_dtypes(filename):
+                raise
+            logging.getLogger(__name__).warning('{}, reading it without int dtypes'.format(str(e)))
+            with self.__without_int_dtypes():
+                super().load_csv_data_from_zip_file(zip_file, filename, sep, usecols, encoding, **kwargs)
+
+    def load_csv_data(self, csv_full_filename: Union[str, IO], sep: str = ',', usecols: Optional[List[str]] = None,
+                      filename: Optional[str] = None, **kwargs: Any) -> None:
+        try:
+            super().load_csv_data(csv_full_filename, sep, usecols, filename, **kwargs)
+        except InvalidFile as e:
+            # a stream cannot be read again, it is done by load_csv_data_from_zip_file
+            if not isinstance(csv_full_filename, str) or not self.__has_int_dtypes(csv_full_filename):
+                raise
+            logging.getLogger(__name__).warning('{}, reading it without int dtypes'.format(str(e)))
+            with self.__without_int_dtypes():
+                super().load_csv_data(csv_full_filename, sep, usecols, filename, **kwargs)
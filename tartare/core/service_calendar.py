@@ -0,0 +1,209 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+from datetime import date, timedelta
+from typing import Optional, List, Union, BinaryIO, Tuple
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+
+from tartare.core.readers import GtfsReader
+
+
+class ServiceCalendar:
+    """
+    days on which the services of a GTFS run, from the weekdays of the periods of calendar.txt and the exceptions of
+    calendar_dates.txt (exception_type 1 adds a day to a service, 2 removes it)
+    days are numbered from start_date, the first day of calendar.txt and calendar_dates.txt
+    a service can have several periods (rows) in calendar.txt
+    """
+    calendar_file_name = 'calendar.txt'
+    calendar_dates_file_name = 'calendar_dates.txt'
+    weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    exception_added = 1
+    exception_removed = 2
+
+    def __init__(self, calendar: Optional[pd.DataFrame] = None, calendar_dates: Optional[pd.DataFrame] = None) -> None:
+        """
+        :param calendar: service_id, weekdays columns, start_date and end_date (datetime64) columns
+        :param calendar_dates: service_id, date (datetime64) and exception_type columns
+        """
+        calendar = calendar if calendar is not None else pd.DataFrame(
+            columns=['service_id'] + self.weekdays + ['start_date', 'end_date'])
+        calendar_dates = calendar_dates if calendar_dates is not None else pd.DataFrame(
+            columns=['service_id', 'date', 'exception_type'])
+        self.nb_calendar_rows, self.nb_calendar_dates_rows = len(calendar), len(calendar_dates)
+        calendar = calendar.dropna(subset=['service_id', 'start_date', 'end_date'])
+        calendar_dates = calendar_dates.dropna(subset=['service_id', 'date', 'exception_type'])
+        calendar = calendar.assign(service_id=calendar['service_id'].astype(str))
+        calendar_dates = calendar_dates.assign(service_id=calendar_dates['service_id'].astype(str)) \
+            .drop_duplicates(['service_id', 'date'])
+
+        self.service_ids = pd.Index(pd.unique(np.concatenate([calendar['service_id'].values,
+                                                              calendar_dates['service_id'].values])))
+        all_dates = pd.concat([calendar['start_date'], calendar['end_date'], calendar_dates['date']])
+        self.start_date = all_dates.min().date() if len(all_dates) else date.today()
+        self.nb_days = (all_dates.max().date() - self.start_date).days + 1 if len(all_dates) else 0
+        # weekday of each day, 0 for monday
+        self.day_weekdays = (self.start_date.weekday() + np.arange(self.nb_days)) % 7
+
+        self.calendar_services = self.service_ids.get_indexer(calendar['service_id'])
+        self.calendar_starts = self.__to_days(calendar['start_date'])
+        self.calendar_ends = self.__to_days(calendar['end_date'])
+        # (nb calendar rows, 7) weekdays of the periods
+        self.calendar_weekdays = calendar[self.weekdays].fillna(0).values.astype(bool) \
+            if len(calendar) else np.zeros((0, 7), dtype=bool)
+
+        exception_services = self.service_ids.get_indexer(calendar_dates['service_id'])
+        exception_days = self.__to_days(calendar_dates['date'])
+        exception_types = calendar_dates['exception_type'].values
+        # only exceptions changing a day of the periods are kept
+        in_periods = self.__is_active_in_periods(exception_services, exception_days)
+        changing = np.where(exception_types == self.exception_added, ~in_periods,
+                            (exception_types == self.exception_removed) & in_periods)
+        self.exception_services = exception_services[changing]
+        self.exception_days = exception_days[changing]
+        self.exception_deltas = np.where(exception_types[changing] == self.exception_added, 1, -1)
+
+    def __to_days(self, dates: pd.Series) -> np.ndarray:
+        return ((dates.values.astype('datetime64[D]') - np.datetime64(self.start_date, 'D'))
+                .astype(np.int64)) if len(dates) else np.zeros(0, dtype=np.int64)
+
+    def __is_active_in_periods(self, services: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """
+        :return: for each (service, day), True if the day is in a period of the service in calendar.txt and
+        the service runs on its weekday
+        """
+        exceptions = pd.DataFrame({'service': services, 'exception': np.arange(len(services))})
+        periods = pd.DataFrame({'service': self.calendar_services, 'period': np.arange(len(self.calendar_services))})
+        exception_periods = exceptions.merge(periods, on='service')
+        rows = exception_periods['period'].values
+        exception_days = days[exception_periods['exception'].values]
+        active = (self.calendar_starts[rows] <= exception_days) & (exception_days <= self.calendar_ends[rows]) & \
+            self.calendar_weekdays[rows, self.day_weekdays[exception_days]]
+        in_periods = np.zeros(len(services), dtype=bool)
+        in_periods[exception_periods['exception'].values[active]] = True
+        return in_periods
+
+    @staticmethod
+    def __merge_periods(services: np.ndarray, starts: np.ndarray, ends: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: services, starts and ends of the periods where overlapping periods of a same service are merged
+        """
+        if not len(services):
+            return services, starts, ends
+        periods = pd.DataFrame({'service': services, 'start': starts, 'end': ends}).sort_values(['service', 'start'])
+        # a period starts a new merged period if it starts after the end of all previous periods of its service
+        previous_ends = periods.groupby('service')['end'].cummax().groupby(periods['service']).shift()
+        merged_periods = (periods['start'] > previous_ends.fillna(-1)).cumsum()
+        merged = periods.groupby(merged_periods).agg({'service': 'first', 'start': 'min', 'end': 'max'})
+        return merged['service'].values, merged['start'].values, merged['end'].values
+
+    @classmethod
+    def from_zip_file(cls, zip_file: Union[str, BinaryIO, ZipFile], file_names: Optional[List[str]] = None,
+                      date_format: str = '%Y%m%d') -> 'ServiceCalendar':
+        """
+        :param zip_file: a GTFS, already opened ZipFile avoids to open the archive again
+        :param file_names: members of the zip file if already known
+        """
+        reader = GtfsReader()
+        if file_names is None:
+            if isinstance(zip_file, ZipFile):
+                file_names = zip_file.namelist()
+            else:
+                with ZipFile(zip_file, 'r') as files_zip:
+                    file_names = files_zip.namelist()
+        date_parser = lambda dates: pd.to_datetime(dates, format=date_format)
+        calendar, calendar_dates = None, None
+        if cls.calendar_file_name in file_names:
+            reader.load_csv_data_from_zip_file(zip_file, cls.calendar_file_name,
+                                               usecols=['service_id'] + cls.weekdays + ['start_date', 'end_date'],
+                                               parse_dates=['start_date', 'end_date'], date_parser=date_parser)
+            calendar = reader.data
+        if cls.calendar_dates_file_name in file_names:
+            reader.load_csv_data_from_zip_file(zip_file, cls.calendar_dates_file_name,
+                                               usecols=['service_id', 'date', 'exception_type'],
+                                               parse_dates=['date'], date_parser=date_parser)
+            calendar_dates = reader.data
+        return cls(calendar, calendar_dates)
+
+    def get_date(self, day: int) -> date:
+        return self.start_date + timedelta(days=int(day))
+
+    def get_dates(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start_date, periods=self.nb_days, freq='D')
+
+    def get_active_days(self, service_id: str) -> np.ndarray:
+        """
+        :return: bitmap (boolean array of nb_days) of the days on which service_id runs
+        """
+        service = self.service_ids.get_loc(str(service_id)) if str(service_id) in self.service_ids else -1
+        active_days = np.zeros(self.nb_days, dtype=bool)
+        for row in np.flatnonzero(self.calendar_services == service):
+            days = np.arange(self.calendar_starts[row], self.calendar_ends[row] + 1)
+            active_days[days] |= self.calendar_weekdays[row, self.day_weekdays[days]]
+        exceptions = self.exception_services == service
+        active_days[self.exception_days[exceptions]] = self.exception_deltas[exceptions] > 0
+        return active_days
+
+    def get_counts_by_day(self, weights: Optional[pd.Series] = None) -> np.ndarray:
+        """
+        :param weights: weight of each service (indexed by service_id, 0 for missing services), 1 by default
+        :return: for each day, the sum of the weights of the services running this day (the number of running
+        services by default), a service with overlapping periods is counted once
+        """
+        if weights is None:
+            service_weights = np.ones(len(self.service_ids), dtype=np.int64)
+        else:
+            service_weights = pd.Series(weights.values, index=weights.index.astype(str)) \
+                .reindex(self.service_ids).fillna(0).values.astype(np.int64)
+        # a period adds its weight from its start to its end on each of its weekdays (cumulative sum by weekday)
+        counts_by_weekday = np.zeros((7, self.nb_days + 1), dtype=np.int64)
+        valid_periods = self.calendar_starts <= self.calendar_ends
+        for weekday in range(7):
+            periods = valid_periods & self.calendar_weekdays[:, weekday]
+            services, starts, ends = self.__merge_periods(self.calendar_services[periods],
+                                                          self.calendar_starts[periods], self.calendar_ends[periods])
+            period_weights = service_weights[services]
+            np.add.at(counts_by_weekday[weekday], starts, period_weights)
+            np.add.at(counts_by_weekday[weekday], ends + 1, -period_weights)
+        counts_by_weekday = counts_by_weekday.cumsum(axis=1)
+        counts = counts_by_weekday[self.day_weekdays, np.arange(self.nb_days)]
+        np.add.at(counts, self.exception_days, self.exception_deltas * service_weights[self.exception_services])
+        return counts
+
+    def get_first_and_last_active_dates(self) -> Optional[Tuple[date, date]]:
+        """
+        :return: first and last days on which at least one service runs, None if no service runs
+        """
+        active_days = np.flatnonzero(self.get_counts_by_day() > 0)
+        if not len(active_days):
+            return None
+        return self.get_date(active_days[0]), self.get_date(active_days[-1])
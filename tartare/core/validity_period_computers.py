@@ -35,12 +35,12 @@ from typing import List, Optional, Union, BinaryIO
 from xml.etree import ElementTree
 from zipfile import is_zipfile, ZipFile
 
-import numpy as np
 import pandas as pd
 from pandas._libs.tslib import NaTType
 
 from tartare.core.models import ValidityPeriod
-from tartare.core.readers import CsvReader
+from tartare.core.readers import CsvReader, GtfsReader
+from tartare.core.service_calendar import ServiceCalendar
 from tartare.exceptions import InvalidFile
 
 
@@ -49,7 +49,10 @@ class AbstractValidityPeriodComputer(metaclass=ABCMeta):
         self.date_format = date_format
 
     @abstractmethod
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
+        """
+        :param file_names: members of the zip file if already known (see DataSet.zip_members)
+        """
         pass
 
     @classmethod
@@ -61,9 +64,16 @@ class AbstractValidityPeriodComputer(metaclass=ABCMeta):
 
 
 class ValidityPeriodFromCsvComputer(AbstractValidityPeriodComputer):
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
         pass
 
+    @classmethod
+    def get_file_names(cls, file_name: Union[str, BinaryIO], file_names: Optional[List[str]]) -> List[str]:
+        if file_names is not None:
+            return file_names
+        with ZipFile(file_name, 'r') as files_zip:
+            return files_zip.namelist()
+
     def __init__(self, date_format: str = '%Y%m%d') -> None:
         super().__init__(date_format)
         self.reader = CsvReader()
@@ -77,28 +87,26 @@ class GtfsValidityPeriodComputer(ValidityPeriodFromCsvComputer):
 
     def __init__(self) -> None:
         super().__init__()
+        self.reader = GtfsReader()
         self.start_date = date.max
         self.end_date = date.min
 
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
         self.check_zip_file(file_name)
+        with ZipFile(file_name, 'r') as files_zip:
+            file_names = file_names if file_names is not None else files_zip.namelist()
 
-        if not self.reader.file_in_zip_files(file_name, self.calendar_file_name) and \
-                not self.reader.file_in_zip_files(file_name, self.calendar_dates_file_name):
-            msg = 'file zip {} without at least one of {}'.format(file_name, ','.join(
-                [self.calendar_file_name, self.calendar_dates_file_name]))
-            logging.getLogger(__name__).error(msg)
-            raise InvalidFile(msg)
-        if self.reader.file_in_zip_files(file_name, self.feed_info_filename):
-            self._parse_feed_info(file_name)
-            if self.is_start_date_valid() and self.is_end_date_valid():
-                return ValidityPeriod(self.start_date, self.end_date)
-
-        if self.reader.file_in_zip_files(file_name, self.calendar_file_name):
-            self._parse_calendar(file_name)
+            if self.calendar_file_name not in file_names and self.calendar_dates_file_name not in file_names:
+                msg = 'file zip {} without at least one of {}'.format(file_name, ','.join(
+                    [self.calendar_file_name, self.calendar_dates_file_name]))
+                logging.getLogger(__name__).error(msg)
+                raise InvalidFile(msg)
+            if self.feed_info_filename in file_names:
+                self._parse_feed_info(files_zip)
+                if self.is_start_date_valid() and self.is_end_date_valid():
+                    return ValidityPeriod(self.start_date, self.end_date)
 
-        if self.reader.file_in_zip_files(file_name, self.calendar_dates_file_name):
-            self._parse_calendar_dates(file_name)
+            self._parse_calendars(files_zip, file_names)
 
         if not self.is_start_date_valid() or not self.is_end_date_valid():
             msg = 'impossible to find validity period'
@@ -112,64 +120,16 @@ class GtfsValidityPeriodComputer(ValidityPeriodFromCsvComputer):
     def is_end_date_valid(self) -> bool:
         return self.end_date != date.min
 
-    def _parse_calendar(self, files_zip: Union[str, BinaryIO]) -> None:
-        self.reader.load_csv_data_from_zip_file(files_zip, self.calendar_file_name,
-                                                usecols=['start_date', 'end_date'],
-                                                parse_dates=['start_date', 'end_date'],
-                                                date_parser=self.date_parser)
-
-        if self.reader.count_rows():
-            self.start_date = self.reader.get_min('start_date').date()
-            self.end_date = self.reader.get_max('end_date').date()
-
-    def add_dates(self, dates: np.ndarray) -> None:
-        dates.sort()
-        for d in dates:
-            current_date = d.date()
-            if self.start_date > current_date:
-                self.start_date = current_date
-            else:
-                break
-
-        for d in dates[::-1]:
-            current_date = d.date()
-            if self.end_date < current_date:
-                self.end_date = current_date
-            else:
-                break
-
-    def remove_dates(self, dates: np.ndarray) -> None:
+    def _parse_calendars(self, files_zip: ZipFile, file_names: List[str]) -> None:
         """
-        Removing dates extremities, google does not do it in transitfeed
-        https://github.com/google/transitfeed/blob/master/transitfeed/serviceperiod.py#L80
+        first and last days on which at least one service runs (see ServiceCalendar)
         """
-        dates.sort()
-        for d in dates:
-            current_date = d.date()
-            if self.start_date == current_date:
-                self.start_date = self.start_date + timedelta(days=1)
-            else:
-                break
-
-        for d in dates[::-1]:
-            current_date = d.date()
-            if self.end_date == current_date:
-                self.end_date = self.end_date - timedelta(days=1)
-            else:
-                break
-
-    def _parse_calendar_dates(self, files_zip: Union[str, BinaryIO]) -> None:
-        self.reader.load_csv_data_from_zip_file(files_zip, self.calendar_dates_file_name,
-                                                usecols=['date', 'exception_type'],
-                                                parse_dates=['date'],
-                                                date_parser=self.date_parser)
-
-        dates = self.reader.data[(self.reader.data.exception_type == 1)].date.tolist()
-        self.add_dates(dates)
-        dates = self.reader.data[(self.reader.data.exception_type == 2)].date.tolist()
-        self.remove_dates(dates)
+        active_dates = ServiceCalendar.from_zip_file(files_zip, file_names,
+                                                     self.date_format).get_first_and_last_active_dates()
+        if active_dates:
+            self.start_date, self.end_date = active_dates
 
-    def _parse_feed_info(self, files_zip: Union[str, BinaryIO]) -> None:
+    def _parse_feed_info(self, files_zip: ZipFile) -> None:
         try:
             self.reader.load_csv_data_from_zip_file(files_zip, self.feed_info_filename,
                                                     usecols=['feed_start_date', 'feed_end_date'],
@@ -197,9 +157,9 @@ class TitanValidityPeriodComputer(ValidityPeriodFromCsvComputer):
     def __init__(self) -> None:
         super().__init__()
 
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
         self.check_zip_file(file_name)
-        if not self.reader.file_in_zip_files(file_name, self.calendar_file_name):
+        if self.calendar_file_name not in self.get_file_names(file_name, file_names):
             msg = 'file zip {} without {}'.format(file_name, self.calendar_file_name)
             logging.getLogger(__name__).error(msg)
             raise InvalidFile(msg)
@@ -220,9 +180,10 @@ class ObitiValidityPeriodComputer(ValidityPeriodFromCsvComputer):
     def __init__(self) -> None:
         super().__init__('%d/%m/%Y')
 
-    def __check_file_exists_and_return_right_case(self, zip_file: Union[str, BinaryIO], file_to_check: str) -> str:
-        if not self.reader.file_in_zip_files(zip_file, file_to_check):
-            if not self.reader.file_in_zip_files(zip_file, file_to_check.upper()):
+    def __check_file_exists_and_return_right_case(self, zip_file: Union[str, BinaryIO], file_names: List[str],
+                                                   file_to_check: str) -> str:
+        if file_to_check not in file_names:
+            if file_to_check.upper() not in file_names:
                 msg = 'file zip {} without {}'.format(zip_file, file_to_check)
                 logging.getLogger(__name__).error(msg)
                 raise InvalidFile(msg)
@@ -230,9 +191,11 @@ class ObitiValidityPeriodComputer(ValidityPeriodFromCsvComputer):
                 file_to_check = file_to_check.upper()
         return file_to_check
 
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
         self.check_zip_file(file_name)
-        vehicule_journey_file = self.__check_file_exists_and_return_right_case(file_name, self.vehicule_journey_file)
+        file_names = self.get_file_names(file_name, file_names)
+        vehicule_journey_file = self.__check_file_exists_and_return_right_case(file_name, file_names,
+                                                                               self.vehicule_journey_file)
 
         self.reader.load_csv_data_from_zip_file(file_name, vehicule_journey_file, sep=self.separator, encoding='latin1')
         id_regime_list = [int(id_regime) for id_regime in set(self.reader.data['IDREGIME'].dropna().tolist()) if
@@ -241,14 +204,14 @@ class ObitiValidityPeriodComputer(ValidityPeriodFromCsvComputer):
                            id_periode != -1]
         validity_periods = []
         if id_periode_list:
-            periode_file = self.__check_file_exists_and_return_right_case(file_name, self.periode_file)
+            periode_file = self.__check_file_exists_and_return_right_case(file_name, file_names, self.periode_file)
             self.reader.load_csv_data_from_zip_file(file_name, periode_file, sep=self.separator, encoding='latin1',
                                                     parse_dates=['DDEBUT', 'DFIN'], date_parser=self.date_parser)
             self.reader.data = self.reader.data[self.reader.data['IDPERIODE'].isin(id_periode_list)]
             validity_periods.append(
                 ValidityPeriod(self.reader.data['DDEBUT'].min().date(), self.reader.data['DFIN'].max().date()))
         if id_regime_list:
-            validity_pattern_file = self.__check_file_exists_and_return_right_case(file_name,
+            validity_pattern_file = self.__check_file_exists_and_return_right_case(file_name, file_names,
                                                                                    self.validity_pattern_file)
             self.reader.load_csv_data_from_zip_file(file_name, validity_pattern_file, sep=self.separator,
                                                     parse_dates=['DDEBUT'], date_parser=self.date_parser,
@@ -304,7 +267,7 @@ class NeptuneValidityPeriodComputer(AbstractValidityPeriodComputer):
         except (ElementTree.ParseError, TypeError) as e:
             raise InvalidFile("invalid xml {}, error: {}".format(xml_file_name, str(e)))
 
-    def compute(self, file_name: Union[str, BinaryIO]) -> ValidityPeriod:
+    def compute(self, file_name: Union[str, BinaryIO], file_names: Optional[List[str]] = None) -> ValidityPeriod:
         self.check_zip_file(file_name)
         validity_periods = []
         with ZipFile(file_name, 'r') as files_zip, tempfile.TemporaryDirectory() as tmp_path:
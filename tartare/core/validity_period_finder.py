@@ -27,7 +27,7 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
-from typing import List, Union, BinaryIO
+from typing import List, Union, BinaryIO, Optional
 
 from tartare.core.constants import DATA_FORMAT_GTFS, DATA_FORMAT_TITAN, DATA_FORMAT_OBITI, DATA_FORMAT_NEPTUNE, \
     DATA_FORMAT_NTFS
@@ -62,9 +62,10 @@ class ValidityPeriodFinder:
 
     @classmethod
     def select_computer_and_find(cls, file_or_file_name: Union[str, BinaryIO],
-                                 data_format: str = DATA_FORMAT_GTFS) -> ValidityPeriod:
+                                 data_format: str = DATA_FORMAT_GTFS,
+                                 file_names: Optional[List[str]] = None) -> ValidityPeriod:
         try:
             computer = cls.select_computer_from_data_format(data_format)
-            return computer.compute(file_or_file_name)
+            return computer.compute(file_or_file_name, file_names)
         except IntegrityException:
             return None
@@ -27,40 +27,270 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
+import copy
 import logging
+import shutil
+import struct
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import os
-import shutil
-from typing import Callable, Union
-from zipfile import is_zipfile, ZipFile
+from typing import Callable, Union, IO, Any, List, Tuple, Optional
+from zipfile import is_zipfile, ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, BadZipFile
+from tartare import app
 from tartare.exceptions import InvalidFile
 
 logger = logging.getLogger(__name__)
 
+# local file header and data descriptor layouts, see https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+local_file_header_struct = struct.Struct('<4s2B4HL2L2H')
+local_file_header_signature = b'PK\003\004'
+data_descriptor_signature = 0x08074b50
+data_descriptor_fmt = '<LLLL'
+zip64_data_descriptor_fmt = '<LLQQ'
+extra_field_header_struct = struct.Struct('<HH')
+zip64_extra_field_id = 0x0001
+zip64_limit = (1 << 31) - 1
+raw_copy_buffer_size = 1024 * 1024
+deflate_window_size = 32 * 1024
 
-def edit_file_in_zip_file(zip_file: str, filename: str, extract_zip_path: str,
-                          callback: Union[partial, Callable[[str], None]]) -> None:
+
+def check_zip_file(zip_file: Union[str, IO]) -> None:
     if not is_zipfile(zip_file):
         msg = '{} is not a zip file or does not exist.'.format(zip_file)
         logger.error(msg)
         raise InvalidFile(msg)
-    with ZipFile(zip_file, 'r') as files_zip:
-        files_zip.extractall(extract_zip_path)
-        file_path = '{}/{}'.format(extract_zip_path, filename)
-        callback(file_path)
 
 
 def edit_file_in_zip_file_and_pack(zip_file: str, filename: str, extract_zip_path: str,
                                    new_zip_path: str, callback: Union[partial, Callable[[str], None]],
                                    computed_file_name: str='gtfs-processed') -> str:
+    """
+    only the edited member is extracted and compressed again, the other members are copied as is
+    """
+    check_zip_file(zip_file)
+    new_archive_file_name = os.path.join(new_zip_path, computed_file_name + '.zip')
+    with ZipFile(zip_file, 'r') as files_zip, ZipFile(new_archive_file_name, 'w', ZIP_DEFLATED) as new_zip:
+        names = files_zip.namelist()
+        if filename in names:
+            files_zip.extract(filename, extract_zip_path)
+        file_path = os.path.join(extract_zip_path, filename)
+        callback(file_path)
+        for zip_info in files_zip.infolist():
+            if zip_info.filename == filename:
+                write_files_in_zip_file(new_zip, [(file_path, filename)])
+            else:
+                copy_raw_member(files_zip, new_zip, zip_info)
+        if filename not in names:
+            write_files_in_zip_file(new_zip, [(file_path, filename)])
+
+    return new_archive_file_name
+
+
+def get_raw_zip_file(zip_file: ZipFile) -> Optional[Any]:
+    """
+    zipfile has no public api to read or write already compressed data: members are then read and written directly
+    in the underlying file of the ZipFile and added to its central directory, using private attributes of ZipFile
+    checked on the supported python versions
+    :return: the ZipFile to use with its private attributes, None if they cannot be used (members are then
+    decompressed and compressed again)
+    """
+    if not (3, 6) <= sys.version_info[:2] <= (3, 11):
+        return None
+    if not all(hasattr(zip_file, attribute) for attribute in ('fp', 'filelist', 'NameToInfo', 'start_dir',
+                                                                '_didModify')):
+        return None
+    # a member being written with ZipFile.open would be corrupted
+    if getattr(zip_file, '_writing', False):
+        return None
+    return zip_file
+
+
+def strip_zip64_extra_field(extra: bytes) -> bytes:
+    """
+    the zip64 extra field of a member read from an archive is computed again when it is written
+    """
+    stripped = b''
+    position = 0
+    while position + extra_field_header_struct.size <= len(extra):
+        field_id, field_size = extra_field_header_struct.unpack_from(extra, position)
+        field_end = position + extra_field_header_struct.size + field_size
+        if field_id != zip64_extra_field_id:
+            stripped += extra[position:field_end]
+        position = field_end
+    return stripped
+
+
+def copy_raw_member(from_zip: ZipFile, to_zip: ZipFile, zip_info: ZipInfo) -> None:
+    """
+    copy the compressed bytes of a member without decompressing them
+    """
+    from_reader = get_raw_zip_file(from_zip)
+    to_writer = get_raw_zip_file(to_zip)
+    if from_reader is None or to_writer is None:
+        copy_member(from_zip, to_zip, zip_info)
+        return
+    from_fp = from_reader.fp
+    from_fp.seek(zip_info.header_offset)
+    file_header = local_file_header_struct.unpack(from_fp.read(local_file_header_struct.size))
+    if file_header[0] != local_file_header_signature:
+        raise BadZipFile('bad magic number for file header of {}'.format(zip_info.filename))
+    from_fp.seek(file_header[10] + file_header[11], os.SEEK_CUR)
+
+    new_zip_info = copy.copy(zip_info)  # type: Any
+    # sizes and crc are known so they are written in the local header instead of a data descriptor
+    new_zip_info.flag_bits &= ~0x08
+    new_zip_info.extra = strip_zip64_extra_field(zip_info.extra)
+    new_zip_info.header_offset = to_writer.fp.tell()
+    to_writer.fp.write(new_zip_info.FileHeader())
+    remaining = zip_info.compress_size
+    while remaining > 0:
+        data = from_fp.read(min(remaining, raw_copy_buffer_size))
+        if not data:
+            raise BadZipFile('truncated data for file {}'.format(zip_info.filename))
+        to_writer.fp.write(data)
+        remaining -= len(data)
+    register_member(to_writer, new_zip_info)
+
+
+def copy_member(from_zip: ZipFile, to_zip: ZipFile, zip_info: ZipInfo) -> None:
+    new_zip_info = ZipInfo(zip_info.filename, zip_info.date_time)  # type: ignore
+    new_zip_info.compress_type = zip_info.compress_type
+    new_zip_info.external_attr = zip_info.external_attr
+    # the file size tells ZipFile if zip64 extensions are needed
+    new_zip_info.file_size = zip_info.file_size
+    with from_zip.open(zip_info) as from_file, to_zip.open(new_zip_info, 'w') as to_file:
+        shutil.copyfileobj(from_file, to_file, raw_copy_buffer_size)
+
+
+def register_member(zip_writer: Any, zip_info: ZipInfo) -> None:
+    """
+    add a member written directly in the archive file to its central directory
+    :param zip_writer: ZipFile returned by get_raw_zip_file
+    """
+    zip_writer.filelist.append(zip_info)
+    zip_writer.NameToInfo[zip_info.filename] = zip_info
+    zip_writer.start_dir = zip_writer.fp.tell()
+    zip_writer._didModify = True
+
+
+def deflate_block(data: bytes, dictionary: bytes, compress_level: int, last: bool) -> bytes:
+    # the end of the previous block is used as dictionary: back references to the previous block are still valid
+    # when the compressed blocks are concatenated, the compression ratio stays close to a serial compression
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary) \
+        if dictionary else zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelDeflateWriter(object):
+    """
+    members are split in blocks deflated on a thread pool (zlib releases the GIL), blocks are written in order in
+    the archive as soon as they are compressed, with a data descriptor after each member as sizes and crc are only
+    known at the end
+    """
+    def __init__(self, zip_writer: Any, executor: ThreadPoolExecutor, compress_level: int, block_size: int,
+                 max_pending_blocks: int) -> None:
+        """
+        :param zip_writer: ZipFile returned by get_raw_zip_file
+        """
+        self.zip_writer = zip_writer
+        self.executor = executor
+        self.compress_level = compress_level
+        self.block_size = block_size
+        self.max_pending_blocks = max_pending_blocks
+        self.pending_blocks = deque()  # type: deque
+
+    def write(self, file_path: str, arcname: str) -> None:
+        stat = os.stat(file_path)
+        zip_info = ZipInfo(arcname)  # type: ignore
+        zip_info.date_time = time.localtime(stat.st_mtime)[:6]
+        zip_info.external_attr = (stat.st_mode & 0xFFFF) << 16
+        zip_info.compress_type = ZIP_DEFLATED
+        zip_info.flag_bits |= 0x08
+        # the compressed size is not known yet, it can only exceed the file size by a few bytes by block
+        zip64 = stat.st_size + stat.st_size // 100 + 1024 > zip64_limit
+        zip_info.file_size = 0
+        zip_info.compress_size = 0
+        zip_info.CRC = 0
+        with open(file_path, 'rb') as file:
+            previous_block = b''
+            block = file.read(self.block_size)
+            first = True
+            while True:
+                next_block = file.read(self.block_size)
+                last = not next_block
+                zip_info.CRC = zlib.crc32(block, zip_info.CRC)
+                zip_info.file_size += len(block)
+                future = self.executor.submit(deflate_block, block, previous_block[-deflate_window_size:],
+                                              self.compress_level, last)
+                self.pending_blocks.append((zip_info, zip64, future, first, last))
+                while len(self.pending_blocks) > self.max_pending_blocks:
+                    self.write_next_block()
+                if last:
+                    break
+                previous_block, block, first = block, next_block, False
+
+    def write_next_block(self) -> None:
+        zip_info, zip64, future, first, last = self.pending_blocks.popleft()
+        fp = self.zip_writer.fp
+        if first:
+            zip_info.header_offset = fp.tell()
+            fp.write(zip_info.FileHeader(zip64))
+        data = future.result()  # type: bytes
+        fp.write(data)
+        zip_info.compress_size += len(data)
+        if last:
+            fmt = zip64_data_descriptor_fmt if zip64 else data_descriptor_fmt
+            fp.write(struct.pack(fmt, data_descriptor_signature, zip_info.CRC, zip_info.compress_size,
+                                 zip_info.file_size))
+            register_member(self.zip_writer, zip_info)
+
+    def close(self) -> None:
+        while self.pending_blocks:
+            self.write_next_block()
+
+
+def write_files_in_zip_file(zip_out: ZipFile, files: List[Tuple[str, str]],
+                            compress_level: Optional[int] = None) -> None:
+    """
+    :param files: list of (file path, name in the archive)
+    :param compress_level: deflate level from 1 to 9, 0 to store files without compression (ZIP_COMPRESSION_LEVEL
+    if not provided)
+    """
+    if compress_level is None:
+        compress_level = app.config.get('ZIP_COMPRESSION_LEVEL', 6)
+    zip_writer = get_raw_zip_file(zip_out)
+    if compress_level == 0 or zip_writer is None:
+        for file_path, arcname in files:
+            zip_out.write(file_path, arcname, ZIP_DEFLATED if compress_level else ZIP_STORED)
+        return
+    nb_threads = app.config.get('ZIP_COMPRESSION_THREADS', 4)
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        writer = ParallelDeflateWriter(zip_writer, executor, compress_level,
+                                       app.config.get('ZIP_COMPRESSION_BLOCK_SIZE', 4096) * 1024, nb_threads * 2)
+        for file_path, arcname in files:
+            writer.write(file_path, arcname)
+        writer.close()
 
-    edit_file_in_zip_file(zip_file, filename, extract_zip_path, callback)
 
-    return create_zip_file(extract_zip_path, new_zip_path, computed_file_name)
+def add_directory_in_zip_file(zip_out: ZipFile, from_dir: str, compress_level: Optional[int] = None) -> None:
+    files = []
+    for root, dirs, file_names in os.walk(from_dir):
+        dirs.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            files.append((file_path, os.path.relpath(file_path, from_dir)))
+    write_files_in_zip_file(zip_out, files, compress_level)
 
 
-def create_zip_file(from_dir: str, to_dir: str, filename: str='gtfs-processed') -> str:
-    new_archive_file_name = os.path.join(to_dir, filename)
+def create_zip_file(from_dir: str, to_dir: str, filename: str='gtfs-processed',
+                    compress_level: Optional[int] = None) -> str:
+    new_archive_file_name = os.path.join(to_dir, filename + '.zip')
+    with ZipFile(new_archive_file_name, 'w', ZIP_DEFLATED) as zip_out:
+        add_directory_in_zip_file(zip_out, from_dir, compress_level)
 
-    return shutil.make_archive(new_archive_file_name, 'zip', from_dir)
+    return new_archive_file_name
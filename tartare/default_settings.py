@@ -1,5 +1,6 @@
 # encoding: utf-8
 
+import json
 import os
 from datetime import timedelta
 
@@ -49,6 +50,16 @@ CELERYBEAT_SCHEDULE = {
         'task': 'tartare.tasks.purge_pending_jobs',
         'schedule': crontab(minute=0, hour=19),
         'options': {'expires': 25}
+    },
+    'gridfs-deleted-files-sweep': {
+        'task': 'tartare.tasks.sweep_deleted_gridfs_files',
+        'schedule': timedelta(minutes=10),
+        'options': {'expires': 300}
+    },
+    'gridfs-orphan-files-deletion': {
+        'task': 'tartare.tasks.delete_orphan_gridfs_files',
+        'schedule': crontab(minute=0, hour=3),
+        'options': {'expires': 300}
     }
 }
 
@@ -62,8 +73,71 @@ CELERYBEAT_SCHEDULE_FILENAME = '/tmp/celerybeat-schedule'
 
 CELERYD_HIJACK_ROOT_LOGGER = False
 
+# number of data sources of a contributor downloaded at the same time by a manual contributor export (1 to download
+# them one by one), an automatic update fetches each data source in its own task
+FETCH_POOL_SIZE = int(os.getenv('FETCH_POOL_SIZE', '4'))
+FETCH_MAX_CONCURRENT_BY_HOST = int(os.getenv('FETCH_MAX_CONCURRENT_BY_HOST', '2'))
+# time in seconds during which file names guessed from urls (with HEAD requests) are kept
+FETCH_GUESSED_FILE_NAME_TTL = int(os.getenv('FETCH_GUESSED_FILE_NAME_TTL', '3600'))
+# downloads interrupted by a network error are kept there (by data source) to be resumed by the next fetch
+FETCH_PARTIAL_DOWNLOADS_DIR = os.getenv('FETCH_PARTIAL_DOWNLOADS_DIR', '/tmp/tartare/partial_downloads')
+# during an automatic update, the export of a data source sharing its url and credentials with the data source
+# downloading the file is retried every FETCH_SHARED_RETRY_DELAY seconds until the file is available, at most
+# FETCH_SHARED_MAX_RETRIES times before downloading it itself
+FETCH_SHARED_RETRY_DELAY = int(os.getenv('FETCH_SHARED_RETRY_DELAY', '30'))
+FETCH_SHARED_MAX_RETRIES = int(os.getenv('FETCH_SHARED_MAX_RETRIES', '20'))
+
+# names and sizes of the members of a data set archive are stored with the data set (to avoid opening the archive
+# to list them) up to this number of members
+DATA_SET_MAX_INDEXED_ZIP_MEMBERS = int(os.getenv('DATA_SET_MAX_INDEXED_ZIP_MEMBERS', '500'))
+
+# files with identical content and name are stored once in GridFS and shared by reference counting
+GRIDFS_CONTENT_ADDRESSED = True if os.getenv('GRIDFS_CONTENT_ADDRESSED', 'False') == 'True' else False
+# time in seconds during which files deleted from GridFS can still be read by running tasks before being swept
+GRIDFS_DELETED_FILES_GRACE_PERIOD = int(os.getenv('GRIDFS_DELETED_FILES_GRACE_PERIOD', '3600'))
+# GridFS files referenced nowhere are deleted once older than this time in hours (running exports may still use them)
+GRIDFS_ORPHAN_FILES_MIN_AGE = int(os.getenv('GRIDFS_ORPHAN_FILES_MIN_AGE', '24'))
+# GridFS files read by processes can be cached on the local disk of the worker, max size in MB (0 to disable),
+# files larger than the max size are not cached
+GRIDFS_CACHE_DIR = os.getenv('GRIDFS_CACHE_DIR', '/tmp/tartare/gridfs_cache')
+GRIDFS_CACHE_MAX_SIZE = int(os.getenv('GRIDFS_CACHE_MAX_SIZE', '0'))
+# GridFS files read without the local cache fetch this number of chunks by query and keep the last cached chunks
+GRIDFS_READ_AHEAD_CHUNKS = int(os.getenv('GRIDFS_READ_AHEAD_CHUNKS', '4'))
+GRIDFS_CACHED_CHUNKS = int(os.getenv('GRIDFS_CACHED_CHUNKS', '16'))
+
+# archives built by processes: deflate level (0 to store files without compression, faster for archives only read by
+# the next processes), number of threads compressing blocks of ZIP_COMPRESSION_BLOCK_SIZE KB in parallel
+ZIP_COMPRESSION_LEVEL = int(os.getenv('ZIP_COMPRESSION_LEVEL', '6'))
+ZIP_COMPRESSION_THREADS = int(os.getenv('ZIP_COMPRESSION_THREADS', '4'))
+ZIP_COMPRESSION_BLOCK_SIZE = int(os.getenv('ZIP_COMPRESSION_BLOCK_SIZE', '4096'))
+
+# number of rows read at once by processes streaming large csv files (stop_times.txt)
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '100000'))
+
+# coverage export files downloaded from the api are served from a mirror on the local disk, max size in MB (0 to
+# disable), with zero-copy file responses of the wsgi server or, behind a reverse proxy, with its internal redirection
+# header: 'X-Sendfile' (apache, lighttpd) or 'X-Accel-Redirect' (nginx, with an internal location serving the mirror
+# directory at FILE_DOWNLOAD_ACCEL_REDIRECT_LOCATION)
+FILE_DOWNLOAD_MIRROR_DIR = os.getenv('FILE_DOWNLOAD_MIRROR_DIR', '/tmp/tartare/download_mirror')
+FILE_DOWNLOAD_MIRROR_MAX_SIZE = int(os.getenv('FILE_DOWNLOAD_MIRROR_MAX_SIZE', '0'))
+FILE_DOWNLOAD_SENDFILE_HEADER = os.getenv('FILE_DOWNLOAD_SENDFILE_HEADER', '')
+FILE_DOWNLOAD_ACCEL_REDIRECT_LOCATION = os.getenv('FILE_DOWNLOAD_ACCEL_REDIRECT_LOCATION', '/download_mirror/')
+
 TYR_UPLOAD_TIMEOUT = int(os.getenv('TYR_UPLOAD_TIMEOUT', '10'))
 
+# pooled keep-alive http sessions used for fetching, fusio calls and publishing (see tartare.core.http_session)
+# default timeouts in seconds of the calls without their own timeout: fetches (the read timeout applies to each read
+# of a download, not to the whole download) and fusio calls other than uploads, publishing uses TYR_UPLOAD_TIMEOUT
+HTTP_CONNECT_TIMEOUT = int(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = int(os.getenv('HTTP_READ_TIMEOUT', '60'))
+# read timeout of fusio calls uploading a file (data update, external settings), 0 for no timeout
+FUSIO_UPLOAD_READ_TIMEOUT = int(os.getenv('FUSIO_UPLOAD_READ_TIMEOUT', '0'))
+# number of hosts for which connections are kept and max number of kept connections by host
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+# max number of kept connections for specific hosts, ex: {"fusio.canaltp.local": 2}
+HTTP_POOL_MAXSIZE_BY_HOST = json.loads(os.getenv('HTTP_POOL_MAXSIZE_BY_HOST', '{}'))
+
 FUSIO_STOP_MAX_ATTEMPT_NUMBER = int(os.getenv('FUSIO_STOP_MAX_ATTEMPT_NUMBER', '100'))
 # 10 seconds
 FUSIO_WAIT_FIXED = 10*1000
@@ -44,6 +44,10 @@ class InvalidFile(Exception):
         self.message = message
 
 
+class UnsortedFile(InvalidFile):
+    pass
+
+
 class ProtocolException(Exception):
     pass
 
@@ -68,6 +72,14 @@ class FetcherException(Exception):
     pass
 
 
+class FileNotModifiedException(Exception):
+    pass
+
+
+class SharedFetchPendingException(Exception):
+    pass
+
+
 class FusioException(Exception):
     pass
 
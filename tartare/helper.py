@@ -34,7 +34,7 @@ import uuid
 import zipfile
 from collections.abc import Mapping
 from datetime import datetime, date
-from hashlib import md5
+from hashlib import md5, sha256
 from io import StringIO
 from io import TextIOWrapper
 from typing import Optional, Dict, Iterable
@@ -100,11 +100,43 @@ def get_md5_content_file(file: Union[str, bytes, int]) -> str:
         hasher.update(file)
         return hasher.hexdigest()
     with open(file, "rb") as f:
-        data = f.read()
-        hasher.update(data)
+        for data in iter(lambda: f.read(DigestStream.chunk_size), b''):
+            hasher.update(data)
         return hasher.hexdigest()
 
 
+class DigestStream(object):
+    """
+    wraps a binary stream to compute md5 and sha256 of the data read from or written into it
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, stream: Any) -> None:
+        self.stream = stream
+        self.md5 = md5()
+        self.sha256 = sha256()
+
+    def update(self, data: bytes) -> None:
+        self.md5.update(data)
+        self.sha256.update(data)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.update(data)
+        return data
+
+    def write(self, data: bytes) -> int:
+        self.update(data)
+        return self.stream.write(data)
+
+    def flush(self) -> None:
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+    def get_digest(self) -> Dict[str, str]:
+        return {'md5': self.md5.hexdigest(), 'sha256': self.sha256.hexdigest()}
+
+
 def setdefault_ids(collections: List[dict]) -> None:
     for c in collections:
         c.setdefault('id', str(uuid.uuid4()))
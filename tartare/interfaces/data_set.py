@@ -53,8 +53,11 @@ class DataSet(Resource):
             contributor = Contributor.get(contributor_id)
             data_source = contributor.get_data_source(data_source_id)
             data_source.fetch_started_at = None
-            validity_period = ValidityPeriodFinder.select_computer_and_find(file, data_source.data_format)
-            data_set = DataSetModel(validity_period=validity_period)
+            data_set = DataSetModel()
+            data_set.index_zip_members(file)
+            data_set.validity_period = ValidityPeriodFinder.select_computer_and_find(file, data_source.data_format,
+                                                                                     data_set.get_file_names())
+            data_set.compute_service_profile(file, data_source.data_format)
             data_set.add_file_from_io(file, os.path.basename(file.filename))
             data_source.add_data_set_and_update_owner(data_set, contributor)
             return {'data_sets': [schema.DataSetSchema().dump(data_set).data]}, 201
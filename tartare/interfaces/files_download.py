@@ -27,17 +27,70 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
+from typing import Optional, Iterable
+
 import flask_restful
-from flask import Response, send_file
+from flask import Response, request
+from gridfs.grid_file import GridOut
+from werkzeug.wsgi import FileWrapper, wrap_file
+
+from tartare import app
+from tartare.core.gridfs_cache import GridFsDiskCache
 from tartare.core.gridfs_handler import GridFsHandler
+from tartare.core.models import CoverageExport
 from tartare.decorators import validate_file_params
-from typing import Any
 
 
 class FileDownload(flask_restful.Resource):
     @validate_file_params()
     def get(self, file_id: str) -> Response:
-        file = GridFsHandler().get_file_from_gridfs(id=file_id)
-        return send_file(file, as_attachment=True,
-                         attachment_filename=file.filename,
-                         mimetype='multipart/form-data')
+        """
+        conditional (ETag from the file digest and Last-Modified) and range requests are supported,
+        only the chunks of the requested range are read from GridFS
+        """
+        gridfs_handler = GridFsHandler()
+        if app.config.get('FILE_DOWNLOAD_MIRROR_MAX_SIZE') and CoverageExport.exists_with_file(file_id):
+            return self.get_mirrored_file_response(gridfs_handler.get_file_from_gridfs(file_id))
+        file = gridfs_handler.get_file_from_gridfs(id=file_id, read_ahead=True)
+        # werkzeug FileWrapper is seekable: a range is read from its start instead of skipping the previous chunks
+        response = self.create_response(file, FileWrapper(file, file.chunk_size))
+        return response.make_conditional(request, accept_ranges=True, complete_length=file.length)
+
+    @staticmethod
+    def create_response(file: GridOut, body: Optional[Iterable[bytes]]) -> Response:
+        response = Response(body, mimetype='multipart/form-data', direct_passthrough=True)
+        response.headers.add('Content-Disposition', 'attachment', filename=file.filename)
+        if body is not None:
+            response.content_length = file.length
+        digest = file.metadata if file.metadata else {'md5': file.md5}
+        response.set_etag(digest.get('sha256', digest.get('md5')))
+        response.last_modified = file.upload_date
+        return response
+
+    @classmethod
+    def get_mirrored_file_response(cls, grid_out: GridOut) -> Response:
+        """
+        coverage exports are downloaded far more often than they change: they are served from a local mirror,
+        by the reverse proxy if configured (the proxy then handles range requests) or by the wsgi server
+        """
+        mirror = GridFsDiskCache(app.config['FILE_DOWNLOAD_MIRROR_DIR'],
+                                 app.config['FILE_DOWNLOAD_MIRROR_MAX_SIZE'] * 1024 * 1024)
+        file = mirror.open(grid_out)
+        sendfile_header = app.config.get('FILE_DOWNLOAD_SENDFILE_HEADER')
+        if sendfile_header:
+            file.close()
+            response = cls.create_response(file, None)
+            if sendfile_header == 'X-Accel-Redirect':
+                response.headers[sendfile_header] = app.config['FILE_DOWNLOAD_ACCEL_REDIRECT_LOCATION'] + str(file._id)
+            else:
+                response.headers[sendfile_header] = mirror.get_path(str(file._id))
+            # length and ranges are handled by the reverse proxy sending the file
+            response.automatically_set_content_length = False
+            response.make_conditional(request)
+            del response.headers['Accept-Ranges']
+            return response
+        # file wrapper of the wsgi server sends the whole file without copy (sendfile), ranges need a seekable wrapper
+        body = FileWrapper(file, grid_out.chunk_size) if 'Range' in request.headers else \
+            wrap_file(request.environ, file, grid_out.chunk_size)
+        response = cls.create_response(file, body)
+        return response.make_conditional(request, accept_ranges=True, complete_length=file.length)
@@ -35,7 +35,7 @@ from marshmallow import Schema, fields, post_load, validates_schema, ValidationE
 from tartare.core.constants import ACTION_TYPE_COVERAGE_EXPORT, ACTION_TYPE_AUTO_COVERAGE_EXPORT, \
     ACTION_TYPE_AUTO_CONTRIBUTOR_EXPORT
 from tartare.core.models import Job, MongoValidityPeriodSchema, MongoDataSetSchema, \
-    MongoPublicationPlatformSchema, DataSource
+    MongoPublicationPlatformSchema, DataSource, MongoServiceProfileSchema
 from tartare.core.models import MongoContributorSchema, MongoDataSourceSchema, MongoJobSchema, MongoProcessSchema, \
     MongoContributorExportSchema, MongoCoverageExportSchema
 from tartare.core.models import MongoCoverageSchema, Coverage, MongoEnvironmentSchema, MongoEnvironmentListSchema
@@ -73,7 +73,26 @@ class EnvironmentListSchema(MongoEnvironmentListSchema, NoUnknownFieldMixin):
     integration = fields.Nested(EnvironmentSchema, allow_none=True)
 
 
+class ServiceProfileSchema(MongoServiceProfileSchema):
+    class Meta:
+        exclude = ('services_by_day', 'trips_by_day')
+
+
+class DataSetSchema(MongoDataSetSchema):
+    """
+    fields only used internally are not exposed, they are kept from the stored data sets when the owner is updated
+    (see DataSourceAndProcessContainer.fill_data_set_internal_fields_from_existing_object)
+    """
+    id = fields.String()
+    service_profile = fields.Nested(ServiceProfileSchema, allow_none=True, dump_only=True)
+
+    class Meta:
+        exclude = ('zip_members', 'fetch_validators')
+
+
 class DataSourceSchema(MongoDataSourceSchema):
+    data_sets = fields.Nested(DataSetSchema, many=True, required=False, allow_none=True)
+
     @post_dump()
     def remove_password(self, data: dict) -> dict:
         try:
@@ -162,7 +181,3 @@ class CoverageExportSchema(MongoCoverageExportSchema, NoUnknownFieldMixin):
 
 class ValidityPeriodSchema(MongoValidityPeriodSchema, NoUnknownFieldMixin):
     pass
-
-
-class DataSetSchema(MongoDataSetSchema, NoUnknownFieldMixin):
-    id = fields.String()
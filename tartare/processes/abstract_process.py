@@ -27,14 +27,13 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 import logging
-import os
-import shutil
-import tempfile
 import zipfile
 from abc import ABCMeta, abstractmethod
+from functools import partial
 from typing import Any, List, Union, Optional
 from zipfile import is_zipfile
 
+from tartare.core import zip
 from tartare.core.context import Context, ContributorExportContext, CoverageExportContext
 from tartare.core.gridfs_handler import GridFsHandler
 from tartare.core.models import DataSource, Contributor, Coverage, DataSet, ValidityPeriod, NewProcess, \
@@ -107,17 +106,16 @@ class AbstractContributorProcess(AbstractProcess, metaclass=ABCMeta):
                 raise IntegrityException('data source to process {}.{} not found in contributor context'.format(
                     self.contributor_id, data_source_id_to_process
                 ))
-            data_source_gridout = self.gfs.get_file_from_gridfs(data_source_to_process_context.gridfs_id)
-            with zipfile.ZipFile(data_source_gridout, 'r') as zip_file:
-                if not set(expected_files).issubset(set(zip_file.namelist())):
-                    raise RuntimeException('data source {dsid} does not contains required files {files}'.format(
-                        dsid=data_source_id_to_process, files=', '.join(expected_files)
-                    ))
-
-    def replace_in_grid_fs(self, old_gridfs_id: str, zip_file: str, computed_file_name: str) -> str:
-        new_gridfs_id = self.add_in_grid_fs(zip_file, computed_file_name)
-        self.gfs.delete_file_from_gridfs(old_gridfs_id)
-        return new_gridfs_id
+            file_names = data_source_to_process_context.file_names
+            if file_names is None:
+                data_source_gridout = self.gfs.get_file_from_gridfs(data_source_to_process_context.gridfs_id,
+                                                                    read_ahead=True)
+                with zipfile.ZipFile(data_source_gridout, 'r') as zip_file:
+                    file_names = zip_file.namelist()
+            if not set(expected_files).issubset(set(file_names)):
+                raise RuntimeException('data source {dsid} does not contains required files {files}'.format(
+                    dsid=data_source_id_to_process, files=', '.join(expected_files)
+                ))
 
     def add_in_grid_fs(self, zip_file: str, computed_file_name: str) -> str:
         with open(zip_file, 'rb') as new_archive_file:
@@ -126,20 +124,15 @@ class AbstractContributorProcess(AbstractProcess, metaclass=ABCMeta):
 
     def create_archive_and_replace_in_grid_fs(self, old_gridfs_id: str, files: str,
                                               computed_file_name: str = 'gtfs-processed') -> str:
-        if is_zipfile(files):
-            return self.replace_in_grid_fs(old_gridfs_id, files, computed_file_name)
-        with tempfile.TemporaryDirectory() as tmp_out_dir_name:
-            new_archive_file_name = os.path.join(tmp_out_dir_name, computed_file_name)
-            new_archive_file_name = shutil.make_archive(new_archive_file_name, 'zip', files)
-            return self.replace_in_grid_fs(old_gridfs_id, new_archive_file_name, computed_file_name)
+        new_gridfs_id = self.create_archive_and_add_in_grid_fs(files, computed_file_name)
+        self.gfs.delete_file_from_gridfs(old_gridfs_id)
+        return new_gridfs_id
 
     def create_archive_and_add_in_grid_fs(self, files: str, computed_file_name: str = 'gtfs-processed') -> str:
         if is_zipfile(files):
             return self.add_in_grid_fs(files, computed_file_name)
-        with tempfile.TemporaryDirectory() as tmp_out_dir_name:
-            new_archive_file_name = os.path.join(tmp_out_dir_name, computed_file_name)
-            new_archive_file_name = shutil.make_archive(new_archive_file_name, 'zip', files)
-            return self.add_in_grid_fs(new_archive_file_name, computed_file_name)
+        return self.gfs.save_zip_file_in_gridfs(computed_file_name + '.zip',
+                                                partial(zip.add_directory_in_zip_file, from_dir=files))
 
     def check_links(self, data_format_required: List[str]) -> None:
         data_format_exists = set()
@@ -31,14 +31,15 @@ import logging
 import tempfile
 from collections import defaultdict
 from functools import partial
-from typing import Dict, List
+from typing import Dict, List, Iterable, Tuple, Generator
 
+from tartare import app
 from tartare.core import zip
 from tartare.core.constants import DATA_FORMAT_DIRECTION_CONFIG
 from tartare.core.context import Context, ContributorExportContext
 from tartare.core.models import NewProcess
-from tartare.core.readers import CsvReader
-from tartare.exceptions import IntegrityException
+from tartare.core.readers import GtfsReader
+from tartare.exceptions import IntegrityException, InvalidFile
 from tartare.processes.abstract_process import NewAbstractContributorProcess
 from tartare.processes.utils import process_registry
 
@@ -66,10 +67,10 @@ class ComputeDirections(NewAbstractContributorProcess):
         data_source_export.update_data_set_state(new_gridfs_id)
         return self.context
 
-    def __get_rules(self, trip_to_route: Dict[str, str], trip_stop_sequences: Dict[str, List[str]],
+    def __get_rules(self, trip_to_route: Dict[str, str], trip_stop_sequences: Iterable[Tuple[str, List[str]]],
                     config: Dict[str, List[str]]) -> Dict[str, str]:
         trips_to_fix = {}
-        for a_trip, a_stop_sequence in trip_stop_sequences.items():
+        for a_trip, a_stop_sequence in trip_stop_sequences:
             try:
                 a_route = trip_to_route[a_trip]
                 reference = config[a_route]
@@ -99,14 +100,32 @@ class ComputeDirections(NewAbstractContributorProcess):
                 logging.getLogger(__name__).error(str(e))
         return trips_to_fix
 
-    def __apply_rules(self, trips_reader: CsvReader, trips_file_name: str, trips_to_fix: Dict[str, str]) -> None:
-        trips_reader.apply(column_name='direction_id', callback=lambda row, trips=trips_to_fix:
-        trips_to_fix[row['trip_id']] if row['trip_id'] in trips else row['direction_id'])
+    def __apply_rules(self, trips_reader: GtfsReader, trips_file_name: str, trips_to_fix: Dict[str, str]) -> None:
+        trips_reader.map_column('direction_id', trips_to_fix, key_column='trip_id')
         trips_reader.save_as_csv(trips_file_name)
 
+    def __get_rules_from_stop_times(self, trip_to_route: Dict[str, str],
+                                    config: Dict[str, List[str]]) -> Dict[str, str]:
+        try:
+            return self.__get_rules(trip_to_route, self.__read_stop_sequence_by_trip(trip_to_route), config)
+        except InvalidFile as e:
+            logging.getLogger(__name__).warning('{}, loading the whole file'.format(str(e)))
+            return self.__get_rules(trip_to_route, self.__get_stop_sequence_by_trip(trip_to_route).items(), config)
+
+    def __read_stop_sequence_by_trip(self, trip_to_route: Dict[str, str]) -> Generator[Tuple[str, List[str]], None,
+                                                                                          None]:
+        """
+        stop_times.txt is read by chunks and grouped by trip, stop_ids are sorted by stop_sequence for each trip
+        """
+        stop_times_reader = GtfsReader()
+        for trip_id, stop_times in stop_times_reader.get_csv_groups_from_zip_file(
+                self.file_to_process, 'stop_times.txt', 'trip_id', app.config.get('CSV_CHUNK_SIZE', 100000),
+                keys=trip_to_route, usecols=['trip_id', 'stop_id', 'stop_sequence']):
+            yield trip_id, stop_times.sort_values('stop_sequence')['stop_id'].tolist()
+
     def __get_stop_sequence_by_trip(self, trip_to_route: Dict[str, str]) -> Dict[str, List[str]]:
         trip_stop_sequences = defaultdict(list)  # type: Dict[str, List[str]]
-        stop_times_reader = CsvReader()
+        stop_times_reader = GtfsReader()
         stop_times_reader.load_csv_data_from_zip_file(self.file_to_process, "stop_times.txt",
                                                       usecols=['trip_id', 'stop_id', 'stop_sequence'])
         # the sort_values fixes legacy assumption: "it assumes that stop_times comes in order"
@@ -121,18 +140,17 @@ class ComputeDirections(NewAbstractContributorProcess):
         return trip_stop_sequences
 
     def do_compute_directions(self, trips_file_name: str, config: tuple) -> None:
-        trips_reader = CsvReader()
+        trips_reader = GtfsReader()
         trips_reader.load_csv_data(trips_file_name, dtype={'direction_id': str}, keep_default_na=False, sep=',')
 
-        trips_dict = trips_reader.data[trips_reader.data['route_id'].isin(config[1].keys())].to_dict('records')
-        trip_to_route = {trip['trip_id']: trip['route_id'] for trip in trips_dict}
-        trip_stop_sequences = self.__get_stop_sequence_by_trip(trip_to_route)
-        rules = self.__get_rules(trip_to_route, trip_stop_sequences, config[1])
+        trip_to_route = trips_reader.get_mapping('trip_id', 'route_id',
+                                                 mask=trips_reader.get_column('route_id').isin(config[1].keys()))
+        rules = self.__get_rules_from_stop_times(trip_to_route, config[1])
         self.__apply_rules(trips_reader, trips_file_name, rules)
 
     def __process_file_from_gridfs_id(self, gridfs_id_to_process: str, config: Dict[str, List[str]]) -> str:
-        self.file_to_process = self.gfs.get_file_from_gridfs(gridfs_id_to_process)
-        with tempfile.TemporaryDirectory() as tmp_dir_name, tempfile.TemporaryDirectory() as new_tmp_dir_name:
+        with self.gfs.open_file_from_gridfs(gridfs_id_to_process) as self.file_to_process, \
+                tempfile.TemporaryDirectory() as tmp_dir_name, tempfile.TemporaryDirectory() as new_tmp_dir_name:
             gtfs_computed_path = zip.edit_file_in_zip_file_and_pack(self.file_to_process, 'trips.txt', tmp_dir_name,
                                                                     new_tmp_dir_name,
                                                                     callback=partial(self.do_compute_directions,
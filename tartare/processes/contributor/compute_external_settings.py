@@ -29,18 +29,19 @@
 import csv
 import logging
 import os
-import shutil
 import tempfile
 import zipfile
+from functools import partial
 from typing import List
 
 from gridfs import GridOut
 
+from tartare.core import zip
 from tartare.core.constants import DATA_FORMAT_PT_EXTERNAL_SETTINGS, DATA_FORMAT_LINES_REFERENTIAL, \
     DATA_FORMAT_TR_PERIMETER
 from tartare.core.context import Context, ContributorExportContext
 from tartare.core.models import Contributor, DataSource, NewProcess
-from tartare.core.readers import CsvReader, JsonReader
+from tartare.core.readers import CsvReader, GtfsReader, JsonReader
 from tartare.processes.abstract_process import NewAbstractContributorProcess
 from tartare.processes.utils import process_registry
 
@@ -83,20 +84,16 @@ class ComputeExternalSettings(NewAbstractContributorProcess):
 
     def __init_route_id_to_navitia_code_mapping(self, zip_file: GridOut) -> None:
         columns_used = ['route_id', 'agency_id']
-        routes_reader = CsvReader()
+        routes_reader = GtfsReader()
         routes_reader.load_csv_data_from_zip_file(zip_file, "routes.txt", usecols=columns_used)
 
-        route_id_to_navitia_code_list = routes_reader.get_mapping_from_columns(
-            'route_id',
-            lambda row, contrib_trigram=self.contributor_trigram:
-            '{tri}:{rid}{tri}{aid}'.format(tri=contrib_trigram, rid=row['route_id'], aid=str(row['agency_id'])))
-        self.route_id_to_navitia_code = {route_id: navitia_code for row in route_id_to_navitia_code_list for
-                                         route_id, navitia_code in row.items()}
+        routes_reader.format_columns('navitia_code', '{tri}:{route_id}{tri}{agency_id}', tri=self.contributor_trigram)
+        self.route_id_to_navitia_code = routes_reader.get_mapping('route_id', 'navitia_code')
 
     def __create_rules_deactivate_realtime_for_routes_from_gtfs(self, tmp_dir_name: str,
                                                                 writer_properties: csv.DictWriter) -> None:
         routes_file_name = os.path.join(tmp_dir_name, "routes.txt")
-        routes_reader = CsvReader()
+        routes_reader = GtfsReader()
         routes_reader.load_csv_data(routes_file_name, usecols=['route_id'])
         for route_id in routes_reader.data.to_dict('list')['route_id']:
             # On vérifie que c'est bien une ligne de substitution créée par Fusio sur le réseau Transilien
@@ -159,17 +156,15 @@ class ComputeExternalSettings(NewAbstractContributorProcess):
                 )
 
     def __save_csv_files_as_data_set(self, tmp_csv_workspace: str) -> str:
-        with tempfile.TemporaryDirectory() as tmp_out_dir_name:
-            new_archive_file_name = os.path.join(tmp_out_dir_name, DATA_FORMAT_PT_EXTERNAL_SETTINGS)
-            new_archive_file_name = shutil.make_archive(new_archive_file_name, 'zip', tmp_csv_workspace)
-            with open(new_archive_file_name, 'rb') as new_archive_file:
-                new_gridfs_id = self.gfs.save_file_in_gridfs(new_archive_file,
-                                                             filename=DATA_FORMAT_PT_EXTERNAL_SETTINGS + '.zip')
-                return new_gridfs_id
+        return self.gfs.save_zip_file_in_gridfs(DATA_FORMAT_PT_EXTERNAL_SETTINGS + '.zip',
+                                                partial(zip.add_directory_in_zip_file, from_dir=tmp_csv_workspace))
 
     def __process_file_from_gridfs_id(self, gridfs_id_to_process: str) -> str:
-        file_to_process = self.gfs.get_file_from_gridfs(gridfs_id_to_process)
-        self.__init_route_id_to_navitia_code_mapping(file_to_process)
+        with self.gfs.open_file_from_gridfs(gridfs_id_to_process) as file_to_process:
+            self.__init_route_id_to_navitia_code_mapping(file_to_process)
+            return self.__process_file(file_to_process)
+
+    def __process_file(self, file_to_process: GridOut) -> str:
         with zipfile.ZipFile(file_to_process, 'r') as files_zip, \
                 tempfile.TemporaryDirectory() as tmp_dir_name, \
                 tempfile.TemporaryDirectory() as tmp_csv_workspace:
@@ -93,9 +93,8 @@ class Gtfs2Ntfs(AbstractContributorProcess):
                 tempfile.TemporaryDirectory() as extract_dir_path, tempfile.TemporaryDirectory() as dst_dir_path:
             for data_source_id_to_process in self.data_source_ids:
                 data_source_export = self.context.get_data_source_export_from_data_source(data_source_id_to_process)
-                data_source_gridout = self.gfs.get_file_from_gridfs(data_source_export.gridfs_id)
-
-                with ZipFile(data_source_gridout, 'r') as files_zip:
+                with self.gfs.open_file_from_gridfs(data_source_export.gridfs_id) as data_source_gridout, \
+                        ZipFile(data_source_gridout, 'r') as files_zip:
                     files_zip.extractall(extract_dir_path)
 
                     logger.info("Converting GTFS {} from contributor {}, to NTFS".format(data_source_id_to_process,
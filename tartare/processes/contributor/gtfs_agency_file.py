@@ -31,7 +31,9 @@ import os
 import tempfile
 from functools import partial
 
-from tartare.core.context import Context, ContributorExportContext
+from gridfs import GridOut
+
+from tartare.core.context import Context, ContributorExportContext, DataSourceExport
 from tartare.core.gridfs_handler import GridFsHandler
 from tartare.core.models import GtfsAgencyFileProcess
 from tartare.core.zip import edit_file_in_zip_file_and_pack
@@ -57,8 +59,10 @@ class GtfsAgencyFile(NewAbstractContributorProcess):
     def do(self) -> Context:
         data_source_id = self.data_source_ids[0]
         data_source_export = self.context.get_data_source_export_from_data_source(data_source_id)
-        grid_out = GridFsHandler().get_file_from_gridfs(data_source_export.gridfs_id)
+        with GridFsHandler().open_file_from_gridfs(data_source_export.gridfs_id) as grid_out:
+            return self.__edit_agency_file(data_source_export, grid_out)
 
+    def __edit_agency_file(self, data_source_export: DataSourceExport, grid_out: GridOut) -> Context:
         data = get_content_file_from_grid_out_file(grid_out, 'agency.txt')
 
         if len(data) > 1:
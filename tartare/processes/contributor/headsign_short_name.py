@@ -32,12 +32,11 @@ import tempfile
 from functools import partial
 
 from gridfs import GridOut
-from pandas.core.series import Series
 
 from tartare.core import zip
 from tartare.core.context import Context
 from tartare.core.gridfs_handler import GridFsHandler
-from tartare.core.readers import CsvReader
+from tartare.core.readers import GtfsReader
 from tartare.exceptions import ColumnNotFound, RuntimeException
 from tartare.processes.abstract_process import NewAbstractContributorProcess
 from tartare.processes.utils import process_registry
@@ -49,33 +48,30 @@ class HeadsignShortName(NewAbstractContributorProcess):
     METRO = 1
     RAIL = 2
 
-    def get_trip_short_name(self, row: Series, map_route_modes: dict) -> str:
-
-        # Metro
-        if map_route_modes.get(row['route_id']) == self.METRO:
-            return ''
-        # Train Ter
-        if map_route_modes.get(row['route_id']) == self.RAIL and row["route_id"].startswith("800:TER"):
-            return row['trip_headsign']
-        return row['trip_short_name']
-
     def get_map_route_modes(self, grid_out: GridOut) -> dict:
-        reader = CsvReader()
+        reader = GtfsReader()
         reader.load_csv_data_from_zip_file(grid_out,
                                            'routes.txt',
                                            usecols=["route_id", "route_type"],
                                            keep_default_na=False, low_memory=False)
-        return reader.data.groupby('route_id')['route_type'].apply(lambda x: x.iloc[0]).to_dict()
+        # first route_type of each route
+        reader.data = reader.data.drop_duplicates('route_id')
+        return reader.get_mapping('route_id', 'route_type')
 
     def do_manage_headsign_short_name(self, filename: str, map_route_modes: dict) -> None:
-        reader = CsvReader()
+        reader = GtfsReader()
         reader.load_csv_data(filename, keep_default_na=False, low_memory=False)
 
         try:
-            reader.apply(column_name='trip_short_name',
-                         callback=lambda row: self.get_trip_short_name(row, map_route_modes))
+            route_modes = reader.get_mapped_column('route_id', map_route_modes)
+            # Metro
+            reader.assign_where('trip_short_name', route_modes == self.METRO, '')
+            # Train Ter
+            is_ter = (route_modes == self.RAIL) & reader.get_column('route_id').str.startswith('800:TER')
+            if is_ter.any():
+                reader.assign_where('trip_short_name', is_ter, reader.get_column('trip_headsign'))
             # For All modes
-            reader.apply(column_name='trip_headsign', callback=lambda _: '')
+            reader.data['trip_headsign'] = ''
         except ColumnNotFound as e:
             msg = 'error in file "{}": {}'.format(os.path.basename(filename), str(e))
             raise RuntimeException(self.format_error_message(msg))
@@ -86,10 +82,9 @@ class HeadsignShortName(NewAbstractContributorProcess):
         data_source_id = self.data_source_ids[0]
         data_source_export = self.context.get_data_source_export_from_data_source(data_source_id)
 
-        grid_out = GridFsHandler().get_file_from_gridfs(data_source_export.gridfs_id)
-        map_route_modes = self.get_map_route_modes(grid_out)
-
-        with tempfile.TemporaryDirectory() as extract_zip_path, tempfile.TemporaryDirectory() as new_zip_path:
+        with GridFsHandler().open_file_from_gridfs(data_source_export.gridfs_id) as grid_out, \
+                tempfile.TemporaryDirectory() as extract_zip_path, tempfile.TemporaryDirectory() as new_zip_path:
+            map_route_modes = self.get_map_route_modes(grid_out)
             gtfs_computed_path = zip.edit_file_in_zip_file_and_pack(grid_out, 'trips.txt', extract_zip_path,
                                                                     new_zip_path,
                                                                     callback=partial(
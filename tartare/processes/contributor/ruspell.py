@@ -88,25 +88,28 @@ class Ruspell(NewAbstractContributorProcess):
 
     def do(self) -> Context:
         self.check_expected_files(['stops.txt'])
-        with tempfile.TemporaryDirectory() as extract_dir_path, tempfile.TemporaryDirectory() as ruspell_dir_path:
+        with tempfile.TemporaryDirectory() as ruspell_dir_path:
             stops_output_path = os.path.join(ruspell_dir_path, self.stops_output_filename)
             # Get config and banos
             config_path = self.__extract_data_sources_from_gridfs(ruspell_dir_path)
             for data_source_id_to_process in self.data_source_ids:
                 data_source_export = self.context.get_data_source_export_from_data_source(data_source_id_to_process)
 
-                data_source_gridout = self.gfs.get_file_from_gridfs(data_source_export.gridfs_id)
-                zip.edit_file_in_zip_file(data_source_gridout,
-                                          self.stops_filename,
-                                          extract_dir_path,
-                                          callback=partial(self.do_ruspell,
-                                                           stops_output_path=stops_output_path,
-                                                           config_path=config_path
-                                                           )
-                                          )
+                with self.gfs.open_file_from_gridfs(data_source_export.gridfs_id) as data_source_gridout, \
+                        tempfile.TemporaryDirectory() as extract_dir_path, \
+                        tempfile.TemporaryDirectory() as new_zip_path:
+                    gtfs_computed_path = zip.edit_file_in_zip_file_and_pack(data_source_gridout,
+                                                                            self.stops_filename,
+                                                                            extract_dir_path,
+                                                                            new_zip_path,
+                                                                            callback=partial(
+                                                                                self.do_ruspell,
+                                                                                stops_output_path=stops_output_path,
+                                                                                config_path=config_path
+                                                                            )
+                                                                            )
 
-                data_source_export.update_data_set_state(self.create_archive_and_add_in_grid_fs(
-                    files=extract_dir_path,
-                ))
+                    data_source_export.update_data_set_state(
+                        self.create_archive_and_add_in_grid_fs(gtfs_computed_path))
 
         return self.context
@@ -27,11 +27,13 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 from datetime import datetime
-import os
-import tempfile
-from zipfile import ZipFile, ZIP_DEFLATED
+import shutil
+from functools import partial
+from io import StringIO
+from zipfile import ZipFile, ZIP64_LIMIT  # type: ignore
 
-from typing import List
+from gridfs import GridOut
+from typing import List, Dict
 
 from tartare.core.context import Context
 from tartare.core.models import DataSource
@@ -50,6 +52,15 @@ class ComputeODS(NewAbstractCoverageProcess):
         return ['ID', 'Description', 'Format', 'Download', 'Validity start date', 'Validity end date',
                 'Licence', 'License link', 'Size', 'Update date']
 
+    @staticmethod
+    def write_ods_members(zip_out: ZipFile, coverage_id: str, memory_csv: StringIO,
+                          data_sets_with_file_names: Dict[str, GridOut]) -> None:
+        zip_out.writestr('{coverage}.txt'.format(coverage=coverage_id), memory_csv.getvalue())
+        for data_set_file_name, data_set_file in data_sets_with_file_names.items():
+            force_zip64 = data_set_file.length > ZIP64_LIMIT
+            with zip_out.open(data_set_file_name, 'w', force_zip64=force_zip64) as member:  # type: ignore
+                shutil.copyfileobj(data_set_file, member)
+
     def do(self) -> Context:
         meta_data_dict = []
         data_sets_with_file_names = {}
@@ -80,16 +91,12 @@ class ComputeODS(NewAbstractCoverageProcess):
                 }
             )
         memory_csv = dic_to_memory_csv(meta_data_dict, self.metadata_ordered_columns)
-        with tempfile.TemporaryDirectory() as tmp_dirname:
-            zip_file_name = '{coverage}.zip'.format(coverage=coverage.id)
-            zip_full_path = os.path.join(tmp_dirname, zip_file_name)
-            with ZipFile(zip_full_path, 'a', ZIP_DEFLATED, False) as zip_out:
-                zip_out.writestr('{coverage}.txt'.format(coverage=coverage.id), memory_csv.getvalue())
-                for data_set_file_name, data_set_file in data_sets_with_file_names.items():
-                    zip_out.writestr(data_set_file_name, data_set_file.read())
-
-            with open(zip_full_path, 'rb') as zip_full_file:
-                gridfs_id = self.gfs.save_file_in_gridfs(zip_full_file, filename=zip_file_name)
-                self.save_result_into_target_data_source(self.context.coverage, gridfs_id)
+        zip_file_name = '{coverage}.zip'.format(coverage=coverage.id)
+        gridfs_id = self.gfs.save_zip_file_in_gridfs(zip_file_name, partial(self.write_ods_members,
+                                                                            coverage_id=coverage.id,
+                                                                            memory_csv=memory_csv,
+                                                                            data_sets_with_file_names=
+                                                                            data_sets_with_file_names))
+        self.save_result_into_target_data_source(self.context.coverage, gridfs_id)
 
         return self.context
@@ -28,8 +28,7 @@
 # www.navitia.io
 import logging
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.context import Context
 from tartare.core.models import Contributor, DataSource, DataSet
 from tartare.core.validity_period_finder import ValidityPeriodFinder
@@ -69,7 +68,7 @@ class FusioDataUpdate(AbstractFusioProcess):
                 continue
             try:
                 data_set = data_source.get_last_data_set()
-                resp = self.fusio.call(requests.post, api='api',
+                resp = self.fusio.call(http_session.post, api='api',
                                        data=self.__get_data(contributor, data_source, data_set),
                                        files=self.get_files_from_gridfs(data_set.gridfs_id))
                 self.fusio.wait_for_action_terminated(self.fusio.get_action_id(resp.content))
@@ -29,8 +29,7 @@
 import logging
 import tempfile
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.constants import DATA_FORMAT_GTFS, DATA_FORMAT_NTFS, DATA_FORMAT_GOOGLE_TRANSIT
 from tartare.core.context import Context, CoverageExportContext
 from tartare.core.fetcher import HttpFetcher
@@ -87,7 +86,7 @@ class FusioExport(AbstractFusioProcess):
             'ExportType': self.get_export_type(),
             'Source': 4
         }
-        resp = self.fusio.call(requests.post, api='api', data=data)
+        resp = self.fusio.call(http_session.post, api='api', data=data)
         action_id = self.fusio.get_action_id(resp.content)
         self.fusio.wait_for_action_terminated(action_id)
 
@@ -29,8 +29,7 @@
 import logging
 import tempfile
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.context import Context
 from tartare.core.fetcher import HttpFetcher
 from tartare.core.models import MongoPlatformSchema
@@ -67,7 +66,7 @@ class FusioExportContributor(AbstractFusioProcess):
             'isadapted': self.is_adapted_value_no_strike
         }
         logging.getLogger(__name__).info('fusio export contributor called with {}'.format(data))
-        resp = self.fusio.call(requests.post, api='api', data=data)
+        resp = self.fusio.call(http_session.post, api='api', data=data)
         action_id = self.fusio.get_action_id(resp.content)
         self.fusio.wait_for_action_terminated(action_id)
 
@@ -27,8 +27,7 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.context import Context
 from tartare.core.models import ValidityPeriod, DataSource
 from tartare.exceptions import IntegrityException, ValidityPeriodException
@@ -52,7 +51,7 @@ class FusioImport(AbstractFusioProcess):
 
     def do(self) -> Context:
         validity_period = self.get_validity_period()
-        resp = self.fusio.call(requests.post, api='api',
+        resp = self.fusio.call(http_session.post, api='api',
                                data={
                                    'DateDebut': Fusio.format_date(validity_period.start_date),
                                    'DateFin': Fusio.format_date(validity_period.end_date),
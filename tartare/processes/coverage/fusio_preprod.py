@@ -27,8 +27,7 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.context import Context
 from tartare.processes.abstract_process import AbstractFusioProcess
 from tartare.processes.utils import process_registry
@@ -37,6 +36,6 @@ from tartare.processes.utils import process_registry
 @process_registry('coverage')
 class FusioPreProd(AbstractFusioProcess):
     def do(self) -> Context:
-        resp = self.fusio.call(requests.post, api='api', data={'action': 'settopreproduction'})
+        resp = self.fusio.call(http_session.post, api='api', data={'action': 'settopreproduction'})
         self.fusio.wait_for_action_terminated(self.fusio.get_action_id(resp.content))
         return self.context
@@ -27,8 +27,7 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 
-import requests
-
+from tartare.core import http_session
 from tartare.core.constants import DATA_FORMAT_PT_EXTERNAL_SETTINGS
 from tartare.core.context import Context
 from tartare.core.models import DataSource
@@ -43,7 +42,7 @@ class FusioSendPtExternalSettings(AbstractFusioProcess):
             data_source = DataSource.get_one(data_source_id)
             data_set = data_source.get_last_data_set()
             if data_source.is_of_data_format(DATA_FORMAT_PT_EXTERNAL_SETTINGS):
-                resp = self.fusio.call(requests.post, api='api',
+                resp = self.fusio.call(http_session.post, api='api',
                                        data={'action': 'externalstgupdate'},
                                        files=self.get_files_from_gridfs(data_set.gridfs_id))
                 self.fusio.wait_for_action_terminated(self.fusio.get_action_id(resp.content))
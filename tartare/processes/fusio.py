@@ -33,11 +33,12 @@ from urllib.parse import urlencode
 
 from retrying import retry
 import requests
+from tartare.core import http_session
 from tartare.exceptions import FusioException
 import xml.etree.cElementTree as ElementTree
 from xml.etree.cElementTree import Element
 from tartare import app
-from typing import Optional, Any
+from typing import Optional, Callable, Tuple
 
 
 def is_running(status: str) -> bool:
@@ -71,7 +72,7 @@ class Fusio(object):
         return None if action_id_element is None else action_id_element.text
 
     def get_export_url(self, action_id: str) -> str:
-        response = self.call(requests.get, api='info')
+        response = self.call(http_session.get, api='info')
         if response.status_code != 200:
             raise FusioException('fusio query failed: {}'.format(response))
         root = self.__parse_xml(response.content)
@@ -83,14 +84,22 @@ class Fusio(object):
         return next((action.find('ActionProgression').get('Status') for action in root.iter('Action')
                      if action.get('ActionId') == action_id), None)
 
-    def call(self, method: Any, api: str = 'api',
+    @staticmethod
+    def get_upload_timeout() -> Tuple[int, Optional[int]]:
+        return app.config['HTTP_CONNECT_TIMEOUT'], app.config['FUSIO_UPLOAD_READ_TIMEOUT'] or None
+
+    def call(self, method: Callable[..., requests.Response], api: str = 'api',
              data: Optional[dict] = None,
              files: Optional[dict] = None) -> requests.Response:
         try:
             endpoint = self.url.rstrip('/') + '/' + api
             if data:
                 logging.getLogger(__name__).info('calling fusio: {}?{}'.format(endpoint, urlencode(data)))
-            response = method(endpoint, data=data, files=files)
+            if files:
+                # uploading a data set can take longer than the read timeout of other calls
+                response = method(endpoint, data=data, files=files, timeout=self.get_upload_timeout())
+            else:
+                response = method(endpoint, data=data, files=files)
         except requests.exceptions.Timeout as e:
             msg = 'call to fusio timeout, error: {}'.format(str(e))
             logging.getLogger(__name__).error(msg)
@@ -123,5 +132,5 @@ class Fusio(object):
            stop_max_attempt_number=app.config['FUSIO_STOP_MAX_ATTEMPT_NUMBER'],
            wait_fixed=app.config['FUSIO_WAIT_FIXED'])
     def wait_for_action_terminated(self, action_id: str) -> Optional[str]:
-        response = self.call(requests.get, api='info')
+        response = self.call(http_session.get, api='info')
         return self.__get_status_by_action_id(action_id, response.content)
@@ -28,6 +28,8 @@
 # www.navitia.io
 
 import logging
+import uuid
+from datetime import datetime, timedelta
 from typing import Optional, List, Union
 
 from billiard.einfo import ExceptionInfo
@@ -50,7 +52,7 @@ from tartare.core.models import CoverageExport, Coverage, Job, Contributor, Proc
     PublicationPlatform
 from tartare.core.publisher import ProtocolException, ProtocolManager, Publisher
 from tartare.exceptions import FetcherException, ProtocolManagerException, PublisherManagerException, IntegrityException, \
-    RuntimeException
+    RuntimeException, SharedFetchPendingException
 from tartare.processes.processes import ProcessManager
 
 logger = logging.getLogger(__name__)
@@ -107,15 +109,16 @@ def finish_job(context: Context) -> None:
              max_retries=tartare.app.config.get('RETRY_NUMBER_WHEN_FAILED_TASK'),
              base=CallbackTask)
 def contributor_export(self: Task, context: ContributorExportContext, contributor: Contributor,
-                       check_for_update: bool = True, data_source_to_fetch_id: str = None) -> \
-        Optional[List[str]]:
+                       check_for_update: bool = True, data_source_to_fetch_id: str = None,
+                       fetch_cycle_id: str = None, nb_shared_fetch_retries: int = 0) -> Optional[List[str]]:
     try:
         context.job = context.job.update(state=JOB_STATUS_RUNNING, step="fetching data")
         logger.info(
             'contributor_export of {cid} from job {action}'.format(cid=contributor.id, action=context.job.action_type))
         # Launch fetch all dataset for contributor
         nb_updated_data_sources_fetched = contributor_export_functions.fetch_datasets_and_return_updated_number(
-            contributor, data_source_to_fetch_id)
+            contributor, data_source_to_fetch_id, fetch_cycle_id,
+            wait_for_shared_fetch=nb_shared_fetch_retries < tartare.app.config['FETCH_SHARED_MAX_RETRIES'])
         logger.info('number of data_sources updated for contributor {cid}: {number}'.
                     format(cid=contributor.id, number=nb_updated_data_sources_fetched))
         # contributor export is always done if coming from API call, we skip updated data verification
@@ -127,13 +130,18 @@ def contributor_export(self: Task, context: ContributorExportContext, contributo
             return launch(contributor.processes, context)
         else:
             finish_job(context)
+    except SharedFetchPendingException as exc:
+        logger.debug('{}, retrying contributor export'.format(str(exc)))
+        # waiting retries are not counted in the retries on failure
+        raise self.retry(exc=exc, kwargs=dict(self.request.kwargs, nb_shared_fetch_retries=nb_shared_fetch_retries + 1),
+                         countdown=tartare.app.config['FETCH_SHARED_RETRY_DELAY'], max_retries=None)
     except (FetcherException, RuntimeException) as exc:
         msg = 'contributor export failed{retry_or_not}, error {error}'.format(
             error=str(exc),
             retry_or_not=' (retrying)' if int(tartare.app.config.get('RETRY_NUMBER_WHEN_FAILED_TASK')) else ''
         )
         logger.error(msg)
-        raise self.retry(exc=exc)
+        raise self.retry(exc=exc, max_retries=self.max_retries + nb_shared_fetch_retries)
 
 
 @celery.task(base=CallbackTask)
@@ -249,6 +257,9 @@ def automatic_update() -> None:
     if contributors:
         actions_header = []
         logger.info("fetching {} contributors".format(len(contributors)))
+        # data sources of the cycle with the same url and credentials share a single download
+        fetch_cycle_id = str(uuid.uuid4())
+        models.SharedFetch.delete_claimed_before(24)
         for contributor in contributors:
             for data_source in contributor.data_sources:
                 if data_source.should_fetch():
@@ -257,7 +268,8 @@ def automatic_update() -> None:
                                      action_type=ACTION_TYPE_AUTO_CONTRIBUTOR_EXPORT)
                     job.save()
                     action_export = contributor_export.si(ContributorExportContext(job), contributor,
-                                                          data_source_to_fetch_id=data_source.id)
+                                                          data_source_to_fetch_id=data_source.id,
+                                                          fetch_cycle_id=fetch_cycle_id)
                     actions_header.append(action_export)
         if actions_header:
             chord(actions_header)(automatic_update_launch_coverage_exports.s())
@@ -328,3 +340,25 @@ def purge_pending_jobs() -> None:
     cancelled_jobs = models.Job.cancel_pending_updated_before(nb_hours, statuses)
     if cancelled_jobs:
         mailer.build_purge_report_and_send_mail(cancelled_jobs, nb_hours, statuses)
+
+
+@celery.task()
+def sweep_deleted_gridfs_files() -> None:
+    logger.info('sweep_deleted_gridfs_files')
+    deleted_before = datetime.utcnow() - timedelta(seconds=tartare.app.config['GRIDFS_DELETED_FILES_GRACE_PERIOD'])
+    nb_removed_files = GridFsHandler().sweep_deleted_files(deleted_before)
+    logger.info('{} deleted files removed from gridfs'.format(nb_removed_files))
+
+
+@celery.task()
+def delete_orphan_gridfs_files() -> None:
+    logger.info('delete_orphan_gridfs_files')
+    gridfs_handler = GridFsHandler()
+    uploaded_before = datetime.utcnow() - timedelta(hours=tartare.app.config['GRIDFS_ORPHAN_FILES_MIN_AGE'])
+    # files are listed before references so that a file referenced during the scan is not seen as orphan
+    refcounts = gridfs_handler.get_refcounts_of_files_uploaded_before(uploaded_before)
+    orphan_ids = set(refcounts) - models.get_referenced_gridfs_ids()
+    if orphan_ids:
+        logger.warning('deleting {} orphan files from gridfs: {}'.format(len(orphan_ids), ', '.join(orphan_ids)))
+        # files referenced again since they were listed are kept
+        gridfs_handler.mark_as_deleted({id: refcounts[id] for id in orphan_ids})
@@ -0,0 +1,88 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import mock
+import pytest
+
+from tartare import app
+from tartare.core.contributor_export_functions import fetch_datasets_and_return_updated_number, DownloadedFile
+from tartare.core.models import Contributor, DataSource, InputAuto
+from tartare.exceptions import FetcherException
+
+
+def save_dataset(contributor, data_source, download):
+    return download().file_name != 'unchanged.zip'
+
+
+def download_dataset(data_source, destination_path):
+    if data_source.id.startswith('failing'):
+        raise FetcherException('error during download of file: HTTP Error 500')
+    return DownloadedFile(destination_path, data_source.input.url.split('/')[-1], {}, None)
+
+
+@mock.patch.dict(app.config, {'FETCH_POOL_SIZE': 2})
+@mock.patch('tartare.core.contributor_export_functions.download_dataset', side_effect=download_dataset)
+@mock.patch('tartare.core.contributor_export_functions.save_dataset', side_effect=save_dataset)
+@mock.patch.object(DataSource, 'starts_fetch')
+class TestFetchConcurrently:
+    def __create_contributor(self, data_source_ids):
+        return Contributor('cid', 'cname', 'prefix', data_sources=[
+            DataSource(id=data_source_id, input=InputAuto('http://{}.com/{}.zip'.format(data_source_id, data_source_id),
+                                                          frequency=None))
+            for data_source_id in data_source_ids])
+
+    def test_fetch_concurrently(self, starts_fetch, save_dataset, download_dataset):
+        contributor = self.__create_contributor(['ds1', 'unchanged', 'ds2'])
+        assert fetch_datasets_and_return_updated_number(contributor) == 2
+        assert [args[1].id for args, _ in save_dataset.call_args_list] == ['ds1', 'unchanged', 'ds2']
+
+    def test_other_data_sources_are_saved_when_one_fails(self, starts_fetch, save_dataset, download_dataset):
+        contributor = self.__create_contributor(['ds1', 'failing', 'ds2'])
+        with pytest.raises(FetcherException) as excinfo:
+            fetch_datasets_and_return_updated_number(contributor)
+        assert str(excinfo.value) == 'error during download of file: HTTP Error 500'
+        assert [args[1].id for args, _ in save_dataset.call_args_list] == ['ds1', 'failing', 'ds2']
+        assert sorted(args[0].id for args, _ in download_dataset.call_args_list) == ['ds1', 'ds2', 'failing']
+
+    def test_every_failure_is_logged(self, starts_fetch, save_dataset, download_dataset):
+        contributor = self.__create_contributor(['failing', 'ds1', 'failing_too'])
+        with mock.patch('tartare.core.contributor_export_functions.logger') as logger, \
+                pytest.raises(FetcherException):
+            fetch_datasets_and_return_updated_number(contributor)
+        assert [args[0] for args, _ in logger.exception.call_args_list] == [
+            'fetching data source failing of contributor cid failed: error during download of file: HTTP Error 500',
+            'fetching data source failing_too of contributor cid failed: error during download of file: HTTP Error 500'
+        ]
+        logger.error.assert_called_once_with(
+            '2 data sources of contributor cid failed: failing (error during download of file: HTTP Error 500), '
+            'failing_too (error during download of file: HTTP Error 500)')
+
+    def test_only_the_data_source_to_fetch(self, starts_fetch, save_dataset, download_dataset):
+        contributor = self.__create_contributor(['ds1', 'failing'])
+        assert fetch_datasets_and_return_updated_number(contributor, data_source_to_fetch_id='ds1') == 1
+        assert [args[1].id for args, _ in save_dataset.call_args_list] == ['ds1']
@@ -0,0 +1,167 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import os
+import time
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+from gridfs.errors import CorruptGridFile
+
+from tartare.core.gridfs_cache import GridFsDiskCache, ReadAheadGridOut
+
+
+class FakeGridOut(BytesIO):
+    def __init__(self, id, content, filename='file.zip'):
+        super().__init__(content)
+        self._id = id
+        self.filename = filename
+        self.md5 = 'md5'
+        self.metadata = {'md5': 'md5'}
+        self.length = len(content)
+        self.chunk_size = 4
+        self.upload_date = datetime(2018, 1, 1)
+
+
+def test_open_copies_file_with_grid_out_attributes(tmpdir):
+    with GridFsDiskCache(str(tmpdir), 100).open(FakeGridOut('id1', b'content', 'gtfs.zip')) as cached_file:
+        assert cached_file.read() == b'content'
+        assert cached_file.filename == 'gtfs.zip'
+        assert cached_file.name == 'gtfs.zip'
+        assert cached_file.md5 == 'md5'
+        assert len(cached_file) == 7
+    assert tmpdir.join('id1').read_binary() == b'content'
+
+
+def test_open_reads_cached_file(tmpdir):
+    cache = GridFsDiskCache(str(tmpdir), 100)
+    cache.open(FakeGridOut('id1', b'content')).close()
+    grid_out = FakeGridOut('id1', b'not read')
+    with cache.open(grid_out) as cached_file:
+        assert cached_file.read() == b'content'
+    assert grid_out.tell() == 0
+
+
+def test_open_zip_file(tmpdir):
+    zip_content = BytesIO()
+    with zipfile.ZipFile(zip_content, 'w') as zip_file:
+        zip_file.writestr('stops.txt', 'stop_id')
+    with GridFsDiskCache(str(tmpdir), 1000).open(FakeGridOut('id1', zip_content.getvalue())) as cached_file, \
+            zipfile.ZipFile(cached_file) as zip_file:
+        assert zip_file.read('stops.txt') == b'stop_id'
+
+
+def test_least_recently_used_files_are_removed(tmpdir):
+    cache = GridFsDiskCache(str(tmpdir), 20)
+    cache.open(FakeGridOut('id1', b'0123456789')).close()
+    os.utime(cache.get_path('id1'), (time.time() - 20, time.time() - 20))
+    cache.open(FakeGridOut('id2', b'0123456789')).close()
+    os.utime(cache.get_path('id2'), (time.time() - 30, time.time() - 30))
+    cache.open(FakeGridOut('id1', b'0123456789')).close()
+    cache.open(FakeGridOut('id3', b'0123456789')).close()
+    assert sorted(os.listdir(str(tmpdir))) == ['id1', 'id3']
+
+
+def test_opened_file_bigger_than_cache_is_kept(tmpdir):
+    cache = GridFsDiskCache(str(tmpdir), 5)
+    cache.open(FakeGridOut('id1', b'0123456789')).close()
+    with cache.open(FakeGridOut('id2', b'0123456789')) as cached_file:
+        assert cached_file.read() == b'0123456789'
+    assert os.listdir(str(tmpdir)) == ['id2']
+
+
+def test_stale_downloads_are_removed(tmpdir):
+    tmpdir.join('.stale').write('partial')
+    tmpdir.join('.running').write('partial')
+    os.utime(str(tmpdir.join('.stale')), (time.time() - 7200, time.time() - 7200))
+    GridFsDiskCache(str(tmpdir), 100).open(FakeGridOut('id1', b'content')).close()
+    assert sorted(os.listdir(str(tmpdir))) == ['.running', 'id1']
+
+
+class FakeChunks(object):
+    def __init__(self, content, chunk_size=4):
+        self.chunks = [{'files_id': 'id1', 'n': n, 'data': content[offset:offset + chunk_size]}
+                       for n, offset in enumerate(range(0, len(content), chunk_size))]
+        self.nb_queries = 0
+
+    def find(self, filter):
+        self.nb_queries += 1
+        return [chunk for chunk in self.chunks
+                if chunk['files_id'] == filter['files_id'] and filter['n']['$gte'] <= chunk['n'] < filter['n']['$lt']]
+
+
+def test_read_ahead_reads_several_chunks_by_query():
+    chunks = FakeChunks(b'0123456789abcdef')
+    grid_out = ReadAheadGridOut(FakeGridOut('id1', b'0123456789abcdef'), chunks, read_ahead_chunks=2)
+    assert grid_out.read(3) == b'012'
+    assert grid_out.read(10) == b'3456789abc'
+    assert grid_out.read() == b'def'
+    assert grid_out.read() == b''
+    assert chunks.nb_queries == 2
+
+
+def test_read_ahead_keeps_chunks_when_seeking():
+    chunks = FakeChunks(b'0123456789abcdef')
+    grid_out = ReadAheadGridOut(FakeGridOut('id1', b'0123456789abcdef'), chunks, read_ahead_chunks=1,
+                                cached_chunks=2)
+    grid_out.seek(-2, os.SEEK_END)
+    assert grid_out.read() == b'ef'
+    grid_out.seek(1)
+    assert grid_out.read(2) == b'12'
+    grid_out.seek(-3, os.SEEK_END)
+    assert grid_out.read(1) == b'd'
+    assert chunks.nb_queries == 2
+    grid_out.seek(5)
+    assert grid_out.read(1) == b'5'
+    grid_out.seek(0)
+    assert grid_out.read(1) == b'0'
+    assert chunks.nb_queries == 4
+    assert grid_out.tell() == 1
+
+
+def test_read_ahead_zip_file():
+    zip_content = BytesIO()
+    with zipfile.ZipFile(zip_content, 'w') as zip_file:
+        zip_file.writestr('stops.txt', 'stop_id\n' * 100)
+        zip_file.writestr('trips.txt', 'trip_id\n' * 100)
+    content = zip_content.getvalue()
+    grid_out = FakeGridOut('id1', content)
+    grid_out.chunk_size = 64
+    with zipfile.ZipFile(ReadAheadGridOut(grid_out, FakeChunks(content, 64))) as zip_file:
+        assert zip_file.namelist() == ['stops.txt', 'trips.txt']
+        assert zip_file.read('trips.txt') == b'trip_id\n' * 100
+
+
+def test_read_ahead_missing_chunk():
+    chunks = FakeChunks(b'01234567')
+    chunks.chunks.pop()
+    grid_out = ReadAheadGridOut(FakeGridOut('id1', b'01234567'), chunks)
+    with pytest.raises(CorruptGridFile):
+        grid_out.read()
@@ -27,14 +27,15 @@
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
 from datetime import date
-from io import StringIO
+from hashlib import md5, sha256
+from io import StringIO, BytesIO
 
 import pytest
 import requests_mock
 from mock import mock
 
 from tartare.helper import to_doted_notation, _make_doted_key, get_values_by_key, date_from_string, \
-    dic_to_memory_csv
+    dic_to_memory_csv, DigestStream
 
 
 def test_to_doted_notation_flat():
@@ -143,3 +144,21 @@ def test_dic_to_memory_csv_return_type():
     assert isinstance(csv, StringIO)
     csv = dic_to_memory_csv([{"att1": "val1", "att2": "val2"}], ['att1', 'att2'])
     assert isinstance(csv, StringIO)
+
+
+def test_digest_stream_write():
+    out = BytesIO()
+    digest_stream = DigestStream(out)
+    digest_stream.write(b'some ')
+    digest_stream.write(b'content')
+    assert out.getvalue() == b'some content'
+    assert digest_stream.get_digest() == {'md5': md5(b'some content').hexdigest(),
+                                          'sha256': sha256(b'some content').hexdigest()}
+
+
+def test_digest_stream_read():
+    digest_stream = DigestStream(BytesIO(b'some content'))
+    assert digest_stream.read(4) == b'some'
+    assert digest_stream.read() == b' content'
+    assert digest_stream.get_digest() == {'md5': md5(b'some content').hexdigest(),
+                                          'sha256': sha256(b'some content').hexdigest()}
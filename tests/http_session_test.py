@@ -0,0 +1,64 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+from mock import mock
+
+from tartare import app
+from tartare.core import http_session
+from tartare.core.http_session import HttpSessionManager
+
+
+def test_session_is_reused():
+    assert HttpSessionManager.get_session() is HttpSessionManager.get_session()
+
+
+def test_session_is_renewed_in_forked_process():
+    session = HttpSessionManager.get_session()
+    with mock.patch('os.getpid', return_value=-1):
+        assert HttpSessionManager.get_session() is not session
+
+
+def test_pool_size_by_host():
+    with mock.patch.dict(app.config, {'HTTP_POOL_MAXSIZE_BY_HOST': {'fusio.local': 2}}):
+        session = HttpSessionManager.create_session()
+    assert session.get_adapter('https://fusio.local/api')._pool_maxsize == 2
+    assert session.get_adapter('http://fusio.local:8080/api')._pool_maxsize == 2
+    assert session.get_adapter('https://other.local/api')._pool_maxsize == app.config['HTTP_POOL_MAXSIZE']
+    assert session.get_adapter('https://fusio.local.other.com/api')._pool_maxsize == app.config['HTTP_POOL_MAXSIZE']
+
+
+@mock.patch('requests.Session.request')
+def test_default_timeout(request):
+    http_session.post('http://whatever.com/api', data={'a': 1})
+    assert request.call_args[1]['timeout'] == (app.config['HTTP_CONNECT_TIMEOUT'], app.config['HTTP_READ_TIMEOUT'])
+
+
+@mock.patch('requests.Session.request')
+def test_timeout_can_be_overridden(request):
+    http_session.post('http://whatever.com/api', timeout=3)
+    assert request.call_args[1]['timeout'] == 3
@@ -141,7 +141,7 @@ def action_status(*args, **kwargs):
 
     return response
 from retrying import RetryError
-@mock.patch('requests.get',  side_effect=action_status)
+@mock.patch('tartare.core.http_session.get',  side_effect=action_status)
 def test_wait_for_action_terminated_retry(action_status):
     with pytest.raises(RetryError) as excinfo:
         Fusio(url='bob').wait_for_action_terminated('1607281547155684')
@@ -156,3 +156,15 @@ def test_wait_for_action_terminated_retry(action_status):
     ])
 def test_replace_url_hostname(export_url, fusio_url, expected_url):
     assert Fusio.replace_url_hostname_from_url(export_url, fusio_url) == expected_url
+
+
+def test_call_fusio_upload_without_read_timeout():
+    method = mock.MagicMock(return_value=mock.MagicMock(status_code=200))
+    with mock.patch.dict(app.config, {'HTTP_CONNECT_TIMEOUT': 5, 'FUSIO_UPLOAD_READ_TIMEOUT': 0}):
+        Fusio(url='bob').call(method, api='api', data={'action': 'dataupdate'}, files={'filename': b'content'})
+        assert method.call_args[1]['timeout'] == (5, None)
+        Fusio(url='bob').call(method, api='info')
+        assert 'timeout' not in method.call_args[1]
+    with mock.patch.dict(app.config, {'HTTP_CONNECT_TIMEOUT': 5, 'FUSIO_UPLOAD_READ_TIMEOUT': 600}):
+        Fusio(url='bob').call(method, api='api', data={'action': 'dataupdate'}, files={'filename': b'content'})
+        assert method.call_args[1]['timeout'] == (5, 600)
@@ -30,10 +30,12 @@
 # www.navitia.io
 import json
 
+import mock
 import pytest
 from freezegun import freeze_time
 
 from tartare import app, mongo
+from tartare.core import contributor_export_functions
 from tartare.core.constants import ACTION_TYPE_AUTO_CONTRIBUTOR_EXPORT, ACTION_TYPE_AUTO_COVERAGE_EXPORT, \
     DATA_FORMAT_OSM_FILE, DATA_TYPE_GEOGRAPHIC, DATA_FORMAT_RUSPELL_CONFIG, \
     DATA_FORMAT_DEFAULT, DATA_FORMAT_DIRECTION_CONFIG, DATA_FORMAT_TITAN, DATA_FORMAT_OBITI, DATA_FORMAT_NEPTUNE
@@ -175,6 +177,44 @@ class TestAutomaticUpdate(TartareFixture):
             # when data source url does not change it will not generate a coverage export
             assert len(contributor_export_unchanged_jobs) == 3
 
+    def test_automatic_update_downloads_shared_url_once(self, init_http_download_server):
+        contributors = ['c1', 'c2', 'c3']
+        for contributor in contributors:
+            self.__create_contributor(init_http_download_server.ip_addr, contributor)
+        with mock.patch('tartare.core.contributor_export_functions.download_dataset',
+                        wraps=contributor_export_functions.download_dataset) as download_dataset:
+            jobs = self.run_automatic_update()
+        assert download_dataset.call_count == 1
+        gridfs_ids = set()
+        for contributor in contributors:
+            job = next(job for job in jobs if job['contributor_id'] == contributor)
+            self.__assert_job_is_automatic_update_contributor_export(job, contributor)
+            data_source = next(data_source for data_source in self.get_contributor(contributor)['data_sources']
+                               if data_source['id'] == 'ds_' + contributor)
+            assert len(data_source['data_sets']) == 1
+            gridfs_ids.add(data_source['data_sets'][0]['gridfs_id'])
+        with app.app_context():
+            shared_fetches = list(mongo.db['shared_fetches'].find())
+        assert len(shared_fetches) == 1
+        assert shared_fetches[0]['state'] == 'done'
+        assert shared_fetches[0]['file_name'] == 'some_archive.zip'
+        # the shared file is referenced by the data sets instead of being stored again
+        assert gridfs_ids == {shared_fetches[0]['gridfs_id']}
+
+    def test_automatic_update_downloads_shared_url_when_shared_fetch_does_not_end(self, init_http_download_server):
+        contributors = ['c1', 'c2']
+        for contributor in contributors:
+            self.__create_contributor(init_http_download_server.ip_addr, contributor)
+        with mock.patch('tartare.core.models.SharedFetch.complete'), \
+                mock.patch.dict(app.config, {'FETCH_SHARED_MAX_RETRIES': 2}), \
+                mock.patch('tartare.core.contributor_export_functions.download_dataset',
+                           wraps=contributor_export_functions.download_dataset) as download_dataset:
+            jobs = self.run_automatic_update()
+        assert download_dataset.call_count == 2
+        for contributor in contributors:
+            job = next(job for job in jobs if job['contributor_id'] == contributor)
+            self.__assert_job_is_automatic_update_contributor_export(job, contributor)
+
     def test_data_format_generate_export(self, init_http_download_server):
         with freeze_time(datetime_from_string('2018-01-15 10:00:00 UTC')) as frozen_datetime:
             url = self.format_url(init_http_download_server.ip_addr, 'sample_1.zip')
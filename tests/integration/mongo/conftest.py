@@ -32,6 +32,7 @@ import pytest
 
 from tartare import app, mongo
 from tartare.core import models
+from tartare.core.fetcher import guessed_file_names
 from tests.docker_wrapper import MongoDocker, DownloadHttpServerDocker, DownloadFtpServerDocker, UploadFtpServerDocker, \
     DownloadHttpServerAuthentDocker, DownloadFtpServerAuthentDocker
 from tests.utils import to_json, to_dict
@@ -64,6 +65,12 @@ def empty_mongo(docker):
         models.init_mongo()
 
 
+@pytest.fixture(scope="function", autouse=True)
+def empty_guessed_file_names():
+    """file names guessed from urls are cached by worker, some tests use the same urls with different contents"""
+    guessed_file_names.clear()
+
+
 @pytest.yield_fixture(scope="session", autouse=False)
 def init_http_download_server():
     with DownloadHttpServerDocker() as download_server:
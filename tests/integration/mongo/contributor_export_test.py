@@ -32,7 +32,7 @@
 import pytest
 
 from tartare.core.constants import ACTION_TYPE_CONTRIBUTOR_EXPORT, \
-    JOB_STATUS_FAILED
+    JOB_STATUS_FAILED, DATA_SOURCE_STATUS_FAILED
 from tests.integration.test_mechanism import TartareFixture
 
 
@@ -105,7 +105,7 @@ class TestContributorExport(TartareFixture):
         ('http', 'not_a_zip_file.zip', 'failed', 'fetching data', 'downloaded file from url %url% is not a zip file'),
         ('ftp', 'some_archive.zip', 'done', 'save_contributor_export', None),
         ('ftp', 'unexisting_file.zip', 'failed', 'fetching data',
-         """error during download of file: <urlopen error ftp error: URLError('ftp error: error_perm("550 Can\\'t change directory to unexisting_file.zip: No such file or directory",)',)>"""),
+         "error during download of file: 550 Can't open /gtfs/unexisting_file.zip: No such file or directory"),
         ('ftp', 'not_a_zip_file.zip', 'failed', 'fetching data', 'downloaded file from url %url% is not a zip file')
     ])
     def test_contributor_export_with_http_download(self, init_http_download_server, init_ftp_download_server,
@@ -137,6 +137,23 @@ class TestContributorExport(TartareFixture):
         if error_message:
             assert job['error_message'] == error_message
 
+    def test_contributor_export_fetches_data_sources_concurrently(self, init_http_download_server):
+        ip = init_http_download_server.ip_addr
+        self.init_contributor('cid', 'ds1', self.format_url(ip, 'some_archive.zip'))
+        self.add_data_source_to_contributor('cid', 'ds2', self.format_url(ip, 'sample_1.zip'))
+        self.add_data_source_to_contributor('cid', 'ds3', self.format_url(ip, 'unexisting_file.zip'))
+
+        resp = self.contributor_export('cid', check_done=False)
+        job = self.get_job_from_export_response(resp)
+        assert job['state'] == 'failed'
+        assert job['error_message'] == 'error during download of file: HTTP Error 404: Not Found'
+
+        data_sources = {data_source['id']: data_source for data_source in self.get_contributor('cid')['data_sources']}
+        for data_source_id in ['ds1', 'ds2']:
+            assert len(data_sources[data_source_id]['data_sets']) == 1
+        assert data_sources['ds3']['status'] == DATA_SOURCE_STATUS_FAILED
+        assert not data_sources['ds3']['data_sets']
+
     def test_contributor_export_with_processes_called(self, init_http_download_server, contributor):
         url = self.format_url(ip=init_http_download_server.ip_addr, filename='some_archive.zip')
 
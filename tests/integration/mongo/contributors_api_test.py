@@ -1352,9 +1352,9 @@ class TestContributors(TartareFixture):
                               export_id='export_id')
         self.contributor_export('cid')
         with tartare.app.app_context():
-            assert tartare.mongo.db['fs.files'].find({}).count() == 1
+            assert tartare.mongo.db['fs.files'].find({'deleted_at': {'$exists': False}}).count() == 1
             self.delete('/contributors/cid')
-            assert tartare.mongo.db['fs.files'].find({}).count() == 0
+            assert tartare.mongo.db['fs.files'].find({'deleted_at': {'$exists': False}}).count() == 0
 
     def test_delete_contributor_with_process_remove_files(self, init_http_download_server):
         self.init_contributor('cid', 'dsid', self.format_url(init_http_download_server.ip_addr, 'some_archive.zip'),
@@ -1367,10 +1367,10 @@ class TestContributors(TartareFixture):
         }, 'cid')
         self.contributor_export('cid')
         with tartare.app.app_context():
-            assert tartare.mongo.db['fs.files'].find({}).count() == 2
+            assert tartare.mongo.db['fs.files'].find({'deleted_at': {'$exists': False}}).count() == 2
             raw = self.delete('/contributors/cid')
             self.assert_sucessful_call(raw, 204)
-            assert tartare.mongo.db['fs.files'].find({}).count() == 0
+            assert tartare.mongo.db['fs.files'].find({'deleted_at': {'$exists': False}}).count() == 0
 
     def test_get_data_source_of_unknown_contributor(self):
         raw = self.get('/contributors/unknown/data_sources/stillunknown')
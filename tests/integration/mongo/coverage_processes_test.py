@@ -284,8 +284,8 @@ class TestFusioImportProcess(TartareFixture):
 class TestFusioExportProcess(TartareFixture):
     @mock.patch('tartare.processes.fusio.Fusio.replace_url_hostname_from_url')
     @mock.patch('tartare.processes.fusio.Fusio.wait_for_action_terminated')
-    @mock.patch('requests.post')
-    @mock.patch('requests.get')
+    @mock.patch('tartare.core.http_session.post')
+    @mock.patch('tartare.core.http_session.get')
     def test_fusio_export_avoid_merge_and_use_fusio_export_file(self,
                                                                 fusio_get,
                                                                 fusio_post,
@@ -357,8 +357,8 @@ class TestFusioExportProcess(TartareFixture):
 
     @mock.patch('tartare.processes.fusio.Fusio.replace_url_hostname_from_url')
     @mock.patch('tartare.processes.fusio.Fusio.wait_for_action_terminated')
-    @mock.patch('requests.post')
-    @mock.patch('requests.get')
+    @mock.patch('tartare.core.http_session.post')
+    @mock.patch('tartare.core.http_session.get')
     def test_fusio_export_to_data_source(self,
                                          fusio_get,
                                          fusio_post,
@@ -443,7 +443,7 @@ class TestFusioExportProcess(TartareFixture):
 class TestFusioExportContributorProcess(TartareFixture):
     @mock.patch('tartare.processes.fusio.Fusio.replace_url_hostname_from_url')
     @mock.patch('tartare.processes.fusio.Fusio.wait_for_action_terminated')
-    @mock.patch('requests.post')
+    @mock.patch('tartare.core.http_session.post')
     @mock.patch('tartare.processes.fusio.Fusio.get_export_url')
     def test_fusio_export_contributor(self,
                                       fusio_get,
@@ -111,7 +111,7 @@ class TestDataPublisher(TartareFixture):
         self._create_coverage(coverage_id, 'ds_gtfs', publication_platform)
 
         # Launch contributor export
-        with mock.patch('requests.post', mock_requests_post):
+        with mock.patch('tartare.core.http_session.post', mock_requests_post):
             resp = self.full_export(contributor_id, coverage_id)
             self.assert_sucessful_call(resp, 201)
 
@@ -197,8 +197,8 @@ class TestDataPublisher(TartareFixture):
 
     @mock.patch('tartare.processes.fusio.Fusio.replace_url_hostname_from_url')
     @mock.patch('tartare.processes.fusio.Fusio.wait_for_action_terminated')
-    @mock.patch('requests.post')
-    @mock.patch('requests.get')
+    @mock.patch('tartare.core.http_session.post')
+    @mock.patch('tartare.core.http_session.get')
     @freeze_time("2018-05-14")
     def test_process_compute_ods_with_metadata_fusio(self, fusio_get, fusio_post, wait_for_action_terminated,
                                                      replace_url_hostname_from_url, init_http_download_server, init_ftp_upload_server):
@@ -294,7 +294,7 @@ class TestDataPublisher(TartareFixture):
         self.assert_ods_metadata(coverage_id, test_ods_file_exist)
 
     @freeze_time("2015-08-10")
-    @mock.patch('requests.post', side_effect=[get_response(200), get_response(200), get_response(200)])
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200), get_response(200), get_response(200)])
     def test_publish_environment_respect_sequence_order(self, mock_post, init_http_download_server):
         contributor_id = 'contrib-seq'
         cov_id = 'cov-sequence'
@@ -337,7 +337,7 @@ class TestDataPublisher(TartareFixture):
             assert url.format(env=environment) == mock_post.call_args_list[idx][0][0]
 
     @freeze_time("2015-08-10")
-    @mock.patch('requests.post', side_effect=[get_response(200),
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200),
                                               get_response(200),
                                               get_response(200),
                                               get_response(200),
@@ -388,7 +388,7 @@ class TestDataPublisher(TartareFixture):
             assert url.format(seq=idx) == mock_post.call_args_list[idx][0][0]
 
     @freeze_time("2015-08-10")
-    @mock.patch('requests.post', side_effect=[get_response(200), get_response(500)])
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200), get_response(500)])
     def test_publish_platform_failed(self, mock_post, init_http_download_server):
         contributor_id = 'contrib-pub-failed'
         cov_id = 'cov-sequence'
@@ -433,7 +433,7 @@ class TestDataPublisher(TartareFixture):
             job)
         assert job['state'] == 'failed'
 
-    @mock.patch('requests.post', side_effect=[get_response(200)])
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200)])
     def test_publish_http(self, post_mock, init_http_download_server):
         publish_url = "http://tyr.whatever.com"
         contributor_id = 'fr-idf'
@@ -461,7 +461,7 @@ class TestDataPublisher(TartareFixture):
         assert job['error_message'] == '', print(job)
         assert job['state'] == 'done', print(job)
 
-    @mock.patch('requests.post', side_effect=[get_response(200), get_response(200)])
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200), get_response(200)])
     @pytest.mark.parametrize("data_format,file_name", [
         (DATA_FORMAT_OSM_FILE, 'empty_pbf.osm.pbf'),
         (DATA_FORMAT_POLY_FILE, 'ile-de-france.poly')
@@ -499,7 +499,7 @@ class TestDataPublisher(TartareFixture):
         assert job['error_message'] == '', print(job)
         assert job['state'] == 'done', print(job)
 
-    @mock.patch('requests.post', side_effect=[get_response(200), get_response(200), get_response(200)])
+    @mock.patch('tartare.core.http_session.post', side_effect=[get_response(200), get_response(200), get_response(200)])
     def test_publish_navitia_with_osm_and_poly(self, post_mock, init_http_download_server):
         publish_url = "http://tyr.whatever.com"
         contributor_id = 'fr-idf'
@@ -538,7 +538,7 @@ class TestDataPublisher(TartareFixture):
         assert job['error_message'] == '', print(job)
         assert job['state'] == 'done', print(job)
 
-    @mock.patch('requests.post')
+    @mock.patch('tartare.core.http_session.post')
     @pytest.mark.parametrize("data_format,file_name", [
         (DATA_FORMAT_OSM_FILE, 'empty_pbf.osm.pbf'),
         (DATA_FORMAT_POLY_FILE, 'ile-de-france.poly')
@@ -32,6 +32,8 @@ from tartare.core.constants import DATA_SOURCE_STATUS_NEVER_FETCHED, DATA_SOURCE
 from tests.integration.test_mechanism import TartareFixture
 from tartare import app, mongo
 from bson.objectid import ObjectId
+from hashlib import sha256
+from zipfile import ZipFile
 
 from tests.utils import _get_file_fixture_full_path
 
@@ -95,6 +97,8 @@ class TestDatasetApi(TartareFixture):
         with app.app_context():
             gridfs = mongo.db['fs.files'].find_one({'_id': ObjectId(r["data_sets"][0]["gridfs_id"])})
             assert gridfs["filename"] == "some_archive.zip"
+            assert gridfs["metadata"]["md5"] == gridfs["md5"]
+            assert gridfs["metadata"]["sha256"] == sha256(open(fixtures_path, 'rb').read()).hexdigest()
 
         raw = self.get('/contributors/id_test/data_sources/{}'.format(data_source.get('id')))
         self.assert_sucessful_call(raw)
@@ -104,3 +108,43 @@ class TestDatasetApi(TartareFixture):
         assert not ds['fetch_started_at']
         assert ds['updated_at']
         assert ds['validity_period']
+
+    def test_post_dataset_indexes_zip_members(self, data_source):
+        self.post_manual_data_set('id_test', data_source.get('id'), 'gtfs/some_archive.zip')
+        self.post_manual_data_set('id_test', data_source.get('id'), 'gtfs/minimal_gtfs.zip')
+
+        with app.app_context():
+            data_sets = mongo.db['contributors'].find_one({'_id': 'id_test'})['data_sources'][0]['data_sets']
+        with ZipFile(fixtures_path) as zip_file:
+            assert data_sets[0]['zip_members'] == [{'name': zip_info.filename, 'file_size': zip_info.file_size}
+                                                   for zip_info in zip_file.infolist()]
+        assert [member['name'] for member in data_sets[1]['zip_members']] == ['calendar.txt']
+
+    def test_post_dataset_stores_service_profile(self, data_source):
+        self.post_manual_data_set('id_test', data_source.get('id'), 'gtfs/some_archive.zip')
+
+        with app.app_context():
+            data_set = mongo.db['contributors'].find_one({'_id': 'id_test'})['data_sources'][0]['data_sets'][0]
+        service_profile = data_set['service_profile']
+        assert service_profile['start_date'] == '2015-03-25'
+        assert len(service_profile['services_by_day']) == len(service_profile['trips_by_day'])
+        assert service_profile['rows_by_table']['trips'] == 5
+
+    def test_internal_fields_are_not_exposed_and_kept_on_update(self, data_source):
+        self.post_manual_data_set('id_test', data_source.get('id'), 'gtfs/some_archive.zip')
+
+        raw = self.get('/contributors/id_test')
+        contributor = self.json_to_dict(raw)['contributors'][0]
+        data_set = contributor['data_sources'][0]['data_sets'][0]
+        assert 'zip_members' not in data_set
+        assert 'fetch_validators' not in data_set
+        assert data_set['service_profile']['start_date'] == '2015-03-25'
+        assert 'services_by_day' not in data_set['service_profile']
+        assert 'trips_by_day' not in data_set['service_profile']
+
+        raw = self.put('/contributors/id_test', self.dict_to_json(contributor))
+        self.assert_sucessful_call(raw)
+        with app.app_context():
+            data_set = mongo.db['contributors'].find_one({'_id': 'id_test'})['data_sources'][0]['data_sets'][0]
+        assert data_set['zip_members']
+        assert data_set['service_profile']['trips_by_day']
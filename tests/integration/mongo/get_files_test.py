@@ -31,6 +31,16 @@
 
 
 import json
+import os
+from datetime import date
+from hashlib import sha256
+
+import mock
+import pytest
+
+from tartare import app
+from tartare.core.gridfs_handler import GridFsHandler
+from tartare.core.models import CoverageExport, ValidityPeriod
 from tests.integration.test_mechanism import TartareFixture
 from tests.utils import assert_text_files_equals, _get_file_fixture_full_path
 
@@ -124,3 +134,97 @@ class TestGetFiles(TartareFixture):
                         format(gridfs_id=environments['production']['current_ntfs_id']), follow_redirects=True)
         assert resp.status_code == 200
         assert_text_files_equals(resp.data, fixtures_file)
+
+    def __save_file(self, content):
+        with app.app_context():
+            return GridFsHandler().save_file_in_gridfs(content, filename='ntfs.zip')
+
+    def test_download_file_headers(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id))
+        assert resp.status_code == 200
+        assert resp.data == b'0123456789'
+        assert resp.headers['ETag'] == '"{}"'.format(sha256(b'0123456789').hexdigest())
+        assert resp.headers['Accept-Ranges'] == 'bytes'
+        assert resp.headers['Content-Length'] == '10'
+        assert resp.headers['Content-Disposition'] == 'attachment; filename=ntfs.zip'
+        assert 'Last-Modified' in resp.headers
+
+    def test_download_file_not_modified(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id))
+        resp = self.get('/files/{}/download'.format(gridfs_id), headers={'If-None-Match': resp.headers['ETag']})
+        assert resp.status_code == 304
+        assert resp.data == b''
+        resp = self.get('/files/{}/download'.format(gridfs_id), headers={'If-None-Match': '"other"'})
+        assert resp.status_code == 200
+
+    def test_download_file_modified_since(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id))
+        resp = self.get('/files/{}/download'.format(gridfs_id),
+                        headers={'If-Modified-Since': resp.headers['Last-Modified']})
+        assert resp.status_code == 304
+
+    def test_download_file_range(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id), headers={'Range': 'bytes=4-'})
+        assert resp.status_code == 206
+        assert resp.data == b'456789'
+        assert resp.headers['Content-Range'] == 'bytes 4-9/10'
+        assert resp.headers['Content-Length'] == '6'
+
+    def test_download_file_range_of_modified_file(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id), headers={'Range': 'bytes=4-', 'If-Range': '"other"'})
+        assert resp.status_code == 200
+        assert resp.data == b'0123456789'
+
+    def test_download_file_range_not_satisfiable(self):
+        gridfs_id = self.__save_file(b'0123456789')
+        resp = self.get('/files/{}/download'.format(gridfs_id), headers={'Range': 'bytes=20-'})
+        assert resp.status_code == 416
+
+    def __save_coverage_export_file(self, content):
+        gridfs_id = self.__save_file(content)
+        with app.app_context():
+            CoverageExport('covid', gridfs_id, ValidityPeriod(date(2018, 1, 1), date(2018, 12, 31))).save()
+        return gridfs_id
+
+    def test_download_coverage_export_from_mirror(self, tmpdir):
+        gridfs_id = self.__save_coverage_export_file(b'0123456789')
+        with mock.patch.dict(app.config, {'FILE_DOWNLOAD_MIRROR_MAX_SIZE': 1,
+                                          'FILE_DOWNLOAD_MIRROR_DIR': str(tmpdir)}):
+            resp = self.get('/files/{}/download'.format(gridfs_id))
+            assert resp.status_code == 200
+            assert resp.data == b'0123456789'
+            assert tmpdir.join(gridfs_id).read_binary() == b'0123456789'
+            resp = self.get('/files/{}/download'.format(gridfs_id), headers={'Range': 'bytes=8-'})
+            assert resp.status_code == 206
+            assert resp.data == b'89'
+            resp = self.get('/files/{}/download'.format(gridfs_id), headers={'If-None-Match': resp.headers['ETag']})
+            assert resp.status_code == 304
+
+    def test_download_file_not_exported_is_not_mirrored(self, tmpdir):
+        gridfs_id = self.__save_file(b'0123456789')
+        with mock.patch.dict(app.config, {'FILE_DOWNLOAD_MIRROR_MAX_SIZE': 1,
+                                          'FILE_DOWNLOAD_MIRROR_DIR': str(tmpdir)}):
+            resp = self.get('/files/{}/download'.format(gridfs_id))
+        assert resp.data == b'0123456789'
+        assert not os.listdir(str(tmpdir))
+
+    @pytest.mark.parametrize('sendfile_header,header_value', [
+        ('X-Sendfile', '{mirror_dir}/{gridfs_id}'),
+        ('X-Accel-Redirect', '/download_mirror/{gridfs_id}'),
+    ])
+    def test_download_coverage_export_by_reverse_proxy(self, tmpdir, sendfile_header, header_value):
+        gridfs_id = self.__save_coverage_export_file(b'0123456789')
+        with mock.patch.dict(app.config, {'FILE_DOWNLOAD_MIRROR_MAX_SIZE': 1,
+                                          'FILE_DOWNLOAD_MIRROR_DIR': str(tmpdir),
+                                          'FILE_DOWNLOAD_SENDFILE_HEADER': sendfile_header}):
+            resp = self.get('/files/{}/download'.format(gridfs_id))
+        assert resp.status_code == 200
+        assert resp.data == b''
+        assert resp.headers[sendfile_header] == header_value.format(mirror_dir=str(tmpdir), gridfs_id=gridfs_id)
+        assert resp.headers['ETag'] == '"{}"'.format(sha256(b'0123456789').hexdigest())
+        assert tmpdir.join(gridfs_id).read_binary() == b'0123456789'
@@ -0,0 +1,290 @@
+# coding=utf-8
+
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import os
+import zipfile
+from datetime import datetime, timedelta
+from hashlib import md5, sha256
+from io import BytesIO
+
+import mock
+import pytest
+from bson.objectid import ObjectId
+
+from tartare import app, mongo, tasks
+from tartare.core import models
+from tartare.core.gridfs_cache import CachedGridFile, ReadAheadGridOut
+from tartare.core.gridfs_handler import GridFsHandler
+from tests.integration.test_mechanism import TartareFixture
+
+
+class TestGridFsHandler(TartareFixture):
+    def __count_files(self):
+        return mongo.db['fs.files'].find({}).count()
+
+    def __count_live_files(self):
+        return mongo.db['fs.files'].find({'deleted_at': {'$exists': False}}).count()
+
+    def test_save_and_copy_store_new_files(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            copy_id = handler.copy_file(id)
+            assert copy_id != id
+            assert handler.save_file_in_gridfs(b'content', filename='file.txt') not in [id, copy_id]
+            assert self.__count_files() == 3
+
+    @mock.patch.dict(app.config, {'GRIDFS_CONTENT_ADDRESSED': True})
+    def test_content_addressed_save_references_identical_file(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            digest = {'md5': md5(b'content').hexdigest(), 'sha256': sha256(b'content').hexdigest()}
+            assert handler.save_file_in_gridfs(BytesIO(b'content'), filename='file.txt') == id
+            assert handler.save_file_in_gridfs(BytesIO(b'content'), digest=digest, filename='file.txt') == id
+            assert handler.save_file_in_gridfs(b'content', filename='other.txt') != id
+            assert handler.save_file_in_gridfs(b'other content', filename='file.txt') != id
+            assert self.__count_files() == 3
+            assert mongo.db['fs.files'].find_one({'filename': 'file.txt', 'metadata': digest})['refcount'] == 3
+
+    @mock.patch.dict(app.config, {'GRIDFS_CONTENT_ADDRESSED': True})
+    def test_content_addressed_copy_and_delete(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            assert handler.copy_file(id) == id
+            assert handler.copy_file(id) == id
+            handler.delete_file_from_gridfs(id)
+            handler.delete_file_from_gridfs(id)
+            assert self.__count_live_files() == 1
+            handler.delete_file_from_gridfs(id)
+            assert self.__count_live_files() == 0
+
+    @mock.patch.dict(app.config, {'GRIDFS_CONTENT_ADDRESSED': True})
+    def test_content_addressed_copy_of_file_saved_without_refcount(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = str(handler.gridfs.put(b'content', filename='file.txt'))
+            assert handler.copy_file(id) == id
+            handler.delete_file_from_gridfs(id)
+            assert self.__count_live_files() == 1
+            handler.delete_file_from_gridfs(id)
+            assert self.__count_live_files() == 0
+
+    @mock.patch.dict(app.config, {'GRIDFS_CONTENT_ADDRESSED': True})
+    def test_file_referenced_while_deleted_is_kept(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            find_one_and_update = handler.files.find_one_and_update
+
+            def dereference_then_reference(*args, **kwargs):
+                stored_file = find_one_and_update(*args, **kwargs)
+                GridFsHandler().reference(id)
+                return stored_file
+
+            with mock.patch.object(handler.files, 'find_one_and_update', side_effect=dereference_then_reference):
+                handler.delete_file_from_gridfs(id)
+            assert self.__count_live_files() == 1
+            assert mongo.db['fs.files'].find_one({'_id': ObjectId(id)})['refcount'] == 1
+
+    def test_deleted_file_is_readable_until_swept(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            kept_id = handler.save_file_in_gridfs(b'other content', filename='file.txt')
+            handler.delete_file_from_gridfs(id)
+            assert handler.get_file_from_gridfs(id).read() == b'content'
+            assert handler.sweep_deleted_files(datetime.utcnow() - timedelta(hours=1)) == 0
+            assert handler.sweep_deleted_files(datetime.utcnow() + timedelta(seconds=1)) == 1
+            assert self.__count_files() == 1
+            assert mongo.db['fs.chunks'].find({'files_id': ObjectId(id)}).count() == 0
+            assert handler.get_file_from_gridfs(kept_id).read() == b'other content'
+
+    def test_sweep_deleted_files_by_batch(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            for index in range(5):
+                handler.delete_file_from_gridfs(handler.save_file_in_gridfs(str(index).encode(), filename='file.txt'))
+            assert handler.sweep_deleted_files(datetime.utcnow() + timedelta(seconds=1), batch_size=2) == 5
+            assert self.__count_files() == 0
+            assert mongo.db['fs.chunks'].find({}).count() == 0
+
+    def test_interrupted_sweep_is_completed(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            handler.delete_file_from_gridfs(handler.save_file_in_gridfs(b'content', filename='file.txt'))
+            with mock.patch.object(handler.files, 'delete_many', side_effect=RuntimeError('interrupted')):
+                with pytest.raises(RuntimeError):
+                    handler.sweep_deleted_files(datetime.utcnow() + timedelta(seconds=1))
+            assert mongo.db['fs.chunks'].find({}).count() == 0
+            assert handler.sweep_deleted_files(datetime.utcnow() + timedelta(seconds=1)) == 1
+            assert self.__count_files() == 0
+
+    def test_file_referenced_during_sweep_is_kept(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            handler.delete_file_from_gridfs(id)
+            update_many = handler.files.update_many
+
+            def reference_then_claim(*args, **kwargs):
+                GridFsHandler().reference(id)
+                return update_many(*args, **kwargs)
+
+            with mock.patch.object(handler.files, 'update_many', side_effect=reference_then_claim):
+                assert handler.sweep_deleted_files(datetime.utcnow() + timedelta(seconds=1)) == 0
+            assert self.__count_live_files() == 1
+            assert handler.get_file_from_gridfs(id).read() == b'content'
+
+    def test_file_referenced_again_is_not_marked_as_orphan(self):
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            refcounts = handler.get_refcounts_of_files_uploaded_before(datetime.utcnow() + timedelta(seconds=1))
+            assert refcounts == {id: 1}
+            handler.reference(id)
+            handler.mark_as_deleted(refcounts)
+            assert self.__count_live_files() == 1
+            handler.mark_as_deleted({id: 2})
+            assert self.__count_live_files() == 0
+
+    def test_delete_orphan_files(self, init_http_download_server):
+        self.init_contributor('cid', 'dsid', self.format_url(init_http_download_server.ip_addr, 'some_archive.zip'))
+        self.contributor_export('cid')
+        with app.app_context():
+            nb_referenced_files = self.__count_live_files()
+            assert nb_referenced_files
+            handler = GridFsHandler()
+            orphan_id = handler.save_file_in_gridfs(b'content', filename='file.txt')
+            with mock.patch.dict(app.config, {'GRIDFS_ORPHAN_FILES_MIN_AGE': 0}):
+                tasks.delete_orphan_gridfs_files()
+            assert self.__count_live_files() == nb_referenced_files
+            assert mongo.db['fs.files'].find_one({'_id': ObjectId(orphan_id)})['deleted_at']
+            with mock.patch.dict(app.config, {'GRIDFS_DELETED_FILES_GRACE_PERIOD': -1}):
+                tasks.sweep_deleted_gridfs_files()
+            assert self.__count_files() == nb_referenced_files
+
+    def test_referenced_gridfs_ids(self):
+        with app.app_context():
+            mongo.db['contributors'].insert_one({'_id': 'cid', 'data_sources': [
+                {'id': 'dsid', 'data_sets': [{'gridfs_id': 'contributor_1'}, {'gridfs_id': 'contributor_2'}]}]})
+            mongo.db['coverages'].insert_one({
+                '_id': 'coverage', 'data_sources': [{'id': 'coverage_dsid', 'data_sets': [{'gridfs_id': 'coverage'}]}],
+                'environments': {'production': {'current_ntfs_id': 'ntfs', 'publication_platforms': []},
+                                 'integration': {'current_ntfs_id': None}}})
+            mongo.db['contributor_exports'].insert_one({'_id': 'contributor_export', 'data_sources': [
+                {'data_source_id': 'dsid', 'gridfs_id': 'contributor_1'},
+                {'data_source_id': 'other', 'gridfs_id': 'contributor_export'}]})
+            mongo.db['coverage_exports'].insert_one({'_id': 'coverage_export', 'gridfs_id': 'coverage_export'})
+            mongo.db['shared_fetches'].insert_one({'_id': 'shared_fetch', 'gridfs_id': 'shared_fetch',
+                                                   'file_name': 'gridfs_id'})
+            assert models.get_referenced_gridfs_ids() == {'contributor_1', 'contributor_2', 'coverage', 'ntfs',
+                                                          'contributor_export', 'coverage_export', 'shared_fetch'}
+
+    def test_open_file_from_gridfs_caches_only_small_files(self, tmpdir):
+        with app.app_context(), mock.patch.dict(app.config, {'GRIDFS_CACHE_DIR': str(tmpdir),
+                                                             'GRIDFS_CACHE_MAX_SIZE': 1}):
+            handler = GridFsHandler()
+            small_id = handler.save_file_in_gridfs(b'content', filename='small.txt')
+            big_id = handler.save_file_in_gridfs(b'0' * (1024 * 1024 + 1), filename='big.txt')
+            with handler.open_file_from_gridfs(small_id) as small_file:
+                assert isinstance(small_file, CachedGridFile)
+                assert small_file.read() == b'content'
+            with handler.open_file_from_gridfs(big_id) as big_file:
+                assert isinstance(big_file, ReadAheadGridOut)
+                assert big_file.read() == b'0' * (1024 * 1024 + 1)
+            assert os.listdir(str(tmpdir)) == [small_id]
+
+    def test_delete_orphan_files_keeps_recent_files(self):
+        with app.app_context():
+            GridFsHandler().save_file_in_gridfs(b'content', filename='file.txt')
+            tasks.delete_orphan_gridfs_files()
+            assert self.__count_live_files() == 1
+
+    def test_save_zip_file_streamed_in_gridfs(self):
+        def write_members(zip_out):
+            zip_out.writestr('stops.txt', 'stop_id\nstop_1\n')
+
+        with app.app_context():
+            handler = GridFsHandler()
+            id = handler.save_zip_file_in_gridfs('gtfs.zip', write_members)
+            grid_out = handler.get_file_from_gridfs(id)
+            content = grid_out.read()
+            assert grid_out.filename == 'gtfs.zip'
+            assert grid_out.metadata == {'md5': md5(content).hexdigest(), 'sha256': sha256(content).hexdigest()}
+            with zipfile.ZipFile(BytesIO(content)) as zip_file:
+                assert zip_file.read('stops.txt') == b'stop_id\nstop_1\n'
+
+    def test_save_zip_file_in_gridfs_aborted_on_error(self):
+        def write_members(zip_out):
+            zip_out.writestr('stops.txt', 'stop_id\nstop_1\n')
+            raise ValueError('failure')
+
+        with app.app_context():
+            with pytest.raises(ValueError):
+                GridFsHandler().save_zip_file_in_gridfs('gtfs.zip', write_members)
+            assert self.__count_files() == 0
+            assert mongo.db['fs.chunks'].find({}).count() == 0
+
+
+class TestReadAheadGridOutBenchmark(TartareFixture):
+    """
+    number of queries on fs.chunks by zip operation on a GridOut and on a ReadAheadGridOut
+    """
+    zip_operations = {
+        'list members': lambda zip_file: zip_file.namelist(),
+        'read last member': lambda zip_file: zip_file.read(zip_file.namelist()[-1]),
+        'read all members': lambda zip_file: [zip_file.read(name) for name in zip_file.namelist()],
+        'read all members twice': lambda zip_file: [zip_file.read(name) for name in zip_file.namelist() * 2],
+    }
+
+    def __count_queries(self, file, zip_operation):
+        nb_queries_before = mongo.db.command('serverStatus')['opcounters']['query']
+        with zipfile.ZipFile(file) as zip_file:
+            zip_operation(zip_file)
+        # serverStatus itself is not counted as a query
+        return mongo.db.command('serverStatus')['opcounters']['query'] - nb_queries_before
+
+    @pytest.mark.parametrize('operation', sorted(zip_operations.keys()))
+    def test_read_ahead_chunk_queries(self, operation, tmpdir):
+        archive_path = str(tmpdir.join('archive.zip'))
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for index in range(6):
+                zip_file.writestr('file_{}.txt'.format(index), os.urandom(512 * 1024))
+        with app.app_context(), open(archive_path, 'rb') as archive:
+            handler = GridFsHandler()
+            id = handler.save_file_in_gridfs(archive, filename='archive.zip')
+            nb_grid_out_queries = self.__count_queries(handler.get_file_from_gridfs(id),
+                                                       self.zip_operations[operation])
+            read_ahead_grid_out = handler.get_file_from_gridfs(id, read_ahead=True)
+            nb_read_ahead_queries = self.__count_queries(read_ahead_grid_out, self.zip_operations[operation])
+        assert nb_read_ahead_queries == read_ahead_grid_out.nb_chunk_queries
+        assert nb_read_ahead_queries < nb_grid_out_queries
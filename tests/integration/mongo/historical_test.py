@@ -111,5 +111,5 @@ class TestHistorical(TartareFixture):
         assert raw.count() == min(exports_number, tartare.app.config.get('HISTORICAL'))
 
     def assert_files_number(self, exports_number):
-        raw = mongo.db['fs.files'].find({})
+        raw = mongo.db['fs.files'].find({'deleted_at': {'$exists': False}})
         assert raw.count() == (min(tartare.app.config.get('HISTORICAL'), exports_number) * 3)
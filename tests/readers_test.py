@@ -26,8 +26,19 @@
 # IRC #navitia on freenode
 # https://groups.google.com/d/forum/navitia
 # www.navitia.io
+import io
+import json
+import os
+import time
+import tracemalloc
+from zipfile import ZipFile, ZIP_DEFLATED
 
-from tartare.core.readers import JsonReader, CsvReader
+import pandas as pd
+import pytest
+
+from tartare.core.constants import DATA_FORMAT_NTFS
+from tartare.core.readers import JsonReader, CsvReader, GtfsReader, JsonArrayParser
+from tartare.exceptions import InvalidFile, UnsortedFile, ColumnNotFound
 from tests.utils import _get_file_fixture_full_path
 
 
@@ -67,6 +78,283 @@ class TestCsvReader:
         assert map == [{42: 'bob (23): bordeaux'}, {92: 'toto (25): lyon'}, {66: 'tata (77): nantes'},
                        {1: 'kenny (18): paris'}], print(map)
 
+    def test_get_mapping(self):
+        reader = self.__load_sample()
+        assert reader.get_mapping('id', 'name') == {42: 'bob', 92: 'toto', 66: 'tata', 1: 'kenny'}
+        assert reader.get_mapping('id', 'name', mask=reader.get_column('age') > 24) == {92: 'toto', 66: 'tata'}
+
+    def test_map_column(self):
+        reader = self.__load_sample()
+        reader.map_column('city', {'lyon': 'Lyon', 'paris': 'Paris'})
+        reader.map_column('country', {42: 'fr', 1: 'fr'}, key_column='id')
+        assert reader.data['city'].tolist() == ['bordeaux', 'Lyon', 'nantes', 'Paris']
+        assert reader.data['country'].fillna('').tolist() == ['fr', '', '', 'fr']
+
+    def test_assign_where(self):
+        reader = self.__load_sample()
+        reader.assign_where('city', reader.get_column('age') > 24, reader.get_column('name'))
+        reader.assign_where('name', reader.get_column('id') == 1, '')
+        assert reader.data['city'].tolist() == ['bordeaux', 'toto', 'tata', 'paris']
+        assert reader.data['name'].tolist() == ['bob', 'toto', 'tata', '']
+
+    def test_format_columns(self):
+        reader = self.__load_sample()
+        reader.format_columns('label', '{prefix}:{name} ({age:03d}): {city!r}', prefix='people')
+        assert reader.data['label'].tolist() == ["people:bob (023): 'bordeaux'", "people:toto (025): 'lyon'",
+                                                 "people:tata (077): 'nantes'", "people:kenny (018): 'paris'"]
+
+    def test_join(self):
+        reader = self.__load_sample()
+        reader.join(pd.DataFrame({'city': ['lyon', 'paris'], 'zip_code': ['69000', '75000']}), on='city')
+        assert reader.data['name'].tolist() == ['bob', 'toto', 'tata', 'kenny']
+        assert reader.data['zip_code'].fillna('').tolist() == ['', '69000', '', '75000']
+
+    def test_transform_missing_column(self):
+        reader = self.__load_sample()
+        with pytest.raises(ColumnNotFound) as excinfo:
+            reader.format_columns('label', '{name}:{unknown}')
+        assert excinfo.value.message == 'column "unknown" missing'
+
+    def __create_zip(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'sample.zip')
+        with ZipFile(zip_path, 'w') as zip_file:
+            zip_file.write(_get_file_fixture_full_path('readers/sample.csv'), 'sample.csv')
+            zip_file.writestr('latin1.txt', 'id;name\n1;Hélène\n2;Gaëlle\n'.encode('latin1'))
+        return zip_path
+
+    def test_load_from_zip_file_stream(self, tmpdir):
+        reader = CsvReader()
+        with open(self.__create_zip(tmpdir), 'rb') as zip_file:
+            reader.load_csv_data_from_zip_file(zip_file, 'sample.csv', usecols=['id', 'name'])
+        assert reader.count_rows() == 4
+        assert sorted(reader.data.columns.tolist()) == ['id', 'name']
+
+    @pytest.mark.parametrize('sep,engine', [(';', 'c'), (';', 'python'), ('[;]', 'python')])
+    def test_load_from_zip_file_with_encoding(self, tmpdir, sep, engine):
+        reader = CsvReader()
+        reader.load_csv_data_from_zip_file(self.__create_zip(tmpdir), 'latin1.txt', sep=sep, encoding='latin1',
+                                           engine=engine)
+        assert reader.data['name'].tolist() == ['Hélène', 'Gaëlle']
+
+    def test_load_from_zip_file_by_chunks(self, tmpdir):
+        reader = CsvReader()
+        chunks = list(reader.get_csv_chunks_from_zip_file(self.__create_zip(tmpdir), 'sample.csv', chunksize=3))
+        assert [len(chunk) for chunk in chunks] == [3, 1]
+        assert reader.data is chunks[-1]
+
+    def test_load_from_zip_file_invalid_columns(self, tmpdir):
+        with pytest.raises(InvalidFile) as excinfo:
+            CsvReader().load_csv_data_from_zip_file(self.__create_zip(tmpdir), 'sample.csv', usecols=['unknown'])
+        assert str(excinfo.value).startswith('impossible to parse file sample.csv')
+
+
+class TestGtfsReader:
+    stop_times = 'trip_id,arrival_time,departure_time,stop_id,stop_sequence,pickup_type\n' \
+                 'trip_1,08:00:00,08:01:00,stop_1,1,0\n' \
+                 'trip_1,,,stop_2,2,\n' \
+                 'trip_2,25:10:05,25:10:05,stop_1,1,1\n'
+
+    def __create_zip(self, tmpdir, files):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        with ZipFile(zip_path, 'w') as zip_file:
+            for file_name, content in files.items():
+                zip_file.writestr(file_name, content)
+        return zip_path
+
+    def test_load_with_gtfs_dtypes(self, tmpdir):
+        reader = GtfsReader()
+        reader.load_csv_data_from_zip_file(self.__create_zip(tmpdir, {'stop_times.txt': self.stop_times}),
+                                           'stop_times.txt')
+        dtypes = reader.data.dtypes.astype(str).to_dict()
+        assert dtypes == {'trip_id': 'category', 'arrival_time': 'int32', 'departure_time': 'int32',
+                          'stop_id': 'category', 'stop_sequence': 'int32', 'pickup_type': 'category'}
+        assert reader.data['trip_id'].tolist() == ['trip_1', 'trip_1', 'trip_2']
+        assert reader.data['arrival_time'].tolist() == [28800, -1, 90605]
+
+    def test_load_with_dtype_overridden(self, tmpdir):
+        reader = GtfsReader(parse_times=False)
+        reader.load_csv_data_from_zip_file(self.__create_zip(tmpdir, {'stop_times.txt': self.stop_times}),
+                                           'stop_times.txt', usecols=['trip_id', 'arrival_time', 'stop_sequence'],
+                                           dtype={'trip_id': str}, keep_default_na=False)
+        assert reader.data.dtypes.astype(str).to_dict() == {'trip_id': 'object', 'arrival_time': 'object',
+                                                            'stop_sequence': 'int32'}
+        assert reader.data['arrival_time'].tolist() == ['08:00:00', '', '25:10:05']
+
+    def test_load_with_empty_required_int_column(self, tmpdir):
+        reader = GtfsReader()
+        reader.load_csv_data_from_zip_file(
+            self.__create_zip(tmpdir, {'stop_times.txt': self.stop_times.replace('stop_2,2', 'stop_2,')}),
+            'stop_times.txt')
+        assert str(reader.data['stop_sequence'].dtype) == 'float64'
+        assert str(reader.data['trip_id'].dtype) == 'category'
+
+    def test_load_by_chunks(self, tmpdir):
+        reader = GtfsReader()
+        chunks = list(reader.get_csv_chunks_from_zip_file(
+            self.__create_zip(tmpdir, {'stop_times.txt': self.stop_times}), 'stop_times.txt', chunksize=2))
+        assert [chunk['departure_time'].tolist() for chunk in chunks] == [[28860, -1], [90605]]
+
+    def test_load_groups_by_chunks(self, tmpdir):
+        stop_times = self.stop_times + 'trip_2,25:20:00,25:20:00,stop_3,2,1\n' \
+                                       'trip_3,10:00:00,10:00:00,stop_3,1,\n'
+        groups = GtfsReader().get_csv_groups_from_zip_file(
+            self.__create_zip(tmpdir, {'stop_times.txt': stop_times}), 'stop_times.txt', 'trip_id', chunksize=2)
+        assert [(trip_id, rows['stop_id'].tolist(), rows['arrival_time'].tolist()) for trip_id, rows in groups] == [
+            ('trip_1', ['stop_1', 'stop_2'], [28800, -1]),
+            ('trip_2', ['stop_1', 'stop_3'], [90605, 91200]),
+            ('trip_3', ['stop_3'], [36000]),
+        ]
+
+    def test_load_groups_of_keys(self, tmpdir):
+        stop_times = self.stop_times + 'trip_1,08:10:00,08:10:00,stop_3,3,0\n'
+        groups = GtfsReader().get_csv_groups_from_zip_file(
+            self.__create_zip(tmpdir, {'stop_times.txt': stop_times}), 'stop_times.txt', 'trip_id', chunksize=2,
+            keys={'trip_1'}, usecols=['trip_id', 'stop_sequence'])
+        assert [(trip_id, rows['stop_sequence'].tolist()) for trip_id, rows in groups] == [('trip_1', [1, 2, 3])]
+
+    def test_load_groups_not_consecutive(self, tmpdir):
+        stop_times = self.stop_times + 'trip_1,08:10:00,08:10:00,stop_3,3,0\n'
+        groups = GtfsReader().get_csv_groups_from_zip_file(
+            self.__create_zip(tmpdir, {'stop_times.txt': stop_times}), 'stop_times.txt', 'trip_id', chunksize=2)
+        with pytest.raises(UnsortedFile) as excinfo:
+            list(groups)
+        assert str(excinfo.value) == 'impossible to read file stop_times.txt by trip_id, ' \
+                                     'rows of trip_1 are not consecutive'
+
+    def test_transform_categorical_columns(self, tmpdir):
+        reader = GtfsReader()
+        reader.load_csv_data_from_zip_file(self.__create_zip(tmpdir, {'stop_times.txt': self.stop_times}),
+                                           'stop_times.txt')
+        reader.format_columns('stop_time_id', '{trip_id}-{stop_id}-{pickup_type}')
+        reader.map_column('stop_id', {'stop_1': 'stop_10'})
+        reader.assign_where('pickup_type', reader.get_column('trip_id') == 'trip_1', 3)
+        assert reader.data['stop_time_id'].tolist() == ['trip_1-stop_1-0', 'trip_1-stop_2-nan', 'trip_2-stop_1-1']
+        assert reader.data['stop_id'].tolist() == ['stop_10', 'stop_2', 'stop_10']
+        assert reader.data['pickup_type'].tolist() == [3, 3, '1']
+
+    def test_load_ntfs(self, tmpdir):
+        reader = GtfsReader(DATA_FORMAT_NTFS)
+        reader.load_csv_data_from_zip_file(
+            self.__create_zip(tmpdir, {'object_codes.txt': 'object_type,object_id,object_system,object_code\n'
+                                                           'line,line_1,source,1\n'}),
+            'object_codes.txt')
+        assert reader.data.dtypes.astype(str).to_dict() == {'object_type': 'category', 'object_id': 'category',
+                                                            'object_system': 'category', 'object_code': 'int64'}
+
+
+@pytest.mark.benchmark
+class TestGtfsReaderBenchmark:
+    """
+    peak memory allocated while loading a generated stop_times.txt and memory of the loaded data frame with
+    CsvReader and GtfsReader (run with pytest -m benchmark -s)
+    """
+    nb_trips = 10000
+    nb_stops_by_trip = 30
+
+    def __create_zip(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        lines = ['trip_id,arrival_time,departure_time,stop_id,stop_sequence']
+        for trip in range(self.nb_trips):
+            for sequence in range(self.nb_stops_by_trip):
+                time = '{:02d}:{:02d}:00'.format(5 + (trip + sequence) // 60 % 20, (trip + sequence) % 60)
+                lines.append('trip:{trip},{time},{time},stop_point:{stop},{sequence}'.format(
+                    trip=trip, time=time, stop=(trip * 7 + sequence) % 5000, sequence=sequence))
+        with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('stop_times.txt', '\n'.join(lines) + '\n')
+        return zip_path
+
+    def __load(self, reader, zip_path):
+        tracemalloc.start()
+        try:
+            reader.load_csv_data_from_zip_file(zip_path, 'stop_times.txt')
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return peak, reader.data.memory_usage(deep=True).sum()
+
+    def test_gtfs_reader_memory(self, tmpdir):
+        zip_path = self.__create_zip(tmpdir)
+        csv_peak, csv_size = self.__load(CsvReader(), zip_path)
+        gtfs_peak, gtfs_size = self.__load(GtfsReader(), zip_path)
+        print('stop_times.txt ({} rows): CsvReader peak {:.1f} MB, data {:.1f} MB / '
+              'GtfsReader peak {:.1f} MB, data {:.1f} MB'.format(self.nb_trips * self.nb_stops_by_trip,
+                                                                 csv_peak / 2 ** 20, csv_size / 2 ** 20,
+                                                                 gtfs_peak / 2 ** 20, gtfs_size / 2 ** 20))
+        assert gtfs_size * 5 < csv_size
+        assert gtfs_peak < csv_peak
+
+
+class TestVectorizedTransform:
+    """
+    row by row transformations (apply and get_mapping_from_columns) and the vectorized ones give the same results on a
+    generated trips.txt, as done by HeadsignShortName and ComputeExternalSettings
+    """
+    nb_trips = 300
+
+    def create_zip(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        trips = ['route_id,service_id,trip_id,trip_headsign,trip_short_name,direction_id']
+        for trip in range(self.nb_trips):
+            trips.append('800:{route}:{route},service_{service},trip_{trip},{trip},short_{trip},{direction}'.format(
+                route='TER' if trip % 3 else 'N', service=trip % 20, trip=trip, direction=trip % 2))
+        with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('trips.txt', '\n'.join(trips) + '\n')
+        return zip_path
+
+    def load(self, reader_class, zip_path):
+        reader = reader_class()
+        reader.load_csv_data_from_zip_file(zip_path, 'trips.txt', keep_default_na=False,
+                                           dtype={'direction_id': str})
+        route_modes = {'800:{route}:{route}'.format(route=route): 2 for route in ['TER', 'N']}
+        return reader, route_modes
+
+    def transform_row_by_row(self, zip_path):
+        reader, route_modes = self.load(CsvReader, zip_path)
+        reader.apply('trip_short_name', lambda row: row['trip_headsign'] if route_modes.get(row['route_id']) == 2 and
+                     row['route_id'].startswith('800:TER') else row['trip_short_name'])
+        reader.apply('direction_id', lambda row: '1' if row['trip_id'] == 'trip_0' else row['direction_id'])
+        codes = {key: value for row in reader.get_mapping_from_columns(
+            'trip_id', lambda row: 'OIF:{}{}'.format(row['route_id'], row['service_id'])) for key, value in row.items()}
+        return reader.data, codes
+
+    def transform_vectorized(self, zip_path):
+        reader, route_modes = self.load(GtfsReader, zip_path)
+        is_ter = (reader.get_mapped_column('route_id', route_modes) == 2) & \
+            reader.get_column('route_id').str.startswith('800:TER')
+        reader.assign_where('trip_short_name', is_ter, reader.get_column('trip_headsign'))
+        reader.map_column('direction_id', {'trip_0': '1'}, key_column='trip_id')
+        reader.format_columns('code', 'OIF:{route_id}{service_id}')
+        return reader.data, reader.get_mapping('trip_id', 'code')
+
+    def test_vectorized_transform(self, tmpdir):
+        zip_path = self.create_zip(tmpdir)
+        row_by_row_data, row_by_row_codes = self.transform_row_by_row(zip_path)
+        vectorized_data, vectorized_codes = self.transform_vectorized(zip_path)
+        assert len(vectorized_codes) == self.nb_trips
+        assert vectorized_codes == row_by_row_codes
+        for column in ['trip_short_name', 'direction_id']:
+            assert vectorized_data[column].tolist() == row_by_row_data[column].tolist()
+
+
+@pytest.mark.benchmark
+class TestTransformBenchmark(TestVectorizedTransform):
+    """
+    durations of the row by row and vectorized transformations on a bigger trips.txt
+    (run with pytest -m benchmark -s)
+    """
+    nb_trips = 20000
+
+    def test_transform_duration(self, tmpdir):
+        zip_path = self.create_zip(tmpdir)
+        start = time.perf_counter()
+        self.transform_row_by_row(zip_path)
+        row_by_row_duration = time.perf_counter() - start
+        start = time.perf_counter()
+        self.transform_vectorized(zip_path)
+        vectorized_duration = time.perf_counter() - start
+        print('trips.txt ({} rows): row by row {:.3f} s / vectorized {:.3f} s'.format(
+            self.nb_trips, row_by_row_duration, vectorized_duration))
+
 
 class TestJsonReader:
     def test_load(self):
@@ -104,3 +392,89 @@ class TestJsonReader:
         map = list(iter)
         assert map == [{'Bob': '70 / 180'}, {'Kenny': '72 / 155'}, {'Stan': '74 / 190'}, {'Cartman': '80 / 215'},
                        {'Chef': '66 / 177'}, {'Kyle': '52 / 180'}], print(map)
+
+    def test_load_columns(self):
+        reader = JsonReader()
+        with open(_get_file_fixture_full_path('prepare_external_settings/tr_perimeter_id.json'), 'rb') as perimeter:
+            reader.load_json_data_from_io(perimeter, ['fields.codifligne_line_externalcode', 'fields.lineref',
+                                                      'fields.unknown'])
+        assert list(reader.data.columns) == ['fields.codifligne_line_externalcode', 'fields.lineref']
+        assert reader.count_rows() == 5
+
+    def test_load_columns_distinct_rows(self):
+        reader = JsonReader()
+        reader.load_json_data_from_io(io.BytesIO(json.dumps([
+            {'fields': {'line': 'A', 'mode': 'bus'}, 'id': 1},
+            {'fields': {'line': 'A', 'mode': 'bus'}, 'id': 2},
+            {'fields': {'line': 'B'}, 'id': 3},
+            {'fields': {'line': 'C', 'mode': {'name': 'tram'}}, 'id': 4},
+        ]).encode()), ['fields.line', 'fields.mode'])
+        assert reader.data.fillna('').to_dict('records') == [{'fields.line': 'A', 'fields.mode': 'bus'},
+                                                             {'fields.line': 'B', 'fields.mode': ''},
+                                                             {'fields.line': 'C', 'fields.mode': ''}]
+
+    def test_load_columns_invalid_file(self):
+        with pytest.raises(InvalidFile) as excinfo:
+            JsonReader().load_json_data_from_io(io.StringIO('[{"fields": {"line": "A"}}, {"fields"'),
+                                                ['fields.line'])
+        assert str(excinfo.value).startswith('impossible to parse file')
+
+
+class TestJsonArrayParser:
+    @pytest.mark.parametrize('read_size', [1, 3, 1024])
+    def test_parse_by_blocks(self, read_size):
+        items = [{'name': 'Élise', 'values': [1, 2.5, None]}, 1234567, 'a string with ] and ,', [], {}]
+        content = json.dumps(items, ensure_ascii=False, indent=2).encode()
+        assert list(JsonArrayParser(io.BytesIO(content), read_size)) == items
+        assert list(JsonArrayParser(io.StringIO(content.decode()), read_size)) == items
+
+    @pytest.mark.parametrize('content, items', [
+        (' [ ] ', []),
+        ('{"name": "Bob"}', [{'name': 'Bob'}]),
+        ('42', [42]),
+    ])
+    def test_parse_not_array(self, content, items):
+        assert list(JsonArrayParser(io.StringIO(content), 2)) == items
+
+    @pytest.mark.parametrize('content', ['', '[1, 2', '[1 2]', '[1, 2] 3', '[{"name": }]'])
+    def test_parse_invalid(self, content):
+        with pytest.raises(ValueError):
+            list(JsonArrayParser(io.StringIO(content), 2))
+
+
+@pytest.mark.benchmark
+class TestJsonReaderBenchmark:
+    """
+    peak memory allocated while loading 2 columns of a generated json export with json.load + json_normalize and
+    with the streaming parser (run with pytest -m benchmark -s)
+    """
+    nb_records = 10000
+
+    def test_json_reader_memory(self, tmpdir):
+        json_path = os.path.join(str(tmpdir), 'referential.json')
+        with open(json_path, 'w') as json_file:
+            json.dump([{'datasetid': 'referentiel-des-lignes', 'record_timestamp': '2018-01-01T00:00:00',
+                        'fields': {'id_line': 'C{:05d}'.format(record % 1000), 'externalcode_line': '800:{}'.format(
+                            record % 1000), 'name_line': 'line {}'.format(record),
+                                   'shape': [[2.35 + record / 1e5, 48.85], [2.36, 48.86]] * 5}}
+                       for record in range(self.nb_records)], json_file)
+        columns = ['fields.externalcode_line', 'fields.id_line']
+        peaks = []
+        for streaming in [False, True]:
+            tracemalloc.start()
+            try:
+                with open(json_path, 'rb') as json_file:
+                    if streaming:
+                        reader = JsonReader()
+                        reader.load_json_data_from_io(json_file, columns)
+                        data = reader.data
+                    else:
+                        data = pd.io.json.json_normalize(json.load(json_file)).filter(items=columns) \
+                            .drop_duplicates()
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            assert len(data) == 1000
+        print('json export ({} records, {:.1f} MB): json_normalize peak {:.1f} MB / streaming peak {:.1f} MB'.format(
+            self.nb_records, os.path.getsize(json_path) / 2 ** 20, peaks[0] / 2 ** 20, peaks[1] / 2 ** 20))
+        assert peaks[1] * 10 < peaks[0]
@@ -0,0 +1,210 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+import os
+from datetime import date
+from zipfile import ZipFile
+
+import pandas as pd
+import pytest
+
+from tartare.core.models import ServiceProfile, MongoServiceProfileSchema, DataSet
+from tartare.core.service_calendar import ServiceCalendar
+from tests.utils import _get_file_fixture_full_path
+
+
+def create_calendar(rows):
+    return pd.DataFrame([dict(zip(['service_id'] + ServiceCalendar.weekdays + ['start_date', 'end_date'],
+                                  [service_id] + [int(day) for day in weekdays] +
+                                  [pd.Timestamp(start_date), pd.Timestamp(end_date)]))
+                         for service_id, weekdays, start_date, end_date in rows])
+
+
+def create_calendar_dates(rows):
+    return pd.DataFrame([{'service_id': service_id, 'date': pd.Timestamp(day), 'exception_type': exception_type}
+                         for service_id, day, exception_type in rows])
+
+
+class TestServiceCalendar:
+    # 2017-01-02 is a monday
+    calendar = create_calendar([
+        ('week', '1111100', '2017-01-02', '2017-01-15'),
+        ('weekend', '0000011', '2017-01-02', '2017-01-08'),
+        ('weekend', '0000011', '2017-01-14', '2017-01-15'),
+    ])
+    calendar_dates = create_calendar_dates([
+        ('week', '2017-01-02', 2),
+        ('week', '2017-01-07', 1),
+        ('week', '2017-01-03', 1),
+        ('weekend', '2017-01-09', 2),
+        ('holiday', '2017-01-01', 1),
+    ])
+
+    # periods of 'daily' overlap, 2017-01-06 is removed from two of them
+    overlapping_calendar = create_calendar([
+        ('daily', '1111100', '2017-01-02', '2017-01-08'),
+        ('daily', '0000011', '2017-01-02', '2017-01-08'),
+        ('daily', '1111111', '2017-01-05', '2017-01-11'),
+        ('other', '1010000', '2017-01-02', '2017-01-15'),
+    ])
+    overlapping_calendar_dates = create_calendar_dates([
+        ('daily', '2017-01-06', 2),
+        ('daily', '2017-01-12', 1),
+    ])
+
+    def test_active_days(self):
+        service_calendar = ServiceCalendar(self.calendar, self.calendar_dates)
+        assert service_calendar.start_date == date(2017, 1, 1)
+        assert service_calendar.nb_days == 15
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('week')) == '001111101111100'
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('weekend')) == '000000110000011'
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('holiday')) == '100000000000000'
+        assert not service_calendar.get_active_days('unknown').any()
+
+        service_calendar = ServiceCalendar(self.overlapping_calendar, self.overlapping_calendar_dates)
+        assert service_calendar.start_date == date(2017, 1, 2)
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('daily')) == '11110111111000'
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('other')) == '10100001010000'
+        service_calendar = ServiceCalendar(self.overlapping_calendar)
+        assert ''.join(str(int(day)) for day in service_calendar.get_active_days('daily')) == '11111111110000'
+
+    def test_counts_by_day(self):
+        service_calendar = ServiceCalendar(self.calendar, self.calendar_dates)
+        assert service_calendar.get_counts_by_day().tolist() == [1, 0, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1]
+        trips = pd.Series({'week': 10, 'weekend': 3})
+        assert service_calendar.get_counts_by_day(trips).tolist() == [0, 0, 10, 10, 10, 10, 13, 3, 10, 10, 10, 10,
+                                                                      10, 3, 3]
+
+        service_calendar = ServiceCalendar(self.overlapping_calendar, self.overlapping_calendar_dates)
+        assert service_calendar.get_counts_by_day().tolist() == [2, 1, 2, 1, 0, 1, 1, 2, 1, 2, 1, 0, 0, 0]
+        trips = pd.Series({'daily': 10, 'other': 1})
+        assert service_calendar.get_counts_by_day(trips).tolist() == [11, 10, 11, 10, 0, 10, 10, 11, 10, 11, 10,
+                                                                      0, 0, 0]
+        service_calendar = ServiceCalendar(self.overlapping_calendar)
+        assert service_calendar.get_counts_by_day().tolist() == [2, 1, 2, 1, 1, 1, 1, 2, 1, 2, 0, 0, 0, 0]
+
+    def test_first_and_last_active_dates(self):
+        service_calendar = ServiceCalendar(self.calendar, self.calendar_dates)
+        assert service_calendar.get_first_and_last_active_dates() == (date(2017, 1, 1), date(2017, 1, 15))
+        service_calendar = ServiceCalendar(self.calendar)
+        assert service_calendar.get_first_and_last_active_dates() == (date(2017, 1, 2), date(2017, 1, 15))
+
+    def test_no_active_days(self):
+        assert ServiceCalendar().get_first_and_last_active_dates() is None
+        service_calendar = ServiceCalendar(create_calendar([('week', '0000000', '2017-01-02', '2017-01-15')]),
+                                           create_calendar_dates([('week', '2017-01-20', 2)]))
+        assert service_calendar.get_first_and_last_active_dates() is None
+
+    def test_from_opened_zip_file(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        with ZipFile(_get_file_fixture_full_path('validity_period/remove_dates.zip')) as source_zip, \
+                ZipFile(zip_path, 'w') as zip_file:
+            for file_name in ['calendar.txt', 'calendar_dates.txt']:
+                zip_file.writestr(file_name, source_zip.read(file_name))
+        with ZipFile(zip_path) as zip_file:
+            service_calendar = ServiceCalendar.from_zip_file(zip_file)
+            assert service_calendar.get_first_and_last_active_dates() == (date(2017, 1, 10), date(2017, 1, 24))
+            # the archive is still opened
+            assert zip_file.read('calendar.txt')
+
+
+class TestServiceProfile:
+    def __create_gtfs(self, tmpdir, files):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        with ZipFile(zip_path, 'w') as zip_file:
+            for file_name, content in files.items():
+                zip_file.writestr(file_name, content)
+        return zip_path
+
+    def test_from_zip_file(self, tmpdir):
+        # 2017-01-02 is a monday
+        zip_path = self.__create_gtfs(tmpdir, {
+            'calendar.txt': 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n'
+                            'week,1,1,1,1,1,0,0,20170102,20170108\n'
+                            'sunday,0,0,0,0,0,0,1,20170102,20170108\n',
+            'calendar_dates.txt': 'service_id,date,exception_type\n'
+                                  'week,20170103,2\n',
+            'trips.txt': 'route_id,service_id,trip_id\nr,week,t1\nr,week,t2\nr,sunday,t3',
+            'stops.txt': 'stop_id,stop_name\n',
+        })
+        service_profile = ServiceProfile.from_zip_file(zip_path)
+        assert service_profile.start_date == date(2017, 1, 2)
+        assert service_profile.services_by_day == [1, 0, 1, 1, 1, 0, 1]
+        assert service_profile.trips_by_day == [2, 0, 2, 2, 2, 0, 1]
+        assert service_profile.rows_by_table == {'calendar': 2, 'calendar_dates': 1, 'trips': 3}
+        assert service_profile.get_trips_count(date(2017, 1, 8)) == 1
+        assert service_profile.get_trips_count(date(2017, 1, 9)) == 0
+        assert service_profile.get_days_without_service(date(2017, 1, 1), date(2017, 1, 9)) == \
+            [date(2017, 1, 1), date(2017, 1, 3), date(2017, 1, 7), date(2017, 1, 9)]
+
+        loaded = MongoServiceProfileSchema(strict=True).load(MongoServiceProfileSchema().dump(service_profile).data).data
+        assert vars(loaded) == vars(service_profile)
+
+    def test_no_profile_without_calendar(self, tmpdir):
+        zip_path = self.__create_gtfs(tmpdir, {'stops.txt': 'stop_id,stop_name\n'})
+        assert ServiceProfile.from_zip_file(zip_path) is None
+        assert ServiceProfile.from_zip_file(_get_file_fixture_full_path('geo_data/ile-de-france.poly')) is None
+
+    def test_from_zip_file_with_overlapping_periods(self, tmpdir):
+        # 2017-01-02 is a monday, periods of 'daily' overlap and 2017-01-06 is removed from both
+        zip_path = self.__create_gtfs(tmpdir, {
+            'calendar.txt': 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n'
+                            'daily,1,1,1,1,1,0,0,20170102,20170108\n'
+                            'daily,1,1,1,1,1,1,1,20170105,20170108\n',
+            'calendar_dates.txt': 'service_id,date,exception_type\n'
+                                  'daily,20170106,2\n',
+            'trips.txt': 'route_id,service_id,trip_id\nr,daily,t1\nr,daily,t2\n',
+        })
+        service_profile = ServiceProfile.from_zip_file(zip_path)
+        assert service_profile.services_by_day == [1, 1, 1, 1, 0, 1, 1]
+        assert service_profile.trips_by_day == [2, 2, 2, 2, 0, 2, 2]
+        assert service_profile.get_days_without_service(date(2017, 1, 2), date(2017, 1, 8)) == [date(2017, 1, 6)]
+
+    def test_no_profile_for_corrupted_archive(self, tmpdir):
+        calendar = 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n' + \
+                   'week,1,1,1,1,1,0,0,20170102,20170108\n' * 1000
+        zip_path = self.__create_gtfs(tmpdir, {'calendar.txt': calendar})
+        with open(zip_path, 'r+b') as zip_file:
+            zip_file.seek(100)
+            zip_file.write(b'corrupted')
+        data_set = DataSet()
+        data_set.compute_service_profile(zip_path, 'gtfs')
+        assert data_set.service_profile is None
+
+    @pytest.mark.parametrize('calendar', [
+        'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n'
+        'week,1,1,1,1,1,0,0,2017-01-02,20170108\n',
+        'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n'
+        'week,1,1,1,1,1,0,0,20170102,20171308\n',
+        'service_id,start_date,end_date\nweek,20170102,20170108\n',
+    ])
+    def test_no_profile_for_malformed_calendar(self, tmpdir, calendar):
+        zip_path = self.__create_gtfs(tmpdir, {'calendar.txt': calendar})
+        data_set = DataSet()
+        data_set.compute_service_profile(zip_path, 'gtfs')
+        assert data_set.service_profile is None
@@ -51,6 +51,14 @@ def test_zip_file_only_feed_info():
     assert validity_period.end_date == date(2016, 12, 31)
 
 
+def test_zip_file_with_known_file_names():
+    # members already known (indexed data set) are used instead of reading the zip file
+    file = _get_file_fixture_full_path('validity_period/gtfs_with_feed_info.zip')
+    validity_period = ValidityPeriodFinder.select_computer_and_find(file, DATA_FORMAT_GTFS, ['calendar_dates.txt'])
+    assert validity_period.start_date == date(2016, 10, 4)
+    assert validity_period.end_date == date(2016, 12, 24)
+
+
 def test_zip_file_only_feed_info_invalid():
     file = _get_file_fixture_full_path('validity_period/gtfs_with_feed_info_invalid.zip')
     validity_period = ValidityPeriodFinder.select_computer_and_find(file)
@@ -160,32 +168,33 @@ def test_add_dates():
 
 def test_remove_dates():
     """
-        calendar.txt   :     20170102                    20170131
+        calendar.txt   :     20170102                    20170131   (tuesdays only)
                                 *--------------------------*
         calendar_dates :
                 remove dates : 20170102, 20170103, 20170115 and 20170131
 
-                production date : 20170104 to 20170130
+                production date : 20170110 to 20170124 (first and last remaining tuesdays)
     """
 
     file = _get_file_fixture_full_path('validity_period/remove_dates.zip')
     validity_period = ValidityPeriodFinder.select_computer_and_find(file)
-    assert validity_period.start_date == date(2017, 1, 4)
-    assert validity_period.end_date == date(2017, 1, 30)
+    assert validity_period.start_date == date(2017, 1, 10)
+    assert validity_period.end_date == date(2017, 1, 24)
 
 
 def test_calendar_with_many_periods():
     file = _get_file_fixture_full_path('validity_period/calendar_many_periods.zip')
     validity_period = ValidityPeriodFinder.select_computer_and_find(file)
-    assert validity_period.start_date == date(2017, 1, 2)
-    assert validity_period.end_date == date(2017, 7, 20)
+    # periods from 20170102 to 20170720 with tuesdays only
+    assert validity_period.start_date == date(2017, 1, 3)
+    assert validity_period.end_date == date(2017, 7, 18)
 
 
 def test_calendar_dates_with_headers_only():
     file = _get_file_fixture_full_path('validity_period/calendar_dates_with_headers_only.zip')
     validity_period = ValidityPeriodFinder.select_computer_and_find(file)
-    assert validity_period.start_date == date(2017, 1, 2)
-    assert validity_period.end_date == date(2017, 1, 20)
+    assert validity_period.start_date == date(2017, 1, 3)
+    assert validity_period.end_date == date(2017, 1, 17)
 
 
 def test_calendar_with_headers_only():
@@ -198,8 +207,8 @@ def test_calendar_with_headers_only():
 def test_calendar_dates_with_empty_line():
     file = _get_file_fixture_full_path('validity_period/calendar_dates_with_empty_line.zip')
     validity_period = ValidityPeriodFinder.select_computer_and_find(file)
-    assert validity_period.start_date == date(2017, 1, 2)
-    assert validity_period.end_date == date(2017, 1, 20)
+    assert validity_period.start_date == date(2017, 1, 3)
+    assert validity_period.end_date == date(2017, 1, 17)
 
 
 def test_calendar_with_empty_line_and_remove_date_only():
@@ -325,3 +334,18 @@ def test_neptune_data_set(fixture, start_date, end_date):
     validity_period = ValidityPeriodFinder.select_computer_and_find(file, DATA_FORMAT_NEPTUNE)
     assert validity_period.start_date == start_date
     assert validity_period.end_date == end_date
+
+
+def test_calendar_with_edge_days_not_active():
+    """
+        calendar.txt   :     20170101 (sunday)           20170131 (tuesday)
+                                *--------------------------*    mondays and fridays
+        calendar_dates :
+                remove dates : 20170102 (monday)
+
+                production date : 20170106 (friday) to 20170130 (monday)
+    """
+    file = _get_file_fixture_full_path('validity_period/calendar_with_edge_days_not_active.zip')
+    validity_period = ValidityPeriodFinder.select_computer_and_find(file)
+    assert validity_period.start_date == date(2017, 1, 6)
+    assert validity_period.end_date == date(2017, 1, 30)
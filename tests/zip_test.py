@@ -0,0 +1,247 @@
+# Copyright (c) 2001-2016, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# IRC #navitia on freenode
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+from datetime import date
+from hashlib import md5, sha256
+import os
+import random
+import struct
+import tempfile
+from io import BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import mock
+import pytest
+
+from tartare import app
+from tartare.core.models import DataSet, ZipMember
+from tartare.core.zip import edit_file_in_zip_file_and_pack, create_zip_file, add_directory_in_zip_file
+from tartare.exceptions import InvalidFile
+from tests.utils import _get_file_fixture_full_path
+
+
+def append_line(file_path: str) -> None:
+    with open(file_path, 'a') as file:
+        file.write('trip_4,route_2\n')
+
+
+def write_agency(file_path: str) -> None:
+    with open(file_path, 'w') as file:
+        file.write('agency_id,agency_name\nagency_1,Agency\n')
+
+
+class TestEditFileInZipFileAndPack:
+    def create_zip(self, path: str) -> str:
+        zip_path = os.path.join(path, 'gtfs.zip')
+        with ZipFile(zip_path, 'w') as zip_file:
+            zip_file.writestr('stop_times.txt', 'trip_id,stop_id\n' + 'trip_1,stop_1\n' * 1000, ZIP_DEFLATED)
+            zip_file.writestr('trips.txt', 'trip_id,route_id\ntrip_1,route_1\n', ZIP_DEFLATED)
+            zip_file.writestr('stops.txt', 'stop_id\nstop_1\n', ZIP_STORED)
+        return zip_path
+
+    def get_local_extra_field_ids(self, zip_path: str, filename: str) -> list:
+        with ZipFile(zip_path) as zip_file, open(zip_path, 'rb') as file:
+            file.seek(zip_file.getinfo(filename).header_offset + 26)
+            name_length = int.from_bytes(file.read(2), 'little')
+            extra_length = int.from_bytes(file.read(2), 'little')
+            file.seek(name_length, os.SEEK_CUR)
+            extra = file.read(extra_length)
+        field_ids = []
+        while extra:
+            field_id, field_size = struct.unpack('<HH', extra[:4])
+            field_ids.append(field_id)
+            extra = extra[4 + field_size:]
+        return field_ids
+
+    def get_raw_member(self, zip_path: str, filename: str) -> bytes:
+        with ZipFile(zip_path) as zip_file, open(zip_path, 'rb') as file:
+            zip_info = zip_file.getinfo(filename)
+            file.seek(zip_info.header_offset + 26)
+            name_length = int.from_bytes(file.read(2), 'little')
+            extra_length = int.from_bytes(file.read(2), 'little')
+            file.seek(name_length + extra_length, os.SEEK_CUR)
+            return file.read(zip_info.compress_size)
+
+    def test_only_edited_member_is_rewritten(self):
+        with tempfile.TemporaryDirectory() as tmp_path, tempfile.TemporaryDirectory() as extract_path:
+            zip_path = self.create_zip(tmp_path)
+            new_zip_path = edit_file_in_zip_file_and_pack(zip_path, 'trips.txt', extract_path, tmp_path,
+                                                          callback=append_line)
+
+            assert new_zip_path == os.path.join(tmp_path, 'gtfs-processed.zip')
+            assert os.listdir(extract_path) == ['trips.txt']
+            with ZipFile(zip_path) as zip_file, ZipFile(new_zip_path) as new_zip_file:
+                assert new_zip_file.testzip() is None
+                assert new_zip_file.namelist() == ['stop_times.txt', 'trips.txt', 'stops.txt']
+                assert new_zip_file.read('trips.txt') == b'trip_id,route_id\ntrip_1,route_1\ntrip_4,route_2\n'
+                for filename in ['stop_times.txt', 'stops.txt']:
+                    assert new_zip_file.getinfo(filename).compress_type == zip_file.getinfo(filename).compress_type
+                    assert new_zip_file.getinfo(filename).CRC == zip_file.getinfo(filename).CRC
+                    assert new_zip_file.read(filename) == zip_file.read(filename)
+            for filename in ['stop_times.txt', 'stops.txt']:
+                assert self.get_raw_member(new_zip_path, filename) == self.get_raw_member(zip_path, filename)
+
+    def test_zip64_members_are_copied(self):
+        with tempfile.TemporaryDirectory() as tmp_path, tempfile.TemporaryDirectory() as extract_path:
+            # members bigger than the zip64 limit have zip64 extra fields in the source archive
+            with mock.patch('zipfile.ZIP64_LIMIT', 100):
+                zip_path = self.create_zip(tmp_path)
+                new_zip_path = edit_file_in_zip_file_and_pack(zip_path, 'trips.txt', extract_path, tmp_path,
+                                                              callback=append_line)
+            assert self.get_local_extra_field_ids(zip_path, 'stop_times.txt') == [1]
+            assert self.get_local_extra_field_ids(new_zip_path, 'stop_times.txt') == [1]
+            with ZipFile(zip_path) as zip_file, ZipFile(new_zip_path) as new_zip_file:
+                assert new_zip_file.testzip() is None
+                for filename in ['stop_times.txt', 'stops.txt']:
+                    assert new_zip_file.read(filename) == zip_file.read(filename)
+            assert self.get_raw_member(new_zip_path, 'stop_times.txt') == \
+                self.get_raw_member(zip_path, 'stop_times.txt')
+
+    def test_members_are_copied_without_zipfile_internals(self):
+        with tempfile.TemporaryDirectory() as tmp_path, tempfile.TemporaryDirectory() as extract_path:
+            zip_path = self.create_zip(tmp_path)
+            with mock.patch('tartare.core.zip.get_raw_zip_file', return_value=None):
+                new_zip_path = edit_file_in_zip_file_and_pack(zip_path, 'trips.txt', extract_path, tmp_path,
+                                                              callback=append_line)
+            with ZipFile(zip_path) as zip_file, ZipFile(new_zip_path) as new_zip_file:
+                assert new_zip_file.testzip() is None
+                assert new_zip_file.namelist() == ['stop_times.txt', 'trips.txt', 'stops.txt']
+                assert new_zip_file.read('trips.txt') == b'trip_id,route_id\ntrip_1,route_1\ntrip_4,route_2\n'
+                for filename in ['stop_times.txt', 'stops.txt']:
+                    assert new_zip_file.getinfo(filename).compress_type == zip_file.getinfo(filename).compress_type
+                    assert new_zip_file.read(filename) == zip_file.read(filename)
+
+    def test_missing_member_is_added(self):
+        with tempfile.TemporaryDirectory() as tmp_path, tempfile.TemporaryDirectory() as extract_path:
+            zip_path = self.create_zip(tmp_path)
+            with open(zip_path, 'rb') as zip_file:
+                new_zip_path = edit_file_in_zip_file_and_pack(zip_file, 'agency.txt', extract_path, tmp_path,
+                                                              callback=write_agency, computed_file_name='gtfs-agency')
+
+            with ZipFile(new_zip_path) as new_zip_file:
+                assert new_zip_file.testzip() is None
+                assert new_zip_file.namelist() == ['stop_times.txt', 'trips.txt', 'stops.txt', 'agency.txt']
+                assert new_zip_file.read('agency.txt') == b'agency_id,agency_name\nagency_1,Agency\n'
+
+    def test_invalid_zip_file(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            with pytest.raises(InvalidFile):
+                edit_file_in_zip_file_and_pack(os.path.join(tmp_path, 'unknown.zip'), 'trips.txt', tmp_path, tmp_path,
+                                               callback=append_line)
+
+
+class UnseekableStream(object):
+    def __init__(self):
+        self.stream = BytesIO()
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        pass
+
+
+@mock.patch.dict(app.config, {'ZIP_COMPRESSION_BLOCK_SIZE': 1, 'ZIP_COMPRESSION_THREADS': 3})
+class TestParallelCompression:
+    def create_files(self, path: str) -> dict:
+        random.seed(1)
+        contents = {
+            'stop_times.txt': ''.join('trip_{},stop_{},{}\n'.format(i // 20, random.randint(0, 500), i % 20)
+                                      for i in range(20000)).encode(),
+            'random.bin': bytes(random.getrandbits(8) for _ in range(5000)),
+            'empty.txt': b'',
+            os.path.join('sub', 'stops.txt'): b'stop_id\nstop_1\n',
+        }
+        os.mkdir(os.path.join(path, 'sub'))
+        for file_name, content in contents.items():
+            with open(os.path.join(path, file_name), 'wb') as file:
+                file.write(content)
+        return {file_name.replace(os.sep, '/'): content for file_name, content in contents.items()}
+
+    def check_archive(self, zip_file: ZipFile, contents: dict, compress_type: int) -> None:
+        assert zip_file.testzip() is None
+        assert sorted(zip_file.namelist()) == sorted(contents.keys())
+        for file_name, content in contents.items():
+            assert zip_file.getinfo(file_name).compress_type == compress_type
+            assert zip_file.read(file_name) == content
+
+    @pytest.mark.parametrize('compress_level', [1, 6, 9])
+    def test_create_zip_file_with_blocks_compressed_in_parallel(self, compress_level):
+        with tempfile.TemporaryDirectory() as from_dir, tempfile.TemporaryDirectory() as to_dir:
+            contents = self.create_files(from_dir)
+            zip_path = create_zip_file(from_dir, to_dir, 'gtfs', compress_level=compress_level)
+
+            assert zip_path == os.path.join(to_dir, 'gtfs.zip')
+            with ZipFile(zip_path) as zip_file:
+                self.check_archive(zip_file, contents, ZIP_DEFLATED)
+                # blocks compressed with the previous block as dictionary keep a good compression ratio
+                assert zip_file.getinfo('stop_times.txt').compress_size < len(contents['stop_times.txt']) / 3
+
+    def test_create_zip_file_stored(self):
+        with tempfile.TemporaryDirectory() as from_dir, tempfile.TemporaryDirectory() as to_dir:
+            contents = self.create_files(from_dir)
+            with mock.patch.dict(app.config, {'ZIP_COMPRESSION_LEVEL': 0}):
+                zip_path = create_zip_file(from_dir, to_dir)
+
+            with ZipFile(zip_path) as zip_file:
+                self.check_archive(zip_file, contents, ZIP_STORED)
+
+    def test_add_directory_in_unseekable_zip_file(self):
+        with tempfile.TemporaryDirectory() as from_dir:
+            contents = self.create_files(from_dir)
+            stream = UnseekableStream()
+            with ZipFile(stream, 'w') as zip_out:
+                add_directory_in_zip_file(zip_out, from_dir)
+
+            with ZipFile(BytesIO(stream.stream.getvalue())) as zip_file:
+                self.check_archive(zip_file, contents, ZIP_DEFLATED)
+
+
+class TestZipMembers:
+    def test_file_names(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'gtfs.zip')
+        with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('stops.txt', 'stop_id\nstop_1\n')
+            zip_file.writestr('trips.txt', 'trip_id\ntrip_1\n')
+        data_set = DataSet(zip_members=ZipMember.list_from_zip_file(zip_path))
+        assert data_set.get_file_names() == ['stops.txt', 'trips.txt']
+        assert [member.file_size for member in data_set.zip_members] == [15, 15]
+        assert DataSet().get_file_names() is None
+
+    def test_too_many_members_are_not_indexed(self, tmpdir):
+        zip_path = os.path.join(str(tmpdir), 'osm.zip')
+        with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zip_file:
+            for index in range(4):
+                zip_file.writestr('file_{}.txt'.format(index), 'content')
+        with mock.patch.dict(app.config, {'DATA_SET_MAX_INDEXED_ZIP_MEMBERS': 3}):
+            assert ZipMember.list_from_zip_file(zip_path) is None
+        with mock.patch.dict(app.config, {'DATA_SET_MAX_INDEXED_ZIP_MEMBERS': 4}):
+            assert len(ZipMember.list_from_zip_file(zip_path)) == 4
+
+    def test_not_a_zip_file(self):
+        assert ZipMember.list_from_zip_file(_get_file_fixture_full_path('gtfs/not_a_zip_file.zip')) is None